@@ -0,0 +1,152 @@
+# app_logging.py
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Application logging. Records go from the request path into a bounded in-memory queue
+# (QueueHandler, never blocks: when the queue is full the record is dropped and counted)
+# and are formatted and written to stdout by a background thread (QueueListener).
+#
+#   LOG_LEVEL        DEBUG / INFO (default) / WARNING / ...
+#   LOG_FORMAT       json (default) or text
+#   LOG_QUEUE_SIZE   max records waiting for the writer thread (default 10000)
+#   LOG_SAMPLE_RATE  share of high-volume lines kept (default 0.1), see sampled()
+#
+# Use %-style arguments (log.debug("found %d slots", n)) so disabled levels skip the
+# formatting, and pass structured fields with extra={...}; they become JSON keys.
+# Do not log message text, replies, or full rows: they carry patient data.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+LOGGING_STATS = {
+    "queued": 0,
+    "dropped": 0,
+    "sampled_out": 0,
+}
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: QueueListener | None = None
+
+
+def sampled(rate: float = LOG_SAMPLE_RATE, **fields) -> dict:
+    """
+    extra= for a high-volume line: only `rate` of the records are kept.
+    """
+    return {**fields, "sample_rate": rate}
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        if rate is not None and rate < 1.0 and random.random() >= rate:
+            LOGGING_STATS["sampled_out"] += 1
+            return False
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve the message here; JSON encoding happens on the writer thread
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            LOGGING_STATS["queued"] += 1
+        except queue.Full:
+            LOGGING_STATS["dropped"] += 1
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room instead of failing when stop() is called with a full queue
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+def setup_logging() -> None:
+    """
+    Install the queue handler on the "app" logger and start the writer thread (idempotent).
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger("app")
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+    _listener = DrainingQueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Write out whatever is still queued and stop the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"app.{name}")
+
+
+def get_logging_stats() -> dict:
+    return {**LOGGING_STATS, "level": LOG_LEVEL}
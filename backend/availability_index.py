@@ -0,0 +1,380 @@
+# availability_index.py
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Awaitable, Callable
+
+from app_logging import get_logger
+from slot_filter import as_array, match_positions
+from time_utils import iso_to_timestamp
+
+
+# In-process copy of each doctor's time segments (start/end, status) over a rolling horizon,
+# so availability questions are answered with a bisect over sorted arrays instead of a
+# PostgREST round trip. The write paths in supabase_utils (book / cancel / event / reactivate)
+# patch the affected segment in place, and a periodic reload picks up changes made elsewhere
+# (other workers, shift regeneration). Bookings still go through the atomic RPCs, so a stale
+# entry can at worst offer a slot that was just taken, never double-book it.
+#
+# Slot holds (slots offered to one patient, see hold_slots) are kept per doctor as a small
+# position → (patient_id, held_until) map. Open-slot queries skip slots held for someone
+# else until the hold expires; the segment status itself stays 0.
+#
+# The refresh loop only reloads doctors read within AVAILABILITY_INDEX_IDLE_TTL and drops the
+# rest; a later read loads them again. A reload runs through the same in-flight task as a
+# read, and local writes made while it runs are replayed onto the new snapshot, so a load
+# that started before a booking cannot bring back the slot as open.
+
+# A little past the 60-day search horizon, so "earliest" searches stay inside an index loaded a while ago
+AVAILABILITY_INDEX_HORIZON_DAYS = int(os.getenv("AVAILABILITY_INDEX_HORIZON_DAYS", "62"))
+AVAILABILITY_INDEX_MAX_AGE = float(os.getenv("AVAILABILITY_INDEX_MAX_AGE", "300"))
+AVAILABILITY_INDEX_REFRESH_INTERVAL = float(os.getenv("AVAILABILITY_INDEX_REFRESH_INTERVAL", "60"))
+AVAILABILITY_INDEX_IDLE_TTL = float(os.getenv("AVAILABILITY_INDEX_IDLE_TTL", "900"))
+
+log = get_logger("availability_index")
+
+# Status value used only inside the index for a slot held for another patient
+SEGMENT_HELD = 2
+
+INDEX_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "loads": 0,
+    "fallbacks": 0,
+    "evictions": 0,
+}
+
+
+@dataclass
+class DoctorSegments:
+    """
+    One doctor's segments in [window_start, window_end), as parallel arrays sorted by start time.
+    """
+    doctor_id: int
+    window_start: float                                   # epoch seconds
+    window_end: float
+    starts: list[float] = field(default_factory=list)
+    ends: list[float] = field(default_factory=list)
+    ids: list[int] = field(default_factory=list)
+    statuses: list[int] = field(default_factory=list)
+    start_iso: list[str] = field(default_factory=list)    # original strings, returned as-is
+    end_iso: list[str] = field(default_factory=list)
+    positions: dict[int, int] = field(default_factory=dict)
+    start_array: object = None                            # starts / statuses for slot_filter (NumPy when available)
+    status_array: object = None
+    holds: dict[int, tuple[int, float]] = field(default_factory=dict)  # position → (patient_id, held_until epoch)
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_rows(cls, doctor_id: int, window_start: float, window_end: float, rows: list[dict]) -> "DoctorSegments":
+        doc = cls(doctor_id, window_start, window_end)
+        parsed = sorted(
+            ((iso_to_timestamp(r["start_time"]), r) for r in rows),
+            key=lambda item: item[0]
+        )
+        for pos, (start_ts, r) in enumerate(parsed):
+            doc.starts.append(start_ts)
+            doc.ends.append(iso_to_timestamp(r["end_time"]))
+            doc.ids.append(r["id"])
+            doc.statuses.append(r["status"])
+            doc.start_iso.append(r["start_time"])
+            doc.end_iso.append(r["end_time"])
+            doc.positions[r["id"]] = pos
+            if r.get("held_by") is not None and r.get("held_until"):
+                doc.holds[pos] = (r["held_by"], iso_to_timestamp(r["held_until"]))
+        doc.start_array = as_array(doc.starts, "float64")
+        doc.status_array = as_array(doc.statuses, "int8")
+        return doc
+
+    def covers(self, start_ts: float, end_ts: float) -> bool:
+        return self.window_start <= start_ts and end_ts <= self.window_end
+
+    def span(self, start_ts: float, end_ts: float) -> range:
+        return range(bisect_left(self.starts, start_ts), bisect_left(self.starts, end_ts))
+
+    def visible_statuses(self, lo: int, hi: int, patient_id: int | None):
+        """
+        status_array[lo:hi], with slots held for anyone but patient_id marked SEGMENT_HELD.
+        """
+        statuses = self.status_array[lo:hi]
+        if not self.holds:
+            return statuses
+        now = time.time()
+        held = [pos - lo for pos, (holder, until) in self.holds.items()
+                if lo <= pos < hi and holder != patient_id and until > now]
+        if not held:
+            return statuses
+        statuses = statuses.copy() if hasattr(statuses, "copy") else list(statuses)
+        for pos in held:
+            statuses[pos] = SEGMENT_HELD
+        return statuses
+
+    def set_status(self, segment_id: int, status: int) -> None:
+        pos = self.positions.get(segment_id)
+        if pos is not None:
+            self.statuses[pos] = status
+            self.status_array[pos] = status
+            if status != 0:
+                self.holds.pop(pos, None)
+
+    def hold(self, segment_id: int, patient_id: int, until: float) -> None:
+        pos = self.positions.get(segment_id)
+        if pos is not None:
+            self.holds[pos] = (patient_id, until)
+
+    def release_holds(self, patient_id: int, now: float) -> None:
+        for pos in [p for p, (holder, until) in self.holds.items() if holder == patient_id or until <= now]:
+            del self.holds[pos]
+
+    def row(self, pos: int, tz: tzinfo | None = None) -> dict:
+        start_dt = datetime.fromtimestamp(self.starts[pos], tz or timezone.utc)
+        return {
+            "segment_id": self.ids[pos],
+            "doctor_id": self.doctor_id,
+            "start_time": self.start_iso[pos],
+            "end_time": self.end_iso[pos],
+            "status": self.statuses[pos],
+            "start_dt": start_dt,
+            "local_day": start_dt.date().isoformat(),
+        }
+
+
+class AvailabilityIndex:
+    """
+    Per-doctor segment index, loaded lazily on first use through `loader`
+    (doctor_id, window_start, window_end) → rows {id, start_time, end_time, status}.
+    Query methods return None when the requested window is outside the indexed
+    horizon or the load failed; callers then fall back to the database.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int, datetime, datetime], Awaitable[list[dict]]],
+        horizon_days: int = AVAILABILITY_INDEX_HORIZON_DAYS,
+        max_age: float = AVAILABILITY_INDEX_MAX_AGE,
+        idle_ttl: float = AVAILABILITY_INDEX_IDLE_TTL
+    ):
+        self._loader = loader
+        self.horizon_days = horizon_days
+        self.max_age = max_age
+        self.idle_ttl = idle_ttl
+        self._doctors: dict[int, DoctorSegments] = {}
+        self._segment_doctor: dict[int, int] = {}
+        self._inflight: dict[int, asyncio.Task] = {}
+        self._last_read: dict[int, float] = {}
+        # Doctor id → local writes made while that doctor's load is in flight
+        self._pending: dict[int, list[Callable[[DoctorSegments], None]]] = {}
+
+    async def get(self, doctor_id: int) -> DoctorSegments | None:
+        now = time.monotonic()
+        self._last_read[doctor_id] = now
+        doc = self._doctors.get(doctor_id)
+        if doc is not None and now - doc.loaded_at < self.max_age:
+            INDEX_STATS["hits"] += 1
+            return doc
+
+        INDEX_STATS["misses"] += 1
+        try:
+            return await self._start_load(doctor_id)
+        except Exception as e:
+            log.error("Load failed for doctor %s: %s", doctor_id, e)
+            return None
+
+    def _start_load(self, doctor_id: int) -> asyncio.Task:
+        """
+        The doctor's in-flight load, started if there is none, so reads and refreshes share it.
+        """
+        task = self._inflight.get(doctor_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(doctor_id))
+            self._inflight[doctor_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(doctor_id, None))
+        return task
+
+    async def _load(self, doctor_id: int) -> DoctorSegments:
+        now = datetime.now(timezone.utc)
+        # Keep the current day in the window so "today" queries stay indexed
+        window_start = now - timedelta(days=1)
+        window_end = now + timedelta(days=self.horizon_days)
+        self._pending[doctor_id] = []
+        try:
+            rows = await self._loader(doctor_id, window_start, window_end)
+        finally:
+            pending = self._pending.pop(doctor_id, [])
+        INDEX_STATS["loads"] += 1
+
+        doc = DoctorSegments.from_rows(doctor_id, window_start.timestamp(), window_end.timestamp(), rows)
+        # The rows may have been read before these writes committed
+        for apply in pending:
+            apply(doc)
+        old = self._doctors.get(doctor_id)
+        if old is not None:
+            for segment_id in old.ids:
+                self._segment_doctor.pop(segment_id, None)
+        for segment_id in doc.ids:
+            self._segment_doctor[segment_id] = doctor_id
+        self._doctors[doctor_id] = doc
+        return doc
+
+    async def free_slots(
+        self,
+        doctor_id: int,
+        start: datetime,
+        end: datetime,
+        time_pref: str | None = None,
+        tz: tzinfo | None = None,
+        limit: int | None = None,
+        patient_id: int | None = None
+    ) -> list[dict] | None:
+        """
+        Open (status 0) segments starting in [start, end), earliest first, optionally
+        restricted to a time of day ("morning" / "afternoon" / "evening") in tz.
+        Slots held for a patient other than patient_id are left out.
+        """
+        return await self.segments(
+            doctor_id, start, end, statuses=(0,), time_pref=time_pref, tz=tz, limit=limit, patient_id=patient_id
+        )
+
+    async def segments(
+        self,
+        doctor_id: int,
+        start: datetime,
+        end: datetime,
+        statuses: tuple[int, ...] | None = None,
+        time_pref: str | None = None,
+        tz: tzinfo | None = None,
+        limit: int | None = None,
+        patient_id: int | None = None
+    ) -> list[dict] | None:
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        doc = await self.get(doctor_id)
+        if doc is None or not doc.covers(start_ts, end_ts):
+            INDEX_STATS["fallbacks"] += 1
+            return None
+
+        tz = tz or timezone.utc
+        span = doc.span(start_ts, end_ts)
+        lo, hi = span.start, span.stop
+        # Filter and rank on the epoch arrays; rows are built only for the matches returned
+        # Holds only narrow status-filtered queries; a full listing shows every segment
+        status_slice = doc.visible_statuses(lo, hi, patient_id) if statuses is not None else doc.status_array[lo:hi]
+        positions = match_positions(
+            doc.start_array[lo:hi], tz, time_pref,
+            statuses=status_slice, wanted=statuses, limit=limit
+        )
+        return [doc.row(lo + pos, tz) for pos in positions]
+
+    def covers(self, doctor_id: int, start: datetime, end: datetime) -> bool:
+        doc = self._doctors.get(doctor_id)
+        return doc is not None and doc.covers(start.timestamp(), end.timestamp())
+
+    def set_status(self, segment_id: int, status: int) -> None:
+        """
+        Apply a status change made by one of the write RPCs. Unknown segments are ignored:
+        their doctor is not indexed, or the segment is outside the horizon.
+        """
+        doc, pos = self._locate(segment_id)
+        if pos is not None:
+            doc.set_status(segment_id, status)
+            self._record(doc.doctor_id, lambda d: d.set_status(segment_id, status))
+
+    def _record(self, doctor_id: int, apply: Callable[[DoctorSegments], None]) -> None:
+        """
+        Keep a local write for replay if the doctor is being reloaded.
+        """
+        pending = self._pending.get(doctor_id)
+        if pending is not None:
+            pending.append(apply)
+
+    def _locate(self, segment_id: int) -> tuple[DoctorSegments | None, int | None]:
+        """
+        (doctor's segments, position) of segment_id; position is None if it is not indexed.
+        """
+        doctor_id = self._segment_doctor.get(segment_id)
+        doc = self._doctors.get(doctor_id) if doctor_id is not None else None
+        return doc, (doc.positions.get(segment_id) if doc is not None else None)
+
+    def set_holds(self, segment_ids: list[int], patient_id: int, until: float) -> None:
+        """
+        Record the holds placed by hold_segments (until: epoch seconds), replacing the patient's earlier ones.
+        """
+        self.release_holds(patient_id)
+        for segment_id in segment_ids:
+            doc, pos = self._locate(segment_id)
+            if pos is not None:
+                doc.hold(segment_id, patient_id, until)
+                self._record(doc.doctor_id, lambda d, s=segment_id: d.hold(s, patient_id, until))
+
+    def release_holds(self, patient_id: int) -> None:
+        """
+        Drop the patient's holds, and any expired ones on the way.
+        """
+        now = time.time()
+        for doc in self._doctors.values():
+            doc.release_holds(patient_id, now)
+        for pending in self._pending.values():
+            pending.append(lambda d: d.release_holds(patient_id, now))
+
+    def invalidate_segment(self, segment_id: int) -> None:
+        """
+        Drop the index of the doctor owning segment_id, if it is indexed.
+        """
+        doctor_id = self._segment_doctor.get(segment_id)
+        if doctor_id is not None:
+            self.invalidate(doctor_id)
+
+    def invalidate(self, doctor_id: int | None = None) -> None:
+        """
+        Drop one doctor's index (or all of them); the next read reloads it.
+        """
+        doctor_ids = [doctor_id] if doctor_id is not None else list(self._doctors)
+        for d in doctor_ids:
+            self._last_read.pop(d, None)
+            doc = self._doctors.pop(d, None)
+            if doc is not None:
+                for segment_id in doc.ids:
+                    self._segment_doctor.pop(segment_id, None)
+
+    async def refresh(self) -> None:
+        """
+        Reload the doctors read within idle_ttl (moves the horizon forward and picks up
+        external writes) and drop the others.
+        """
+        now = time.monotonic()
+        for doctor_id in list(self._doctors):
+            if now - self._last_read.get(doctor_id, 0.0) > self.idle_ttl:
+                self.invalidate(doctor_id)
+                INDEX_STATS["evictions"] += 1
+                continue
+            try:
+                await self._start_load(doctor_id)
+            except Exception as e:
+                log.error("Refresh failed for doctor %s: %s", doctor_id, e)
+
+    async def run_refresh_loop(self, interval: float = AVAILABILITY_INDEX_REFRESH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh()
+
+
+def local_day_bounds(day: date, days: int, tz: tzinfo) -> tuple[datetime, datetime]:
+    """
+    UTC instants covering local calendar days [day, day + days) in tz.
+    """
+    start = datetime.combine(day, datetime.min.time(), tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=days), datetime.min.time(), tzinfo=tz)
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+
+def get_availability_index_stats(index: AvailabilityIndex) -> dict:
+    lookups = INDEX_STATS["hits"] + INDEX_STATS["misses"]
+    return {
+        **INDEX_STATS,
+        "hit_rate": round(INDEX_STATS["hits"] / lookups, 4) if lookups else 0.0,
+        "doctors": len(index._doctors),
+        "segments": len(index._segment_doctor),
+        "holds": sum(len(doc.holds) for doc in index._doctors.values()),
+    }
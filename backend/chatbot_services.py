@@ -1,11 +1,15 @@
 #chatbot_services.py
-from datetime import datetime, timezone, timedelta
-from dateutil import parser
-from dateutil.parser import parse as parse_date
-from llm_client import call_llm_json, call_llm
-import pytz
-from zoneinfo import ZoneInfo
+from datetime import datetime, timezone, timedelta, tzinfo
+from llm_client import call_llm_json, call_llm, call_llm_stream
+from intent_rules import classify_intent_fast
+from intent_cache import intent_cache_key, get_cached_intent, store_intent
+from metrics import timed, set_trace_labels
+from app_logging import get_logger, sampled
+from time_utils import parse_iso, parse_day, get_timezone, format_local, format_local_many
+from slot_filter import filter_rows, time_window
+from availability_index import local_day_bounds
 import random
+import asyncio
 
 from supabase_utils import (
     get_doctor_appointments,
@@ -14,27 +18,32 @@ from supabase_utils import (
     cancel_appointment,
     reactivate_time_segment,
     book_slot,
+    book_series,
     create_doctor_event,
     cancel_event,
+    block_time_range,
+    reactivate_time_range,
     get_memory_history,
-    get_available_segments,
-    get_family_doctor,
+    search_availability,
+    get_family_doctor_brief,
+    get_doctor_segments,
+    get_open_segments,
     save_slot_mapping,
-    get_family_doctor_id,
+    hold_slots,
+    SLOT_HOLD_TTL,
     get_session_task,
     update_task_state,
     find_matching_appointments,
-    slot_matches_time_with_tz,
-    find_matching_events
+    find_matching_events,
+    get_user_context,
+    get_slot_mapping
 )
 
+log = get_logger("chatbot")
 
-def get_user_tz(context: dict) -> ZoneInfo:
-    tz_str = context.get("timezone", "UTC")
-    try:
-        return ZoneInfo(tz_str)
-    except Exception:
-        return ZoneInfo("UTC") 
+
+def get_user_tz(context: dict) -> tzinfo:
+    return get_timezone(context.get("timezone", "UTC"))
 
 
 def is_exact_time_string(s: str) -> bool:
@@ -45,7 +54,39 @@ def is_exact_time_string(s: str) -> bool:
         return False
 
 
-def run_llm_extract_intent(
+@timed("chat")
+async def prefetch_turn_context(session_id: str, user: dict, history_limit: int = 6) -> dict:
+    """
+    Run the independent per-turn reads concurrently, once, before the first LLM call.
+    Returns the user profile (cached / from token claims), history, current task_id and slot mapping.
+    """
+    db_user, history, task_id, slot_mapping = await asyncio.gather(
+        get_user_context(user),
+        get_memory_history(session_id, limit=history_limit),
+        get_session_task(session_id),
+        get_slot_mapping(session_id),
+    )
+    return {
+        "db_user": db_user,
+        "history": history,
+        "task_id": task_id,
+        "slot_mapping": slot_mapping,
+    }
+
+
+async def set_session_task(context: dict, task_id: str | None):
+    """
+    Persist the session task state and keep context["task_id"] in sync,
+    so later stages of the same turn don't need to read it back.
+    """
+    context["task_id"] = task_id
+    session_id = context.get("session_id")
+    if session_id:
+        await update_task_state(session_id, task_id)
+
+
+@timed("chat")
+async def run_llm_extract_intent(
     message: str,
     session_id: str,
     user: dict,
@@ -57,9 +98,29 @@ def run_llm_extract_intent(
     user_tz = get_user_tz(context)
     today_iso = datetime.now().strftime("%Y-%m-%d")
     user_role = user["role"]
-    task_id = get_session_task(session_id)
-    
-    history = history_override if history_override is not None else get_memory_history(session_id, limit=6)
+    if context is not None and "task_id" in context:
+        task_id = context["task_id"]
+    else:
+        task_id = await get_session_task(session_id)
+
+    # Trivial turns (slot number, "cancel my next appointment", "hi"...) skip the LLM
+    fast = classify_intent_fast(message, user_role, task_id, (context or {}).get("slot_mapping"))
+    if fast:
+        log.info("Fast path intent %s", fast["action"], extra=sampled())
+        return fast, ""
+
+    # Repeated utterances with the same role, day, timezone and task reuse the previous intent
+    cache_key = None
+    if system_prompt is None:
+        cache_key = intent_cache_key(
+            message, user_role, today_iso, str(user_tz), task_id, bool((context or {}).get("slot_mapping"))
+        )
+        cached = get_cached_intent(cache_key)
+        if cached:
+            log.info("Intent cache hit %s", cached.get("action"), extra=sampled())
+            return cached, ""
+
+    history = history_override if history_override is not None else await get_memory_history(session_id, limit=6)
 
     if system_prompt is None:
         system_prompt = f"""
@@ -128,6 +189,24 @@ def run_llm_extract_intent(
         i. general_chat
         → {{ type: intro | help | empty }} ← e.g., when user says what can you do, thanks, etc.
 
+        j. book_series
+        → args: {{ weekday, preferred_time, occurrences, interval_weeks, start_date, description }}
+        - Recurring appointments, e.g. "every Tuesday at 10 for 6 weeks":
+        {{ "weekday": "tuesday", "preferred_time": "10:00", "occurrences": 6, "interval_weeks": 1, "start_date": "" }}
+        - "every other week" → interval_weeks: 2; start_date (YYYY-MM-DD) only if the user gave a first date
+        - Leave fields empty when the user didn't say; the system will ask.
+
+        k. block_time_range   (doctors: block many slots at once)
+        → args: {{ start_date, end_date, start_time, end_time, time_pref, description }}
+        - "block all of Friday afternoon" → start_date = end_date = <Friday>, time_pref: "afternoon"
+        - "I'm off next week" → start_date: <Monday of next week>, end_date: <Sunday of next week>, time_pref: ""
+        - "block Friday 14:00 to Monday 09:00" → start_time: "14:00", end_time: "09:00"
+        - Use create_event instead when the doctor means one single slot.
+
+        l. reactivate_time_range   (doctors: reopen many blocked slots at once)
+        → args: {{ start_date, end_date, start_time, end_time, time_pref }}  ← same rules as block_time_range
+        - Use reactivate_time_segment instead when the doctor means one single slot.
+
         ---
 
         --- TIME & DATE ARGUMENTS (Unified Rule) ---
@@ -166,6 +245,9 @@ def run_llm_extract_intent(
         User: "Schedule an event for July 25 in the afternoon"
         → {{ 'action': 'create_event', 'arguments': {{ 'preferred_date': '2025-07-25', 'preferred_time': 'afternoon', 'description': '' }} }}
 
+        User: "Book me every Tuesday at 10 for 6 weeks"
+        → {{ 'action': 'book_series', 'arguments': {{ 'weekday': 'tuesday', 'preferred_time': '10:00', 'occurrences': 6, 'interval_weeks': 1, 'start_date': '', 'description': '' }} }}
+
         User: "Help"
         → {{ 'action': 'general_chat', 'arguments': {{ 'type': 'help' }} }}
 
@@ -189,26 +271,24 @@ def run_llm_extract_intent(
         """
 
     llm_input = history + [{"role": "user", "content": message}]
-    result = call_llm_json(messages=llm_input, system_prompt=system_prompt)
-    # print("RAW LLM INTENT CALL RESULT:", result)
-    # print("RAW TOOL CALL EXTRACT:", json.dumps(result, indent=2))
+    result = await call_llm_json(messages=llm_input, system_prompt=system_prompt)
+    store_intent(cache_key, result)
     return result, ""
 
 
-def run_llm_natural_reply(
+async def build_natural_reply_input(
     message: str,
     session_id: str,
     user: dict,
-    context: dict | None = None,
     system_prompt: str | None = None,
     history_override: list[dict] | None = None
-):
+) -> tuple[str, list[dict]]:
 
     #user_tz = get_user_tz(context)
     #today_iso = datetime.now().strftime("%Y-%m-%d")
     user_role = user["role"]
 
-    history = history_override if history_override is not None else get_memory_history(session_id, limit=6)
+    history = history_override if history_override is not None else await get_memory_history(session_id, limit=6)
 
     if system_prompt is None:
         system_prompt = f"""
@@ -227,7 +307,37 @@ def run_llm_natural_reply(
         """
 
     llm_input = history + [{"role": "user", "content": message}]
-    return call_llm(messages=llm_input, system_prompt=system_prompt)
+    return system_prompt, llm_input
+
+
+@timed("chat")
+async def run_llm_natural_reply(
+    message: str,
+    session_id: str,
+    user: dict,
+    context: dict | None = None,
+    system_prompt: str | None = None,
+    history_override: list[dict] | None = None
+):
+    system_prompt, llm_input = await build_natural_reply_input(message, session_id, user, system_prompt, history_override)
+    return await call_llm(messages=llm_input, system_prompt=system_prompt)
+
+
+@timed("chat")
+async def run_llm_natural_reply_stream(
+    message: str,
+    session_id: str,
+    user: dict,
+    context: dict | None = None,
+    system_prompt: str | None = None,
+    history_override: list[dict] | None = None
+):
+    """
+    Streaming variant of run_llm_natural_reply: yields reply chunks as they arrive.
+    """
+    system_prompt, llm_input = await build_natural_reply_input(message, session_id, user, system_prompt, history_override)
+    async for chunk in call_llm_stream(messages=llm_input, system_prompt=system_prompt):
+        yield chunk
 
 
 def build_search_explanation(preferred_date, preferred_time, days_ahead, user_tz, input_mode):
@@ -245,7 +355,7 @@ def build_search_explanation(preferred_date, preferred_time, days_ahead, user_tz
     if preferred_date:
         # preferred_date is in format of YYYY-MM-DD
         try:
-            local_dt = parser.parse(preferred_date).astimezone(user_tz)
+            local_dt = parse_iso(preferred_date).astimezone(user_tz)
             date_str = local_dt.strftime("%Y-%m-%d")
         except Exception:
             date_str = preferred_date
@@ -265,13 +375,46 @@ def build_search_explanation(preferred_date, preferred_time, days_ahead, user_tz
 
 
 
+#######################
+###Response rendering###
+#######################
+
+# Replies rendered from the handler result; placeholders are keys of the result dict
+REPLY_TEMPLATES = {
+    "appointment_cancelled": "Your appointment on {cancelled_local_time} has been cancelled.",
+}
+
+
+def render_final_reply(routed_response) -> str | None:
+    """
+    Returns the user-ready reply when the handler marked it final ("final": True)
+    or asked for a template ("reply_template"). None means the reply still needs
+    the second LLM round.
+    """
+    if not isinstance(routed_response, dict):
+        return None
+
+    template = REPLY_TEMPLATES.get(routed_response.get("reply_template"))
+    if template:
+        try:
+            return template.format_map(routed_response)
+        except (KeyError, ValueError) as e:
+            log.error("Reply template %s failed: %s", routed_response.get("reply_template"), e)
+            return None
+
+    if routed_response.get("final") and routed_response.get("reply"):
+        return routed_response["reply"]
+    return None
+
+
 #######################
 ###Prompted Actions####
 #######################
 
-def handle_book_appointment(args, user, context: dict):
-    print(f"[DEBUG] context passed in: {context}")
-    print("[DEBUG] Booking args received by handle_book_appointment:", args)
+@timed("handler")
+async def handle_book_appointment(args, user, context: dict):
+    log.debug("Booking in session %s", context.get("session_id"))
+    log.debug("Booking args: %s", sorted(args))
 
     patient_id = user["id"]
     session_id = context.get("session_id")
@@ -295,39 +438,34 @@ def handle_book_appointment(args, user, context: dict):
             slot_index = int(slot_index)
             mapping = context.get("slot_mapping") or {}
             time_segment_id = mapping.get(slot_index)
-            print(f"[DEBUG] Resolved slot_index={slot_index} → segment_id={time_segment_id}")
+            log.debug("Resolved slot_index=%s → segment_id=%s", slot_index, time_segment_id)
             if not time_segment_id:
-                return {"reply": f"I couldn't find slot {slot_index}. Please try again.", "available_slots": []}
+                return {"reply": f"I couldn't find slot {slot_index}. Please try again.", "available_slots": [], "final": True}
 
-            appt = book_slot(patient_id, time_segment_id, description)
-            print(f"[DEBUG] Booking succeeded: {appt}")
+            appt = await book_slot(patient_id, time_segment_id, description)
+            log.debug("Booking succeeded: appointment_id=%s", appt.get("appointment_id"))
 
-            doc_info = get_family_doctor(patient_id)
+            doc_info = await get_family_doctor_brief(patient_id) or {}
             fname = doc_info.get("fname", "").strip()
             lname = doc_info.get("lname", "").strip()
             doc_name = f"Dr. {fname} {lname}".strip() if fname or lname else "your doctor"
 
-            local_time = parser.parse(appt["appointment_time"]).astimezone(user_tz).strftime("%Y-%m-%d at %H:%M %Z")
+            local_time = format_local(appt["appointment_time"], user_tz, "%Y-%m-%d at %H:%M %Z")
 
-            if session_id:
-                update_task_state(session_id, None)
+            await set_session_task(context, None)
 
             return {
                 "reply": f"Your appointment with {doc_name} has been successfully booked for {local_time}.",
-                "appointment": appt
+                "appointment": appt,
+                "final": True
             }
 
         except Exception as e:
-            print(f"[ERROR] Booking failed: {str(e)}")
-            return {"reply": "That time slot has just been taken. Please choose another.", "available_slots": []}
-
-    # Step 2: Search by preferred date/time with fallbacks
-    slots = []
-    doc_info = get_family_doctor(patient_id)
-    fname = doc_info.get("fname", "").strip()
-    lname = doc_info.get("lname", "").strip()
-    doc_name = f"Dr. {fname} {lname}".strip() if fname or lname else "your doctor"
+            log.error("Booking failed: %s", e)
+            return {"reply": "That time slot has just been taken. Please choose another.", "available_slots": [], "final": True}
 
+    # Step 2: Search by preferred date/time with fallbacks.
+    # Preferred day(s), nearest later day and global earliest all come back from one query.
     explanation = build_search_explanation(preferred_date, preferred_time, days_ahead, user_tz, input_mode)
 
     unavailable_notice = ""
@@ -335,59 +473,58 @@ def handle_book_appointment(args, user, context: dict):
 
     # Allow preferred_date to be empty but search even when preferred_time/skylight exists
     if (preferred_date is not None) or preferred_time or days_ahead:
-        # 2a: Preferred search (respects preferred_date, if empty, uses get_available_segments to search the earliest available segment in the world + days_ahead window)
-        slots = get_available_segments(
+        search = await search_availability(
+            patient_id=patient_id,
             preferred_date=preferred_date or None,
             preferred_time=preferred_time,
+            window_days=days_ahead,
+            later_days=days_ahead if days_ahead > 0 else 5,
             topn=5,
-            user=user,
-            days_ahead=days_ahead
+            tz_name=context.get("timezone") or "UTC"
         )
 
+        doc_info = search["doctor"] or {}
+        fname = doc_info.get("fname", "").strip()
+        lname = doc_info.get("lname", "").strip()
+        doc_name = f"Dr. {fname} {lname}".strip() if fname or lname else "your doctor"
+
+        # 2a: Preferred search (if preferred_date is empty, the earliest slots are used below)
+        slots = search["preferred"]
+
         # 2b: If a specific date is given but there is no number on that day → give alternatives for the next few days
-        if preferred_date and not any(s["start_time"].startswith(preferred_date) for s in slots):
+        if preferred_date and not any(s["local_day"] == preferred_date for s in slots):
             unavailable_notice = f"Unfortunately, {doc_name} has no available slots on {preferred_date}. "
-            try:
-                dt = parser.parse(preferred_date)
-                days_to_check = days_ahead if days_ahead > 0 else 5
-                week_dates = [
-                    (dt + timedelta(days=i)).strftime("%Y-%m-%d")
-                    for i in range(1, days_to_check + 1)
-                ]
-                for date in week_dates:
-                    wk_slots = get_available_segments(
-                        preferred_date=date,
-                        preferred_time=preferred_time,
-                        topn=5,
-                        user=user,
-                        days_ahead=days_to_check
-                    )
-                    if wk_slots:
-                        fallback_notice = "Here are some options later next week: "
-                        slots = wk_slots
-                        print(f"[DEBUG] wk_slots found on {date}: {wk_slots}")
-                        break
-            except Exception as e:
-                print(f"[FALLBACK ERROR] Failed to search future days: {e}")
+            if search["later"]:
+                fallback_notice = "Here are some options later next week: "
+                slots = search["later"]
 
         # 2c: If not → give the global earliest
         if not slots:
-            slots = get_available_segments(
-                preferred_time=preferred_time,
-                topn=5,
-                user=user
-            )
+            slots = search["earliest"]
             if slots:
                 fallback_notice = "Here are the earliest options I could find: "
 
+        held = None
+        if slots and session_id:
+            # Hold the offered slots for this patient until they pick one and drop any that another
+            # patient got to first. None means the hold itself failed: offer the slots unheld.
+            held = await hold_slots(patient_id, [s["id"] for s in slots])
+            if held is not None:
+                slots = [s for s in slots if s["id"] in held]
+                if not slots:
+                    return {
+                        "reply": "The times I found were just taken by other patients. "
+                                 "Please ask again and I'll look for new ones.",
+                        "available_slots": [],
+                        "final": True
+                    }
+
         if slots:
             for idx, s in enumerate(slots):
                 s["index"] = idx + 1
 
-            lines = [
-                f"{s['index']}. {parser.parse(s['start_time']).astimezone(user_tz).strftime('%Y-%m-%d %H:%M %Z')}"
-                for s in slots
-            ]
+            local_times = format_local_many((s["start_time"] for s in slots), user_tz, "%Y-%m-%d %H:%M %Z")
+            lines = [f"{s['index']}. {local_time}" for s, local_time in zip(slots, local_times)]
 
             
             reply_parts = []
@@ -399,52 +536,155 @@ def handle_book_appointment(args, user, context: dict):
                 reply_parts.append(fallback_notice)
             reply_parts.append("\n".join(lines))
             reply_parts.append("\nPlease respond with the number of your chosen slot.")
+            if held:
+                reply_parts.append(f"I'll keep these times for you for {max(SLOT_HOLD_TTL // 60, 1)} minutes.")
 
             reply = "\n".join([p for p in reply_parts if p])  
-            print("[DEBUG] reply:", reply)
+            log.debug("Offering %d slots", len(slots))
 
             if session_id:
                 try:
-                    save_slot_mapping(
+                    await save_slot_mapping(
                         session_id=session_id,
                         mapping={s["index"]: s["id"] for s in slots},
                         patient_id=patient_id,
-                        doctor_id=get_family_doctor_id(patient_id),
+                        doctor_id=doc_info.get("id"),
                         role=user["role"],
                         input_mode=input_mode
                     )
                 except Exception as e:
-                    print(f"[SLOT MAP ERROR] Failed to save mapping: {e}")
+                    log.error("Failed to save slot mapping: %s", e)
 
-            return {"reply": reply, "available_slots": slots}
+            return {"reply": reply, "available_slots": slots, "final": True}
 
     # Step 3: Total failure
-    print("[DEBUG] No usable slot info found in args.")
+    log.debug("No usable slot info found in args")
     return {
         "reply": "I couldn't find any available appointments. Please provide a preferred time or try again later.",
-        "available_slots": []
+        "available_slots": [],
+        "final": True
+    }
+
+
+# Longest series booked in one request
+BOOK_SERIES_MAX_OCCURRENCES = 26
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def parse_weekday(value: str | None) -> int | None:
+    """
+    "tuesday" / "Tue" / "tuesdays" → 0-6 (Monday = 0), None if unrecognized.
+    """
+    text = (value or "").strip().lower()
+    if len(text) < 3:
+        return None
+    for idx, name in enumerate(WEEKDAYS):
+        if name.startswith(text[:3]):
+            return idx
+    return None
+
+
+@timed("handler")
+async def handle_book_series(args: dict, user: dict, context: dict = {}) -> dict:
+    """
+    Recurring appointments: one slot per occurrence (same weekday, same time), booked all-or-nothing.
+    args: weekday, preferred_time, occurrences, interval_weeks (default 1), start_date (optional), description
+    """
+    patient_id = user["id"]
+    user_tz = get_user_tz(context)
+    preferred_time = (args.get("preferred_time") or "").strip()
+    start_date = args.get("start_date")
+    weekday = parse_weekday(args.get("weekday"))
+
+    try:
+        occurrences = int(args.get("occurrences") or 0)
+        interval_weeks = max(1, int(args.get("interval_weeks") or 1))
+    except (TypeError, ValueError):
+        occurrences, interval_weeks = 0, 1
+
+    if weekday is None and not start_date:
+        return {"reply": "Which day of the week should the appointments be on?", "final": True}
+    # Only "HH:MM" or a time of day narrows the search; anything else ("10am") would match every slot
+    if time_window(preferred_time, exact=True) is None:
+        return {"reply": "What time should the appointments be at? For example 10:00, or morning.", "final": True}
+    if occurrences < 1:
+        return {"reply": "How many appointments would you like in the series?", "final": True}
+    if occurrences > BOOK_SERIES_MAX_OCCURRENCES:
+        return {"reply": f"I can book up to {BOOK_SERIES_MAX_OCCURRENCES} appointments at a time. Please choose a shorter series.", "final": True}
+
+    # First occurrence: start_date, or the next matching weekday after today
+    if start_date:
+        try:
+            first_day = parse_day(start_date)
+        except ValueError:
+            return {"reply": "Sorry, I couldn't understand the start date. Could you give it as a date, e.g. 2025-09-04?", "final": True}
+    else:
+        today = datetime.now(user_tz).date()
+        first_day = today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)
+    days = [first_day + timedelta(weeks=interval_weeks * k) for k in range(occurrences)]
+
+    doc_info = await get_family_doctor_brief(patient_id)
+    if not doc_info:
+        return {"reply": "You don't have an active family doctor to book with.", "final": True}
+    doc_name = f"Dr. {doc_info.get('fname', '').strip()} {doc_info.get('lname', '').strip()}".strip()
+
+    # One read for the whole series window, then the earliest matching open slot per day
+    window_start, window_end = local_day_bounds(days[0], (days[-1] - days[0]).days + 1, user_tz)
+    segments = await get_open_segments(doc_info["id"], window_start, window_end, tz=user_tz, patient_id=patient_id)
+    wanted_days = set(days)
+    chosen: dict = {}
+    for s in filter_rows(segments, "start_dt", user_tz, preferred_time, wanted=(0,), exact=is_exact_time_string(preferred_time)):
+        day = s["start_dt"].date()
+        if day in wanted_days and day not in chosen:
+            chosen[day] = s
+
+    missing = [d for d in days if d not in chosen]
+    if missing:
+        listed = ", ".join(d.isoformat() for d in missing)
+        when = f"at {preferred_time}" if is_exact_time_string(preferred_time) else f"in the {preferred_time}"
+        return {
+            "reply": f"{doc_name} has no open slot {when} on {listed}, so I haven't booked the series. "
+                     "Would you like a different time or day?",
+            "final": True
+        }
+
+    try:
+        appts = await book_series(patient_id, [chosen[d]["segment_id"] for d in days])
+    except Exception as e:
+        log.error("Series booking failed: %s", e)
+        return {"reply": "One of those slots has just been taken, so nothing was booked. Please try again.", "final": True}
+
+    await set_session_task(context, None)
+    local_times = format_local_many((a["appointment_time"] for a in appts), user_tz, "%Y-%m-%d %H:%M %Z")
+    lines = [f"{idx}. {local_time}" for idx, local_time in enumerate(local_times, 1)]
+    return {
+        "reply": f"Your {len(appts)} appointments with {doc_name} are booked:\n" + "\n".join(lines),
+        "appointments": appts,
+        "final": True
     }
 
 
-def handle_cancel_appointment(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_cancel_appointment(args: dict, user: dict, context: dict = {}) -> dict:
 
     role = user["role"]
     user_id = user["id"]
     target = args.get("target")
     target_date = args.get("target_date")
 
-    print(f"[DEBUG] Cancel request by {role} {user_id}, target={target}, date={target_date}")
+    log.debug("Cancel request by %s %s, target=%s, date=%s", role, user_id, target, target_date)
 
     # 1. Query matching appointments
-    matches = find_matching_appointments(
+    matches = await find_matching_appointments(
         role=role,
         user_id=user_id,
         target=target,
         target_date=target_date
     )
-    print(f"[DEBUG] Raw matching appointments: {matches}")
+    log.debug("%d matching appointments", len(matches))
     if not matches:
-        print("[CANCEL] No matching appointment found.")
+        log.info("No matching appointment to cancel")
         return {
             "error": "not_found",
             "reason": "No matching appointment found."
@@ -458,10 +698,14 @@ def handle_cancel_appointment(args: dict, user: dict, context: dict = {}) -> dic
 
     # 3. Execution cancellation (initiated by doctor or patient)
 
-    result, err = cancel_appointment(appointment_id, by_doctor=(role == "doctor"))
+    result, err = await cancel_appointment(
+        appointment_id,
+        by_doctor=(role == "doctor"),
+        time_segment_id=appt.get("time_segment_id")
+    )
 
     if err:
-        print(f"[CANCEL ERROR] Failed to cancel: {err}")
+        log.error("Failed to cancel appointment: %s", err)
         return {
             "error": err,
             "appointment_id": appointment_id,
@@ -471,17 +715,21 @@ def handle_cancel_appointment(args: dict, user: dict, context: dict = {}) -> dic
             }.get(err, "Unknown error during cancellation.")
         }
  
-    update_task_state(context.get("session_id"), None)
+    await set_session_task(context, None)
 
     # 4. Returns structured success information
+    local_time = format_local(appt["appointment_time"], get_user_tz(context))
     return {
         "appointment_id": appointment_id,
         "cancelled_time": appt["appointment_time"],
-        "status": "cancelled"
+        "cancelled_local_time": local_time,
+        "status": "cancelled",
+        "reply_template": "appointment_cancelled"
     }
 
 
-def handle_reschedule(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_reschedule(args: dict, user: dict, context: dict = {}) -> dict:
     """
     Cancels the user's upcoming appointment (next or by date) and returns structured response.
     If successful, also triggers a rebooking process using preferred time.
@@ -496,10 +744,10 @@ def handle_reschedule(args: dict, user: dict, context: dict = {}) -> dict:
     user_tz = get_user_tz(context)
     
 
-    print(f"[DEBUG] Reschedule requested by user {user['id']} → target={target}, date={target_date}, preferred={preferred_date} {preferred_time}")
+    log.debug("Reschedule requested by user %s → target=%s, date=%s, preferred=%s %s", user["id"], target, target_date, preferred_date, preferred_time)
 
     # 1. Find currently cancelable appointments
-    matches = find_matching_appointments(
+    matches = await find_matching_appointments(
         user_id=user["id"],
         role=user["role"],
         target=target,
@@ -515,12 +763,16 @@ def handle_reschedule(args: dict, user: dict, context: dict = {}) -> dict:
     appt = sorted(matches, key=lambda x: x["appointment_time"])[0]
     appointment_id = appt["appointment_id"]
     appt_time = appt["appointment_time"]
-    local_time = parse_date(appt_time).astimezone(user_tz).strftime("%Y-%m-%d %H:%M")
+    local_time = format_local(appt_time, user_tz)
 
-    print(f"[DEBUG] Found appointment to cancel → id={appointment_id}, time={appt_time}")
+    log.debug("Found appointment to cancel → id=%s, time=%s", appointment_id, appt_time)
 
     # 2. Try to cancel
-    result, err = cancel_appointment(appointment_id, by_doctor=(user["role"] == "doctor"))
+    result, err = await cancel_appointment(
+        appointment_id,
+        by_doctor=(user["role"] == "doctor"),
+        time_segment_id=appt.get("time_segment_id")
+    )
     if err:
         msg = {
             "CANCEL_APPOINTMENT_NOT_FOUND": "Appointment not found or already cancelled.",
@@ -529,7 +781,7 @@ def handle_reschedule(args: dict, user: dict, context: dict = {}) -> dict:
         return { "reply": msg, "status": "cancel_failed" }
 
     # 3. Update the task status to reschedule
-    update_task_state(session_id, "BOOK_APPT")
+    await set_session_task(context, "BOOK_APPT")
 
     # 4. Returns structured information (the summary prompt will continue processing)
     return {
@@ -545,7 +797,8 @@ def handle_reschedule(args: dict, user: dict, context: dict = {}) -> dict:
     }
 
 
-def handle_show_appointments(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_show_appointments(args: dict, user: dict, context: dict = {}) -> dict:
 
     is_patient = user["role"] == "patient"
     user_id = user["id"]
@@ -554,33 +807,28 @@ def handle_show_appointments(args: dict, user: dict, context: dict = {}) -> dict
 
 
     if args.get("from_date"):
-        from_date = parse_date(args["from_date"]).astimezone(timezone.utc)
+        from_date = parse_iso(args["from_date"]).astimezone(timezone.utc)
     elif is_patient:
         from_date = now - timedelta(days=1)  # Default patient to see all future appointments
     else:
         from_date = now  # Doctors default to check from today
 
     if args.get("to_date"):
-        to_date = parse_date(args["to_date"]).astimezone(timezone.utc)
+        to_date = parse_iso(args["to_date"]).astimezone(timezone.utc)
     elif is_patient:
         to_date = now + timedelta(days=90)  # Patients can check for the next 3 months at most
     else:
         to_date = now + timedelta(days=7)   # Doctors only check the next 7 days by default
 
-    print(f"[DEBUG] show_appointments: from={from_date.date()} to={to_date.date()}")
+    log.debug("show_appointments: from=%s to=%s", from_date.date(), to_date.date())
 
-    appts = get_patient_appointments(user_id) if is_patient else get_doctor_appointments(user_id)
+    fetch_appointments = get_patient_appointments if is_patient else get_doctor_appointments
+    appts = await fetch_appointments(user_id, from_time=from_date, to_time=to_date, status=1)
     result = []
 
-    for a in appts.data:
+    for a in appts.data or []:
         try:
-            dt_utc = parse_date(a["appointment_time"]).astimezone(timezone.utc)
-            if a.get("status") != 1:
-                continue
-            if not (from_date <= dt_utc <= to_date):
-                continue
-
-            local_time = dt_utc.astimezone(user_tz)
+            local_time = parse_iso(a["appointment_time"]).astimezone(user_tz)
 
             if is_patient:
                 doc = a.get("doctors_registration", {})
@@ -596,29 +844,35 @@ def handle_show_appointments(args: dict, user: dict, context: dict = {}) -> dict
             })
 
         except Exception as e:
-            print(f"[WARN] Skipping invalid appointment: {e}")
+            log.warning("Skipping invalid appointment: %s", e)
             continue
 
 
     if not result:
-        return { "reply": "You don’t have any upcoming appointments.", "appointments": [] }
+        return { "reply": "You don’t have any upcoming appointments.", "appointments": [], "final": True }
 
-    update_task_state(context.get("session_id"), None)
+    await set_session_task(context, None)
 
+    lines = [
+        f"{idx + 1}. {a['local_time']}" + (f" with {a['name']}" if a["name"] else "")
+        for idx, a in enumerate(result)
+    ]
     return {
-        "reply": f"You have {len(result)} upcoming appointment(s).",
-        "appointments": result
+        "reply": f"You have {len(result)} upcoming appointment(s):\n" + "\n".join(lines),
+        "appointments": result,
+        "final": True
     }
 
 
 #Doctor Only
-def handle_doctor_schedule(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_doctor_schedule(args: dict, user: dict, context: dict = {}) -> dict:
     
     if user.get("role") != "doctor":
         return {"reply": "Only doctors can view schedules."}
 
     doctor_id = user["id"]
-    tz = pytz.timezone(user.get("timezone", "UTC"))
+    tz = get_timezone(user.get("timezone", "UTC"))
     start_date = args.get("target_date")
     days_ahead = args.get("days_ahead")
 
@@ -629,12 +883,12 @@ def handle_doctor_schedule(args: dict, user: dict, context: dict = {}) -> dict:
     else:
         end_date = None
 
-    segments = get_doctor_schedule(doctor_id, start_date=start_date, end_date=end_date)
+    segments = await get_doctor_schedule(doctor_id, start_date=start_date, end_date=end_date)
 
     if not segments:
         return {"reply": "No available schedule found.", "slots": []}
     
-    update_task_state(context.get("session_id"), None)
+    await set_session_task(context, None)
 
     return {
         "reply": f"Schedule from {start_date or 'today'}" + (f" to {end_date}" if end_date else ""),
@@ -643,7 +897,8 @@ def handle_doctor_schedule(args: dict, user: dict, context: dict = {}) -> dict:
 
 
 #Doctor Only
-def handle_reactivate(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_reactivate(args: dict, user: dict, context: dict = {}) -> dict:
 
 
     if user.get("role") != "doctor":
@@ -651,37 +906,39 @@ def handle_reactivate(args: dict, user: dict, context: dict = {}) -> dict:
 
     slot_time_str = args.get("slot_time")
     if not slot_time_str:
-        return {"reply": "Please tell me the time you want to reopen (e.g. '5:30 PM on July 27')."}
+        return {"reply": "Please tell me the time you want to reopen (e.g. '5:30 PM on July 27').", "final": True}
 
     try:
-        slot_dt = parse_date(slot_time_str).astimezone(timezone.utc)
+        slot_dt = parse_iso(slot_time_str).astimezone(timezone.utc)
     except Exception:
-        return {"reply": "Sorry, I couldn't understand the time. Could you rephrase it?"}
+        return {"reply": "Sorry, I couldn't understand the time. Could you rephrase it?", "final": True}
 
-    # Fetch full schedule
-    segments = get_doctor_schedule(user["id"])
-    print(f"[DEBUG] Reactivate slot: looking for segment at {slot_dt.isoformat()}")
+    # Only segments starting within a minute of the requested time can match
+    segments = await get_doctor_segments(user["id"], slot_dt - timedelta(seconds=60), slot_dt + timedelta(seconds=61))
+    log.debug("Reactivate slot: looking for segment at %s", slot_dt)
 
     for seg in segments:
-        seg_time = parse_date(seg["start_time"]).astimezone(timezone.utc)
+        seg_time = seg["start_dt"]
         if seg["status"] == -1 and abs((slot_dt - seg_time).total_seconds()) < 60:
             segment_id = seg["segment_id"]
 
             try:
-                reactivate_time_segment(segment_id)
-                update_task_state(context.get("session_id"), None)
+                await reactivate_time_segment(segment_id)
+                await set_session_task(context, None)
                 return {
-                    "reply": f" Segment at {seg_time.strftime('%Y-%m-%d %H:%M')} reactivated.",
-                    "segment_id": segment_id
+                    "reply": f"Segment at {seg_time.strftime('%Y-%m-%d %H:%M')} reactivated.",
+                    "segment_id": segment_id,
+                    "final": True
                 }
             except ValueError as ve:
                 return { "reply": f"Reactivate failed: {str(ve)}" }
 
-    return { "reply": f"No blocked segment found at {slot_dt.strftime('%Y-%m-%d %H:%M')}. Please try another time." }
+    return { "reply": f"No blocked segment found at {slot_dt.strftime('%Y-%m-%d %H:%M')}. Please try another time.", "final": True }
 
 
 #Doctor Only
-def handle_create_event(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_create_event(args: dict, user: dict, context: dict = {}) -> dict:
 
     if user.get("role") != "doctor":
         return {"error": "Only doctors can create events."}
@@ -695,55 +952,49 @@ def handle_create_event(args: dict, user: dict, context: dict = {}) -> dict:
     if not preferred_date:
         return {"reply": "Please tell me which date you'd like to block.", "event_created": False}
 
-    slots = get_doctor_schedule(doctor_id, start_date=preferred_date, end_date=preferred_date)
+    day_start = datetime.combine(parse_day(preferred_date), datetime.min.time(), tzinfo=timezone.utc)
+    slots = await get_doctor_segments(doctor_id, day_start, day_start + timedelta(days=1), tz=user_tz)
     candidate = None
 
-    print(f"[DEBUG] Found {len(slots)} segments on {preferred_date}")
+    log.debug("Found %d segments on %s", len(slots), preferred_date)
 
     # Step 1: Exact time match (if preferred_time is "HH:MM")
     if preferred_time and is_exact_time_string(preferred_time):
-        target_hour, target_minute = map(int, preferred_time.split(":"))
-        for s in slots:
-            dt_local = parse_date(s["start_time"]).astimezone(user_tz)
-            print(f"[DEBUG] Checking segment {s['segment_id']} at {dt_local} → status={s['status']}")
-            if s["status"] == 0 and dt_local.hour == target_hour and dt_local.minute == target_minute:
-                candidate = s
-                break
+        found = filter_rows(slots, "start_dt", user_tz, preferred_time, wanted=(0,), limit=1, exact=True)
+        candidate = found[0] if found else None
 
     # Step 2: Fallback to divisions of the day (morning/afternoon/evening)
     if not candidate and preferred_time:
-        for s in slots:
-            dt_local = parse_date(s["start_time"]).astimezone(user_tz)
-            match = slot_matches_time_with_tz(dt_local, preferred_time, user_tz)
-            print(f"[DEBUG] Fallback check: segment {s['segment_id']} at {dt_local} → match_time_pref={match}")
-            if s["status"] == 0 and match:
-                candidate = s
-                break
+        found = filter_rows(slots, "start_dt", user_tz, preferred_time, wanted=(0,), limit=1)
+        candidate = found[0] if found else None
 
     if not candidate:
         return {"reply": "No available time slot found on that date.", "event_created": False}
 
     segment_id = candidate["segment_id"]
-    print(f"[DEBUG] Selected segment: {segment_id} ({candidate['start_time']})")
+    log.debug("Selected segment %s (%s)", segment_id, candidate["start_time"])
 
-    result, err = create_doctor_event(segment_id, doctor_id, description)
+    result, err = await create_doctor_event(segment_id, doctor_id, description)
 
     if err == "EVENT_SEGMENT_NOT_AVAILABLE":
         return {"reply": "That slot is already taken. Please choose another.", "event_created": False}
     elif err:
         return {"reply": f"Failed to create event: {err}", "event_created": False}
 
-    update_task_state(context.get("session_id"), None)
+    await set_session_task(context, None)
 
+    local_time = candidate["start_dt"].strftime("%Y-%m-%d %H:%M")
     return {
-        "reply": f"Got it. I've scheduled the event: **{description}** at {candidate['start_time']}.",
+        "reply": f"Got it. I've scheduled the event: {description} at {local_time}.",
         "segment_id": segment_id,
-        "event_created": True
+        "event_created": True,
+        "final": True
     }
 
 
 #Doctor Only
-def handle_cancel_event(args: dict, user: dict, context: dict = {}) -> dict:
+@timed("handler")
+async def handle_cancel_event(args: dict, user: dict, context: dict = {}) -> dict:
 
  
     if user.get("role") != "doctor":
@@ -751,23 +1002,22 @@ def handle_cancel_event(args: dict, user: dict, context: dict = {}) -> dict:
 
     doctor_id = user["id"]
     user_tz = get_user_tz(context)
-    print("user_tz: ", user_tz)
 
     preferred_date = args.get("preferred_date")
     preferred_time = args.get("preferred_time") or args.get("time_pref")
 
-    print(f"[DEBUG] handle_cancel_event input: preferred_date={preferred_date}, time={preferred_time}, doctor={doctor_id}")
+    log.debug("Cancel event: preferred_date=%s, time=%s, doctor=%s, tz=%s", preferred_date, preferred_time, doctor_id, user_tz)
 
     if not preferred_date or not preferred_time:
         return {"error": "Please specify the date and time of the event you want to cancel."}
 
-    matches = find_matching_events(
+    matches = await find_matching_events(
         doctor_id=doctor_id,
         preferred_date=preferred_date,
         preferred_time=preferred_time,
         user_tz=user_tz
     )
-    print(f"[DEBUG] Found matching events: {matches}")
+    log.debug("%d matching events", len(matches))
 
     if not matches:
         return {"error": "No matching event found."}
@@ -775,16 +1025,16 @@ def handle_cancel_event(args: dict, user: dict, context: dict = {}) -> dict:
     event = sorted(matches, key=lambda x: x["start_time"])[0]
     segment_id = event["segment_id"]
 
-    segment_time, err = cancel_event(segment_id=segment_id, doctor_id=doctor_id)
+    segment_time, err = await cancel_event(segment_id=segment_id, doctor_id=doctor_id)
 
     if err:
-        print(f"[ERROR] Cancel failed: {err}")
+        log.error("Cancel event failed: %s", err)
         return {"error": "Failed to cancel the event.", "reason": err}
 
-    update_task_state(context.get("session_id"), None)
+    await set_session_task(context, None)
 
     try:
-        local_time = parse_date(segment_time).astimezone(pytz.timezone(user_tz))
+        local_time = parse_iso(segment_time).astimezone(user_tz)
         formatted = local_time.strftime('%Y-%m-%d %H:%M')
     except Exception:
         formatted = segment_time
@@ -792,11 +1042,106 @@ def handle_cancel_event(args: dict, user: dict, context: dict = {}) -> dict:
     return {
         "reply": f"Event on {formatted} cancelled.",
         "segment_time": segment_time,
-        "event_cancelled": True
+        "event_cancelled": True,
+        "final": True
+    }
+
+
+# Longest calendar range blocked or reopened in one request
+TIME_RANGE_MAX_DAYS = 31
+
+
+def resolve_time_range(args: dict, user_tz: tzinfo) -> tuple[datetime, datetime] | None:
+    """
+    [start, end) in UTC from start_date / end_date (inclusive days) and optional start_time / end_time
+    ("HH:MM") in the user's timezone: "Friday 14:00 to Monday 09:00", or whole days. None without start_date.
+    """
+    start_date = args.get("start_date")
+    if not start_date:
+        return None
+    start_day = parse_day(start_date)
+    end_day = parse_day(args.get("end_date") or start_date)
+
+    start_time = args.get("start_time") or ""
+    end_time = args.get("end_time") or ""
+    start = datetime.combine(start_day, datetime.min.time(), tzinfo=user_tz)
+    if is_exact_time_string(start_time):
+        start = datetime.combine(start_day, datetime.strptime(start_time, "%H:%M").time(), tzinfo=user_tz)
+    if is_exact_time_string(end_time):
+        end = datetime.combine(end_day, datetime.strptime(end_time, "%H:%M").time(), tzinfo=user_tz)
+    else:
+        end = datetime.combine(end_day + timedelta(days=1), datetime.min.time(), tzinfo=user_tz)
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+
+def describe_range_result(summary: dict, verb: str, user_tz: tzinfo) -> str:
+    changed = summary.get("changed", 0)
+    if not changed:
+        return f"There was nothing to {verb} in that time range."
+    first = format_local(summary["first_start"], user_tz, "%Y-%m-%d %H:%M")
+    last = format_local(summary["last_end"], user_tz, "%Y-%m-%d %H:%M %Z")
+    reply = f"Done: {changed} slot{'s' if changed != 1 else ''} {verb}ed between {first} and {last}."
+    if summary.get("booked"):
+        booked = summary["booked"]
+        reply += f" {booked} slot{'s' if booked != 1 else ''} with patient appointments {'were' if booked != 1 else 'was'} left unchanged."
+    return reply
+
+
+async def _handle_time_range(args: dict, user: dict, context: dict, block: bool) -> dict:
+    if user.get("role") != "doctor":
+        return {"error": "Only doctors can change their calendar."}
+
+    user_tz = get_user_tz(context)
+    try:
+        window = resolve_time_range(args, user_tz)
+    except ValueError:
+        return {"reply": "Sorry, I couldn't understand the dates. Could you rephrase them?", "final": True}
+    if window is None:
+        return {"reply": "Which days (and optionally which hours) should I change?", "final": True}
+
+    start, end = window
+    if end <= start:
+        return {"reply": "The end of the range must be after its start.", "final": True}
+    if end - start > timedelta(days=TIME_RANGE_MAX_DAYS):
+        return {"reply": f"I can change at most {TIME_RANGE_MAX_DAYS} days at a time.", "final": True}
+
+    time_pref = args.get("time_pref") or None
+    tz_name = context.get("timezone") or "UTC"
+    try:
+        if block:
+            summary = await block_time_range(
+                user["id"], start, end, time_pref, tz_name, args.get("description") or None
+            )
+        else:
+            summary = await reactivate_time_range(user["id"], start, end, time_pref, tz_name)
+    except Exception as e:
+        log.error("Range %s failed: %s", "block" if block else "reactivation", e)
+        return {"reply": "Sorry, I couldn't update your calendar just now. Please try again.", "final": True}
+
+    await set_session_task(context, None)
+    # Summary only: segment_ids stay server-side
+    result = {k: v for k, v in summary.items() if k != "segment_ids"}
+    return {
+        "reply": describe_range_result(summary, "block" if block else "reopen", user_tz),
+        "range_result": result,
+        "final": True
     }
 
 
-def handle_action_dispatch(extracted: dict, user: dict, context: dict = {}) -> str | dict:
+#Doctor Only
+@timed("handler")
+async def handle_block_time_range(args: dict, user: dict, context: dict = {}) -> dict:
+    return await _handle_time_range(args, user, context, block=True)
+
+
+#Doctor Only
+@timed("handler")
+async def handle_reactivate_time_range(args: dict, user: dict, context: dict = {}) -> dict:
+    return await _handle_time_range(args, user, context, block=False)
+
+
+@timed("chat")
+async def handle_action_dispatch(extracted: dict, user: dict, context: dict = {}) -> str | dict:
     
     ACTION_MAP = {
         "a": "book_appointment",
@@ -807,10 +1152,15 @@ def handle_action_dispatch(extracted: dict, user: dict, context: dict = {}) -> s
         "f": "reschedule_appointment",
         "g": "create_event",
         "h": "cancel_event",
+        "j": "book_series",
+        "k": "block_time_range",
+        "l": "reactivate_time_range",
     }
     action = extracted.get("action")
     if action in ACTION_MAP:
         action = ACTION_MAP[action]
+    # Free-form LLM output must not become a metrics label
+    set_trace_labels(action=action if action in ACTION_MAP.values() or action == "general_chat" else "unsupported")
 
     session_id = context.get("session_id")
     if session_id and action:
@@ -822,41 +1172,50 @@ def handle_action_dispatch(extracted: dict, user: dict, context: dict = {}) -> s
             "reactivate_time_segment": "REACTIVATE_SEGMENT",
             "reschedule_appointment": "RESCHEDULE_APPT",
             "create_event": "CREATE_EVENT",
-            "cancel_event": "CANCEL_EVENT"
+            "cancel_event": "CANCEL_EVENT",
+            "book_series": "BOOK_SERIES",
+            "block_time_range": "BLOCK_RANGE",
+            "reactivate_time_range": "REACTIVATE_RANGE"
         }
         task_id = task_enum_map.get(action)
 
         if task_id:
-            update_task_state(session_id, task_id)
+            await set_session_task(context, task_id)
 
 
     if action == "book_appointment":
-        return handle_book_appointment(extracted["arguments"], user, context)
+        return await handle_book_appointment(extracted["arguments"], user, context)
     elif action == "cancel_appointment":
-        return handle_cancel_appointment(extracted["arguments"], user, context)
+        return await handle_cancel_appointment(extracted["arguments"], user, context)
     elif action == "show_appointments":
-        return handle_show_appointments(extracted["arguments"], user, context)
+        return await handle_show_appointments(extracted["arguments"], user, context)
     elif action == "show_my_schedule":
-        return handle_doctor_schedule(extracted["arguments"], user, context)
+        return await handle_doctor_schedule(extracted["arguments"], user, context)
     elif action == "reactivate_time_segment":
-        return handle_reactivate(extracted["arguments"], user, context)
+        return await handle_reactivate(extracted["arguments"], user, context)
     elif action == "reschedule_appointment":
-        return handle_reschedule(extracted["arguments"], user, context)
+        return await handle_reschedule(extracted["arguments"], user, context)
     elif action == "create_event":
-        return handle_create_event(extracted["arguments"], user, context)
+        return await handle_create_event(extracted["arguments"], user, context)
     elif action == "cancel_event":
-        return handle_cancel_event(extracted["arguments"], user, context)
+        return await handle_cancel_event(extracted["arguments"], user, context)
+    elif action == "book_series":
+        return await handle_book_series(extracted["arguments"], user, context)
+    elif action == "block_time_range":
+        return await handle_block_time_range(extracted["arguments"], user, context)
+    elif action == "reactivate_time_range":
+        return await handle_reactivate_time_range(extracted["arguments"], user, context)
     elif action == "general_chat":
         chat_type = extracted.get("arguments", {}).get("type", "")
         if chat_type == "intro":
-            return {"reply": "Hi! I'm your scheduling assistant. I can help you book, cancel, or view appointments."}
+            return {"reply": "Hi! I'm your scheduling assistant. I can help you book, cancel, or view appointments.", "final": True}
         elif chat_type == "help":
-            return {"reply": "You can say things like 'Book me an appointment tomorrow morning' or 'Cancel my next appointment'."}
+            return {"reply": "You can say things like 'Book me an appointment tomorrow morning' or 'Cancel my next appointment'.", "final": True}
         else:
             return {"reply": random.choice([
                 "Let me know if you need help with anything else.",
                 "Got it. I'm here if you need me."
-            ])}
+            ]), "final": True}
     return {
     "error": "unsupported_action",
     "reply": "Sorry, I couldn't understand your request. Can you rephrase?"
@@ -0,0 +1,559 @@
+# db.py
+import json
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from importlib.util import find_spec
+from typing import Any
+
+import httpx
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+
+from app_logging import get_logger
+
+try:
+    import asyncpg
+except ImportError:        # optional: only needed for DB_BACKEND=postgres
+    asyncpg = None
+
+
+# Data-access layer behind supabase_utils. connect() returns the object supabase_utils
+# calls .table(...) / .rpc(...) on:
+#
+#   DB_BACKEND=postgrest (default)  supabase-py over one shared httpx client with HTTP/2,
+#                                   keep-alive and explicit pool limits / timeouts
+#   DB_BACKEND=postgres             PgClient: the same query-builder calls executed on an
+#                                   asyncpg pool to DATABASE_URL, skipping the PostgREST hop
+#                                   when the backend runs next to the database
+#
+# PgClient renders results with json_agg / to_json in Postgres, the way PostgREST does,
+# so helpers see the same shapes (timestamps as ISO strings, embedded rows as objects)
+# and the same RAISE EXCEPTION messages from the atomic RPCs. It connects as the
+# DATABASE_URL role, which must be allowed what service_role is (RLS is not applied).
+#
+#   DB_HTTP2                  1 (default): negotiate HTTP/2 when the h2 package is installed
+#   DB_HTTP_MAX_CONNECTIONS   open connections to PostgREST (default 50)
+#   DB_HTTP_MAX_KEEPALIVE     idle connections kept open (default 20)
+#   DB_HTTP_KEEPALIVE_EXPIRY  seconds an idle connection is kept (default 60)
+#   DB_CONNECT_TIMEOUT        seconds to open a connection (default 5)
+#   DB_TIMEOUT                seconds per request / statement (default 15)
+#   DB_POOL_TIMEOUT           seconds to wait for a free pooled connection (default 5)
+#   DB_PG_MIN_SIZE / DB_PG_MAX_SIZE   asyncpg pool size (default 2 / 10)
+#   DB_PG_STATEMENT_CACHE_SIZE        prepared statements per connection (default 100;
+#                                     0 behind PgBouncer in transaction mode)
+
+DB_BACKEND = os.getenv("DB_BACKEND", "postgrest").lower()
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+DB_HTTP2 = os.getenv("DB_HTTP2", "1") == "1"
+DB_HTTP_MAX_CONNECTIONS = int(os.getenv("DB_HTTP_MAX_CONNECTIONS", "50"))
+DB_HTTP_MAX_KEEPALIVE = int(os.getenv("DB_HTTP_MAX_KEEPALIVE", "20"))
+DB_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("DB_HTTP_KEEPALIVE_EXPIRY", "60"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "15"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+
+DB_PG_MIN_SIZE = int(os.getenv("DB_PG_MIN_SIZE", "2"))
+DB_PG_MAX_SIZE = int(os.getenv("DB_PG_MAX_SIZE", "10"))
+DB_PG_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PG_STATEMENT_CACHE_SIZE", "100"))
+
+log = get_logger("db")
+
+DB_STATS = {
+    "requests": 0,
+    "rpcs": 0,
+    "errors": 0,
+}
+
+_http: httpx.AsyncClient | None = None
+_pg: "PgClient | None" = None
+
+
+#######################
+# PostgREST over a tuned httpx client
+#######################
+
+async def _count_request(request: httpx.Request) -> None:
+    DB_STATS["requests"] += 1
+    if "/rpc/" in request.url.path:
+        DB_STATS["rpcs"] += 1
+
+
+async def _count_response(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        DB_STATS["errors"] += 1
+
+
+async def _connect_postgrest(url: str, key: str) -> AsyncClient:
+    global _http
+    http2 = DB_HTTP2 and find_spec("h2") is not None
+    if DB_HTTP2 and not http2:
+        log.warning("DB_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+
+    # One client for every PostgREST call: postgrest-py sends full URLs and headers per
+    # request, so the pool is shared and connections stay warm between chat turns
+    _http = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=DB_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=DB_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=DB_HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(DB_TIMEOUT, connect=DB_CONNECT_TIMEOUT, pool=DB_POOL_TIMEOUT),
+        follow_redirects=True,
+        event_hooks={"request": [_count_request], "response": [_count_response]}
+    )
+    log.info("PostgREST client ready", extra={"http2": http2, "max_connections": DB_HTTP_MAX_CONNECTIONS})
+    return await acreate_client(url, key, options=AsyncClientOptions(httpx_client=_http))
+
+
+#######################
+# Direct Postgres (asyncpg)
+#######################
+
+_IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_EMBED_RE = re.compile(r"^(\w+)\((.*)\)$", re.S)
+
+_CATALOG_COLUMNS = """
+SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod)
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'public' AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+  AND a.attnum > 0 AND NOT a.attisdropped
+"""
+
+_CATALOG_FOREIGN_KEYS = """
+SELECT src.relname, a.attname, dst.relname, b.attname
+FROM pg_constraint k
+JOIN pg_class src ON src.oid = k.conrelid
+JOIN pg_class dst ON dst.oid = k.confrelid
+JOIN pg_namespace n ON n.oid = src.relnamespace
+JOIN pg_attribute a ON a.attrelid = k.conrelid AND a.attnum = k.conkey[1]
+JOIN pg_attribute b ON b.attrelid = k.confrelid AND b.attnum = k.confkey[1]
+WHERE k.contype = 'f' AND n.nspname = 'public' AND cardinality(k.conkey) = 1
+"""
+
+_CATALOG_FUNCTIONS = """
+SELECT p.proname, p.proretset, t.typtype::text, p.prorettype = 'void'::regtype, p.pronargdefaults,
+       coalesce(p.proargnames, '{}'), coalesce(p.proargmodes::text[], '{}'),
+       array(SELECT format_type(x, NULL) FROM unnest(coalesce(p.proallargtypes, p.proargtypes::oid[])) x)
+FROM pg_proc p
+JOIN pg_namespace n ON n.oid = p.pronamespace
+JOIN pg_type t ON t.oid = p.prorettype
+WHERE n.nspname = 'public' AND p.prokind = 'f'
+"""
+
+
+class QueryError(Exception):
+    """
+    A request PostgREST would have rejected (unknown column, .single() without exactly one row).
+    """
+
+
+@dataclass
+class QueryResult:
+    data: Any
+    count: int | None = None
+
+
+@dataclass
+class _Function:
+    name: str
+    returns_set: bool
+    returns_row: bool
+    returns_void: bool
+    args: list[tuple[str, str]]     # input (name, type) in declaration order
+    required: int                   # leading args without a default
+
+
+def _ident(name: str) -> str:
+    if not _IDENT_RE.match(name):
+        raise QueryError(f"Invalid identifier: {name!r}")
+    return f'"{name}"'
+
+
+def _as_text(value: Any) -> str:
+    # Filter values are sent as text and cast to the column type, like PostgREST query strings
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _split_columns(columns: str) -> list[str]:
+    parts, depth, current = [], 0, ""
+    for ch in columns:
+        if ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += (ch == "(") - (ch == ")")
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class PgClient:
+    """
+    The part of the supabase-py client used by supabase_utils (table() query builders
+    and rpc()), executed on an asyncpg pool.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.columns: dict[str, dict[str, str]] = {}
+        self.foreign_keys: list[tuple[str, str, str, str]] = []
+        self.functions: dict[str, list[_Function]] = {}
+
+    async def load_catalog(self) -> None:
+        """
+        Column types, single-column foreign keys (for embedding) and function signatures of
+        the public schema. Call again after schema changes.
+        """
+        async with self.pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            columns = await conn.fetch(_CATALOG_COLUMNS)
+            foreign_keys = await conn.fetch(_CATALOG_FOREIGN_KEYS)
+            functions = await conn.fetch(_CATALOG_FUNCTIONS)
+
+        self.columns = {}
+        for table, column, type_name in columns:
+            self.columns.setdefault(table, {})[column] = type_name
+        self.foreign_keys = [tuple(row) for row in foreign_keys]
+        self.functions = {}
+        for name, returns_set, typtype, returns_void, n_defaults, names, modes, types in functions:
+            inputs = [
+                (names[i] if i < len(names) else "", types[i])
+                for i in range(len(types))
+                if not modes or modes[i] in ("i", "b", "v")
+            ]
+            self.functions.setdefault(name, []).append(_Function(
+                name, returns_set, typtype == "c", returns_void, inputs, len(inputs) - n_defaults
+            ))
+
+    def table(self, name: str) -> "PgQuery":
+        return PgQuery(self, name)
+
+    def from_(self, name: str) -> "PgQuery":
+        return PgQuery(self, name)
+
+    def rpc(self, fn: str, params: dict | None = None) -> "PgRpc":
+        return PgRpc(self, fn, params or {})
+
+    def column_type(self, table: str, column: str) -> str:
+        try:
+            return self.columns[table][column]
+        except KeyError:
+            raise QueryError(f"Column {table}.{column} does not exist") from None
+
+    def relation(self, table: str, other: str) -> tuple[str, str, bool]:
+        """
+        Join columns for embedding `other` in rows of `table`: (table column, other column,
+        many) where many is True when several `other` rows point at one `table` row.
+        """
+        for src, src_col, dst, dst_col in self.foreign_keys:
+            if src == table and dst == other:
+                return src_col, dst_col, False
+        for src, src_col, dst, dst_col in self.foreign_keys:
+            if src == other and dst == table:
+                return dst_col, src_col, True
+        raise QueryError(f"No relationship between {table} and {other}")
+
+    async def fetch_json(self, sql: str, *args) -> Any:
+        try:
+            async with self.pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+                text = await conn.fetchval(sql, *args)
+        except Exception:
+            DB_STATS["errors"] += 1
+            raise
+        return json.loads(text) if text is not None else None
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+class PgQuery:
+    """
+    table(...).select / insert / update / delete with eq, neq, gt, gte, lt, lte, in_, is_,
+    order, limit, range, single and maybe_single — PostgREST semantics.
+    """
+
+    def __init__(self, client: PgClient, table: str):
+        self.client = client
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.payload: Any = None
+        self.filters: list[tuple[str, str, Any]] = []
+        self.ordering: list[tuple[str, bool]] = []
+        self.row_limit: int | None = None
+        self.row_offset: int | None = None
+        self.one: str | None = None        # "single" / "maybe_single"
+
+    def select(self, columns: str = "*", **_) -> "PgQuery":
+        self.columns = columns
+        return self
+
+    def insert(self, data: dict | list[dict], **_) -> "PgQuery":
+        self.action, self.payload = "insert", data if isinstance(data, list) else [data]
+        return self
+
+    def update(self, data: dict, **_) -> "PgQuery":
+        self.action, self.payload = "update", data
+        return self
+
+    def delete(self, **_) -> "PgQuery":
+        self.action = "delete"
+        return self
+
+    def _filter(self, column: str, op: str, value: Any) -> "PgQuery":
+        self.filters.append((column, op, value))
+        return self
+
+    def eq(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, "<>", value)
+
+    def gt(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, ">=", value)
+
+    def lt(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, "<=", value)
+
+    def in_(self, column: str, values: list) -> "PgQuery":
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column: str, value: Any) -> "PgQuery":
+        return self._filter(column, "is", value)
+
+    def order(self, column: str, desc: bool = False, **_) -> "PgQuery":
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, size: int, **_) -> "PgQuery":
+        self.row_limit = size
+        return self
+
+    def range(self, start: int, end: int, **_) -> "PgQuery":
+        self.row_offset, self.row_limit = start, end - start + 1
+        return self
+
+    def single(self) -> "PgQuery":
+        self.one = "single"
+        return self
+
+    def maybe_single(self) -> "PgQuery":
+        self.one = "maybe_single"
+        return self
+
+    def _columns_sql(self, table: str, alias: str, columns: str, depth: int = 0) -> str:
+        items = []
+        for item in _split_columns(columns):
+            embed = _EMBED_RE.match(item)
+            if item == "*":
+                items.append(f"{alias}.*")
+            elif embed:
+                other, inner = embed.group(1), embed.group(2)
+                local_col, other_col, many = self.client.relation(table, other)
+                inner_alias = f"_e{depth}"
+                inner_sql = self._columns_sql(other, inner_alias, inner or "*", depth + 1)
+                rows = (
+                    f"SELECT {inner_sql} FROM {_ident(other)} {inner_alias} "
+                    f"WHERE {inner_alias}.{_ident(other_col)} = {alias}.{_ident(local_col)}"
+                )
+                agg = f"coalesce(json_agg(_j{depth}), '[]')" if many else f"row_to_json(_j{depth})"
+                items.append(f"(SELECT {agg} FROM ({rows}) _j{depth}) AS {_ident(other)}")
+            else:
+                self.client.column_type(table, item)
+                items.append(f"{alias}.{_ident(item)}")
+        return ", ".join(items)
+
+    def _where(self, args: list) -> list[str]:
+        clauses = []
+        for column, op, value in self.filters:
+            col = f"_t.{_ident(column)}"
+            type_name = self.client.column_type(self.table, column)
+            if op == "is":
+                keyword = {None: "NULL", True: "TRUE", False: "FALSE"}[value]
+                clauses.append(f"{col} IS {keyword}")
+            elif op == "in":
+                args.append([_as_text(v) for v in value])
+                clauses.append(f"{col} = ANY(${len(args)}::text[]::{type_name}[])")
+            else:
+                args.append(_as_text(value))
+                clauses.append(f"{col} {op} ${len(args)}::text::{type_name}")
+        return clauses
+
+    def _where_sql(self, args: list) -> str:
+        clauses = self._where(args)
+        return f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    def _sql(self) -> tuple[str, list]:
+        table = _ident(self.table)
+        args: list = []
+
+        if self.action == "insert":
+            keys = list(dict.fromkeys(k for row in self.payload for k in row))
+            for k in keys:
+                self.client.column_type(self.table, k)
+            cols = ", ".join(_ident(k) for k in keys)
+            args.append(json.dumps(self.payload, default=str))
+            return (
+                f"WITH _q AS (INSERT INTO {table} ({cols}) SELECT {cols} "
+                f"FROM json_populate_recordset(NULL::{table}, $1::json) RETURNING *) "
+                f"SELECT coalesce(json_agg(_q), '[]')::text FROM _q"
+            ), args
+
+        if self.action == "update":
+            for k in self.payload:
+                self.client.column_type(self.table, k)
+            args.append(json.dumps(self.payload, default=str))
+            sets = ", ".join(f"{_ident(k)} = _v.{_ident(k)}" for k in self.payload)
+            where = " AND ".join(self._where(args)) or "TRUE"
+            return (
+                f"WITH _q AS (UPDATE {table} _t SET {sets} "
+                f"FROM json_populate_record(NULL::{table}, $1::json) _v WHERE {where} RETURNING _t.*) "
+                f"SELECT coalesce(json_agg(_q), '[]')::text FROM _q"
+            ), args
+
+        if self.action == "delete":
+            return (
+                f"WITH _q AS (DELETE FROM {table} _t{self._where_sql(args)} RETURNING _t.*) "
+                f"SELECT coalesce(json_agg(_q), '[]')::text FROM _q"
+            ), args
+
+        sql = f"SELECT {self._columns_sql(self.table, '_t', self.columns)} FROM {table} _t{self._where_sql(args)}"
+        if self.ordering:
+            for column, _ in self.ordering:
+                self.client.column_type(self.table, column)
+            sql += " ORDER BY " + ", ".join(
+                f"_t.{_ident(column)} {'DESC NULLS LAST' if desc else 'ASC NULLS LAST'}" for column, desc in self.ordering
+            )
+        if self.row_limit is not None:
+            sql += f" LIMIT {int(self.row_limit)}"
+        if self.row_offset:
+            sql += f" OFFSET {int(self.row_offset)}"
+        return f"SELECT coalesce(json_agg(_q), '[]')::text FROM ({sql}) _q", args
+
+    async def execute(self) -> QueryResult:
+        sql, args = self._sql()
+        DB_STATS["requests"] += 1
+        rows = await self.client.fetch_json(sql, *args)
+        if self.one is None:
+            return QueryResult(rows)
+        if len(rows) > 1 or (self.one == "single" and not rows):
+            raise QueryError("JSON object requested, multiple (or no) rows returned")
+        return QueryResult(rows[0] if rows else None)
+
+
+class PgRpc:
+    """
+    rpc(fn, params): arguments are passed by name as one JSON object and converted with
+    json_to_record, as PostgREST does; set-returning functions come back as a list.
+    """
+
+    def __init__(self, client: PgClient, fn: str, params: dict):
+        self.client = client
+        self.fn = fn
+        self.params = params
+
+    def _resolve(self) -> _Function:
+        for fn in self.client.functions.get(self.fn, []):
+            names = [name for name, _ in fn.args]
+            if set(self.params) <= set(names) and all(name in self.params for name in names[:fn.required]):
+                return fn
+        raise QueryError(f"No function {self.fn}({', '.join(self.params)}) in the schema")
+
+    def _sql(self) -> str:
+        fn = self._resolve()
+        provided = [(name, type_name) for name, type_name in fn.args if name in self.params]
+        call = f"{_ident(fn.name)}({', '.join(f'{_ident(n)} := _a.{_ident(n)}' for n, _ in provided)})"
+        source = f"json_to_record($1::json) AS _a({', '.join(f'{_ident(n)} {t}' for n, t in provided)})"
+
+        if fn.returns_set or fn.returns_row:
+            rows = f"{source}, LATERAL {call} _r" if provided else f"{call} _r"
+            agg = "coalesce(json_agg(_r), '[]')" if fn.returns_set else "row_to_json(_r)"
+            return f"SELECT {agg}::text FROM {rows}"
+        source = f" FROM {source}" if provided else ""
+        if fn.returns_void:
+            return f"SELECT 'null' FROM (SELECT {call}{source}) _r"
+        return f"SELECT to_json({call})::text{source}"
+
+    async def execute(self) -> QueryResult:
+        sql = self._sql()
+        DB_STATS["requests"] += 1
+        DB_STATS["rpcs"] += 1
+        args = [json.dumps(self.params, default=str)] if "$1" in sql else []
+        return QueryResult(await self.client.fetch_json(sql, *args))
+
+
+async def _connect_postgres() -> PgClient:
+    global _pg
+    if asyncpg is None:
+        raise RuntimeError("DB_BACKEND=postgres needs the asyncpg package")
+    if not DATABASE_URL:
+        raise RuntimeError("DB_BACKEND=postgres needs DATABASE_URL")
+
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_PG_MIN_SIZE,
+        max_size=DB_PG_MAX_SIZE,
+        timeout=DB_CONNECT_TIMEOUT,
+        command_timeout=DB_TIMEOUT,
+        statement_cache_size=DB_PG_STATEMENT_CACHE_SIZE,
+        # UTC so timestamptz values render like PostgREST's (+00:00)
+        server_settings={"application_name": "cdss-backend", "TimeZone": "UTC"}
+    )
+    _pg = PgClient(pool)
+    await _pg.load_catalog()
+    log.info("Postgres pool ready", extra={"min_size": DB_PG_MIN_SIZE, "max_size": DB_PG_MAX_SIZE})
+    return _pg
+
+
+#######################
+# Entry points
+#######################
+
+async def connect(url: str | None, key: str | None) -> AsyncClient | PgClient:
+    """
+    Client for DB_BACKEND; url / key are the Supabase project URL and API key (postgrest only).
+    """
+    if DB_BACKEND == "postgres":
+        return await _connect_postgres()
+    if DB_BACKEND != "postgrest":
+        raise RuntimeError(f"Unknown DB_BACKEND {DB_BACKEND!r} (expected postgrest or postgres)")
+    return await _connect_postgrest(url, key)
+
+
+async def close() -> None:
+    global _http, _pg
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+    if _pg is not None:
+        await _pg.close()
+        _pg = None
+
+
+def get_db_stats() -> dict:
+    stats = {**DB_STATS, "backend": DB_BACKEND}
+    if _pg is not None:
+        stats["pool_size"] = _pg.pool.get_size()
+        stats["pool_idle"] = _pg.pool.get_idle_size()
+        stats["pool_max"] = DB_PG_MAX_SIZE
+    else:
+        stats["pool_max"] = DB_HTTP_MAX_CONNECTIONS
+    return stats
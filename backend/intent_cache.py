@@ -0,0 +1,84 @@
+# intent_cache.py
+import copy
+import os
+
+from ttl_cache import TTLCache
+from intent_rules import normalize_message
+
+
+# Memoizes run_llm_extract_intent results (temperature=0, so identical inputs give identical intents).
+# Today's date is part of the key, so relative dates ("tomorrow") are always resolved against the
+# current day, and the whole cache is dropped when the day changes.
+# Slot choices are never cached: "the 2:30 one" resolves to an index into this session's own
+# offered list, which another session with the same message, task and day does not share.
+
+INTENT_CACHE_TTL = float(os.getenv("INTENT_CACHE_TTL", "3600"))
+INTENT_CACHE_MAX = int(os.getenv("INTENT_CACHE_MAX", "5000"))
+# Very short replies ("yes", "the later one") depend on the conversation, not just the text
+INTENT_CACHE_MIN_WORDS = 3
+
+_cache = TTLCache(maxsize=INTENT_CACHE_MAX, ttl=INTENT_CACHE_TTL)
+_cache_day: str | None = None
+
+INTENT_CACHE_STATS = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def intent_cache_key(
+    message: str,
+    role: str,
+    today_iso: str,
+    user_tz: str,
+    task_id: str | None,
+    has_slot_mapping: bool
+) -> tuple | None:
+    """
+    Returns the cache key for this turn, or None when the message should not be cached
+    (too short, or a slot list is on offer and the answer may pick from it).
+    """
+    if has_slot_mapping:
+        return None
+    text = normalize_message(message)
+    if len(text.split()) < INTENT_CACHE_MIN_WORDS:
+        return None
+    return (text, role, today_iso, user_tz, task_id or "")
+
+
+def _roll_day(today_iso: str) -> None:
+    global _cache_day
+    if _cache_day != today_iso:
+        _cache.clear()
+        _cache_day = today_iso
+
+
+def get_cached_intent(key: tuple | None) -> dict | None:
+    if key is None:
+        return None
+    _roll_day(key[2])
+    result = _cache.get(key)
+    if result is None:
+        INTENT_CACHE_STATS["misses"] += 1
+        return None
+    INTENT_CACHE_STATS["hits"] += 1
+    return copy.deepcopy(result)
+
+
+def store_intent(key: tuple | None, result: dict) -> None:
+    if key is None or not isinstance(result, dict) or not result.get("action"):
+        return
+    if (result.get("arguments") or {}).get("slot_index"):
+        return
+    _roll_day(key[2])
+    _cache.set(key, copy.deepcopy(result))
+
+
+def get_intent_cache_stats() -> dict:
+    total = INTENT_CACHE_STATS["hits"] + INTENT_CACHE_STATS["misses"]
+    return {
+        "hits": INTENT_CACHE_STATS["hits"],
+        "misses": INTENT_CACHE_STATS["misses"],
+        "hit_rate": round(INTENT_CACHE_STATS["hits"] / total, 4) if total else 0.0,
+        "size": len(_cache),
+    }
@@ -0,0 +1,114 @@
+# intent_rules.py
+import re
+
+
+# Local pre-classifier for trivial turns. It returns the same {action, arguments}
+# structure as run_llm_extract_intent, and only for high-confidence patterns;
+# anything else returns None and goes to the LLM.
+
+WORD_NUMBERS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "1st": 1, "2nd": 2, "3rd": 3, "4th": 4, "5th": 5,
+}
+
+_NUM = r"(\d{1,2}|" + "|".join(WORD_NUMBERS) + r")"
+
+SLOT_CHOICE_RE = re.compile(
+    r"^(?:(?:i(?:'ll| will)?|let'?s|please)\s+)?"
+    r"(?:(?:take|pick|choose|go with|book)\s+)?"
+    r"(?:the\s+)?(?:(?:number|option|slot|no\.?|#)\s*)?"
+    + _NUM +
+    r"(?:\s+(?:one|option|slot))?(?:\s*,?\s*please)?$"
+)
+CANCEL_NEXT_RE = re.compile(
+    r"^(?:please\s+)?cancel\s+(?:my\s+)?(?:next|upcoming)\s+appointment(?:\s+please)?$"
+)
+SHOW_APPTS_RE = re.compile(
+    r"^(?:(?:please\s+)?(?:show|list|view|see|check)(?:\s+me)?|what are)\s+"
+    r"(?:all\s+)?my\s+(?:upcoming\s+)?appointments(?:\s+please)?$"
+)
+SHOW_SCHEDULE_RE = re.compile(
+    r"^(?:(?:please\s+)?(?:show|view|see|check)(?:\s+me)?|what'?s|what is)\s+my\s+schedule(?:\s+please)?$"
+)
+GREETING_RE = re.compile(r"^(?:hi|hello|hey|hi there|hello there|good (?:morning|afternoon|evening))$")
+HELP_RE = re.compile(r"^(?:help|what can you do|how does this work)$")
+THANKS_RE = re.compile(r"^(?:thanks|thank you|thank you very much|thanks a lot|ok thanks|okay thanks)$")
+
+
+FAST_PATH_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "by_action": {},
+}
+
+
+def normalize_message(message: str) -> str:
+    text = (message or "").strip().lower()
+    text = re.sub(r"[\s]+", " ", text)
+    return text.strip(" .!?")
+
+
+def _parse_number(token: str) -> int | None:
+    if token.isdigit():
+        return int(token)
+    return WORD_NUMBERS.get(token)
+
+
+def _match(message: str, role: str, task_id: str | None, slot_mapping: dict | None) -> dict | None:
+    text = normalize_message(message)
+    if not text:
+        return None
+
+    # Slot selection right after a numbered slot list was offered, while that booking is still the task
+    if role == "patient" and task_id == "BOOK_APPT" and slot_mapping:
+        m = SLOT_CHOICE_RE.match(text)
+        if m:
+            index = _parse_number(m.group(1))
+            if index in slot_mapping:
+                return {"action": "book_appointment", "arguments": {"slot_index": index, "description": ""}}
+            return None
+
+    if CANCEL_NEXT_RE.match(text):
+        return {"action": "cancel_appointment", "arguments": {"target": "next", "target_date": ""}}
+
+    if SHOW_APPTS_RE.match(text):
+        return {"action": "show_appointments", "arguments": {}}
+
+    if role == "doctor" and SHOW_SCHEDULE_RE.match(text):
+        return {"action": "show_my_schedule", "arguments": {}}
+
+    # Small talk only when no task is in progress, so "thanks" doesn't drop a pending flow
+    if task_id is None:
+        if GREETING_RE.match(text):
+            return {"action": "general_chat", "arguments": {"type": "intro"}}
+        if HELP_RE.match(text):
+            return {"action": "general_chat", "arguments": {"type": "help"}}
+        if THANKS_RE.match(text):
+            return {"action": "general_chat", "arguments": {"type": "empty"}}
+
+    return None
+
+
+def classify_intent_fast(message: str, role: str, task_id: str | None = None, slot_mapping: dict | None = None) -> dict | None:
+    """
+    Returns {action, arguments} for a high-confidence pattern, otherwise None (use the LLM).
+    """
+    result = _match(message, role, task_id, slot_mapping)
+    if result:
+        FAST_PATH_STATS["hits"] += 1
+        by_action = FAST_PATH_STATS["by_action"]
+        by_action[result["action"]] = by_action.get(result["action"], 0) + 1
+    else:
+        FAST_PATH_STATS["misses"] += 1
+    return result
+
+
+def get_fast_path_stats() -> dict:
+    total = FAST_PATH_STATS["hits"] + FAST_PATH_STATS["misses"]
+    return {
+        "hits": FAST_PATH_STATS["hits"],
+        "misses": FAST_PATH_STATS["misses"],
+        "hit_rate": round(FAST_PATH_STATS["hits"] / total, 4) if total else 0.0,
+        "by_action": dict(FAST_PATH_STATS["by_action"]),
+    }
@@ -2,17 +2,22 @@
 
 import os
 import json
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from metrics import timed
+from app_logging import get_logger
 load_dotenv()
 
+log = get_logger("llm")
+
 
 # OpenAI setup
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-def call_llm_json(system_prompt: str, messages: list[dict]) -> dict:
+@timed("llm")
+async def call_llm_json(system_prompt: str, messages: list[dict]) -> dict:
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4-1106-preview",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -43,7 +48,13 @@ def call_llm_json(system_prompt: str, messages: list[dict]) -> dict:
                                         "days_ahead": {"type": "integer"},
                                         "slot_time": {"type": "string"},
                                         "type": {"type": "string"},  # for general_chat
-                                        "time_pref": {"type": "string"}
+                                        "time_pref": {"type": "string"},
+                                        "weekday": {"type": "string"},  # for book_series
+                                        "occurrences": {"type": "integer"},
+                                        "interval_weeks": {"type": "integer"},
+                                        "end_date": {"type": "string"},  # for block / reactivate_time_range
+                                        "start_time": {"type": "string"},
+                                        "end_time": {"type": "string"}
                                     },
                                     "required": [] 
                                 }
@@ -62,18 +73,19 @@ def call_llm_json(system_prompt: str, messages: list[dict]) -> dict:
             args_json_str = tool_calls[0].function.arguments
             return json.loads(args_json_str)
 
-        print("[WARN] No tool_calls returned")
+        log.warning("No tool_calls returned")
         return {}
     except Exception as e:
-        print("[LLM ERROR] call_llm_json failed:", e)
+        log.error("call_llm_json failed: %s", e)
         return {}
 
 
 
-def call_llm(system_prompt: str, messages: list[dict]) -> str:
+@timed("llm")
+async def call_llm(system_prompt: str, messages: list[dict]) -> str:
 
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4-1106-preview",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -83,7 +95,33 @@ def call_llm(system_prompt: str, messages: list[dict]) -> str:
         )
         return response.choices[0].message.content or ""
     except Exception as e:
-        print("[LLM ERROR] call_llm failed:", e)
+        log.error("call_llm failed: %s", e)
         return ""
 
 
+
+
+
+@timed("llm")
+async def call_llm_stream(system_prompt: str, messages: list[dict]):
+    """
+    Same request as call_llm, but yields the reply text chunk by chunk as it is generated.
+    """
+    try:
+        stream = await client.chat.completions.create(
+            model="gpt-4-1106-preview",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                *messages
+            ],
+            temperature=0.5,
+            stream=True
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    except Exception as e:
+        log.error("call_llm_stream failed: %s", e)
@@ -1,14 +1,23 @@
 #main.py
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
 import json
+import os
+import time
+import asyncio
+import contextlib
+
+from app_logging import setup_logging, shutdown_logging, get_logger, sampled, get_logging_stats
+setup_logging()
 
 from supabase_utils import (
     log_conversation, 
-    delete_conversations, 
-    get_memory_history
+    delete_conversations
 )
 
 from supabase_utils import (
@@ -17,19 +26,66 @@ from supabase_utils import (
     get_user_info_by_email,
     auth_dependency,
     login_user,
-    get_user_by_uuid_and_role,
-    get_session_task,
-    get_slot_mapping
+    init_supabase,
+    close_supabase,
+    availability_index,
+    conversation_writer,
+    run_slot_sweep_loop,
+    get_slot_hold_stats
 )
 
+from intent_rules import get_fast_path_stats
+from intent_cache import get_intent_cache_stats
+from availability_index import get_availability_index_stats
+from password_hashing import get_password_hash_stats, shutdown_password_hashing
+from write_behind import get_write_behind_stats
+from db import get_db_stats
+from metrics import start_trace, finish_trace, set_trace_labels, register_stats, render_metrics
+
+log = get_logger("main")
+
+# Share of successful requests written to the access log (errors are always logged)
+LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1.0"))
+
 from chatbot_services import (
     run_llm_extract_intent,
     run_llm_natural_reply,
-    handle_action_dispatch
+    handle_action_dispatch,
+    prefetch_turn_context,
+    run_llm_natural_reply_stream,
+    render_final_reply
 )
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_supabase()
+    refresher = asyncio.create_task(availability_index.run_refresh_loop())
+    slot_sweeper = asyncio.create_task(run_slot_sweep_loop())
+    conversation_writer.start()
+    yield
+    for task in (refresher, slot_sweeper):
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    # Write out queued conversation rows / task updates before the process exits
+    await conversation_writer.drain()
+    await close_supabase()
+    shutdown_password_hashing()
+    shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Existing counters, also exported as gauges on /metrics
+register_stats("intent_fast_path", get_fast_path_stats)
+register_stats("intent_cache", get_intent_cache_stats)
+register_stats("availability_index", lambda: get_availability_index_stats(availability_index))
+register_stats("password_hashing", get_password_hash_stats)
+register_stats("write_behind", lambda: get_write_behind_stats(conversation_writer))
+register_stats("logging", get_logging_stats)
+register_stats("db", get_db_stats)
+register_stats("slot_holds", get_slot_hold_stats)
 
 
 # Allow React frontend to call backend
@@ -78,6 +134,7 @@ class RegisterRequest(BaseModel):
 class ChatRequest(BaseModel):
     message: str               
     context: Optional[dict]    
+    stream: bool = False       # Stream the reply as server-sent events
 
 class LoginRequest(BaseModel):
     emailid:    str
@@ -89,30 +146,68 @@ class LogoutRequest(BaseModel):
 
 ################User registration and login################
 @app.post("/register/doctor")
-def register_doctor(req: DoctorRegisterRequest):
-    return register_doctor_user(req)
+async def register_doctor(req: DoctorRegisterRequest):
+    return await register_doctor_user(req)
 
 @app.post("/register/patient")
-def register_patient(req: PatientRegisterRequest):
-    return register_patient_user(req)
+async def register_patient(req: PatientRegisterRequest):
+    return await register_patient_user(req)
 
 
 @app.post("/login")
-def login(req: LoginRequest):
-    data, err = login_user(req.emailid, req.password)
+async def login(req: LoginRequest):
+    data, err = await login_user(req.emailid, req.password)
     if err:
         raise HTTPException(status_code=401, detail=err)
     return data
 
 @app.post("/logout")
-def logout(req: LogoutRequest):
-    delete_conversations(req.session_id)
+async def logout(req: LogoutRequest):
+    await delete_conversations(req.session_id)
     return {"ok": True}
 
 
+@app.get("/stats/intent")
+async def intent_stats():
+    return {
+        "fast_path": get_fast_path_stats(),
+        "cache": get_intent_cache_stats()
+    }
+
+
+@app.get("/stats/availability")
+async def availability_stats():
+    return get_availability_index_stats(availability_index)
+
+
+@app.get("/stats/password-hashing")
+async def password_hashing_stats():
+    return get_password_hash_stats()
+
+
+@app.get("/stats/write-behind")
+async def write_behind_stats():
+    return get_write_behind_stats(conversation_writer)
+
+
+@app.get("/stats/db")
+async def db_stats():
+    return get_db_stats()
+
+
+@app.get("/stats/slot-holds")
+async def slot_hold_stats():
+    return get_slot_hold_stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/user")
-def get_user(emailid: str, role: str):
-    user = get_user_info_by_email(emailid, role)
+async def get_user(emailid: str, role: str):
+    user = await get_user_info_by_email(emailid, role)
     if user:
         return user
     return {"error": "User not found"}, 404
@@ -131,35 +226,98 @@ def clean_history_for_llm(history: list[dict]) -> list[dict]:
 
 @app.middleware("http")
 async def log_requests(request: ChatRequest, call_next):
-    print(f"→ Incoming: {request.method} {request.url.path}")
-    response = await call_next(request)
-    print(f"← Outgoing: {response.status_code}")
+    trace = start_trace()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        # Unrouted paths share one label so scanners can't grow the metric set
+        finish_trace(trace, request.method, request.url.path if status_code != 404 else "unmatched", status_code)
+        fields = {
+            "status": status_code,
+            "duration_ms": round((time.perf_counter() - trace.started) * 1000, 1),
+            "action": trace.action,
+            "role": trace.role,
+        }
+        if status_code >= 500:
+            log.error("%s %s %s", request.method, request.url.path, status_code, extra=fields)
+        else:
+            log.info("%s %s %s", request.method, request.url.path, status_code, extra=sampled(LOG_ACCESS_SAMPLE_RATE, **fields))
     return response
 
 @app.post("/chat/voice")
-def handle_voice(req: ChatRequest, user=Depends(auth_dependency)):
-    print(f"[VOICE] Explicit voice endpoint called: {req.message}")
-    return chat_endpoint(req, user)  
+async def handle_voice(req: ChatRequest, user=Depends(auth_dependency)):
+    log.debug("Voice endpoint called", extra={"message_chars": len(req.message)})
+    return await chat_endpoint(req, user)  
 
 @app.post("/chat/text")
-def handle_text(req: ChatRequest, user=Depends(auth_dependency)):
-    print(f"[TEXT] Explicit text endpoint called: {req.message}")
-    return chat_endpoint(req, user)
+async def handle_text(req: ChatRequest, user=Depends(auth_dependency)):
+    log.debug("Text endpoint called", extra={"message_chars": len(req.message)})
+    return await chat_endpoint(req, user)
+
+
+async def chat_endpoint(req: ChatRequest, user=Depends(auth_dependency)):
+
+    turn = await prepare_turn(req, user)
+    if turn.get("error_reply"):
+        return {"reply": turn["error_reply"]}
 
+    # Deterministic handler replies are used as-is, skipping the second LLM round
+    final_reply = render_final_reply(turn["routed_response"])
+    if final_reply is not None:
+        turn["reply"] = final_reply
 
-def chat_endpoint(req: ChatRequest, user=Depends(auth_dependency)):
+    # Streaming mode: send the structured part now, then the reply tokens as they arrive.
+    # The conversation is logged once the stream has completed.
+    if req.stream:
+        return StreamingResponse(
+            stream_turn(turn),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(finish_turn, turn)
+        )
 
+    # 6. Second round of LLM: Generating natural language
+    if final_reply is None:
+        turn["reply"] = await run_llm_natural_reply(
+            message=turn["summary_prompt"],
+            session_id=turn["session_id"],
+            user=turn["user"],
+            context=turn["context"],
+            history_override=clean_history_for_llm(turn["history"])
+        )
+
+        log.debug("Second LLM reply: %d chars", len(turn["reply"]))
+
+    await finish_turn(turn)
+
+    # 9. Return to front end
+    return {
+        "reply": turn["reply"],
+        "available_slots": turn_available_slots(turn)
+    }
+
+
+async def prepare_turn(req: ChatRequest, user: dict) -> dict:
+    """
+    Everything up to (not including) the second LLM round: prefetch, intent extraction,
+    dispatch and the summary prompt. Returns the turn state used by the reply stages.
+    """
 
     # 0. Extracting the context field
     context = req.context or {}
     session_id = context.get("session_id")
     input_mode = context.get("input_mode")
     role = user["role"]  
+    set_trace_labels(role=role)
 
-    # 1. Get complete user information
-    db_user = get_user_by_uuid_and_role(user["uuid"], role)
+    # 1. Prefetch everything this turn needs in one concurrent round:
+    #    user profile, history, current task_id and slot_index → segment_id mapping
+    prefetched = await prefetch_turn_context(session_id, user, history_limit=6)
+    db_user = prefetched["db_user"]
     if not db_user:
-        return {"reply": "Error: No user context found."}
+        return {"error_reply": "Error: No user context found."}
 
     full_user = {
         "id": db_user["id"],
@@ -169,15 +327,15 @@ def chat_endpoint(req: ChatRequest, user=Depends(auth_dependency)):
         "lname": db_user.get("lname", ""),
         "emailid": db_user.get("emailid", "")
     }
-    # Debug: Print basic information of the received request
-
+    context["task_id"] = prefetched["task_id"]
+    context["slot_mapping"] = prefetched["slot_mapping"]
 
     # 2. Get the historical memory and add the user's current input
-    history = get_memory_history(session_id, limit=6)
+    history = prefetched["history"]
     history.append({"role": "user", "content": req.message})
 
     # 3. First round of LLM: Structured Intent Recognition
-    extracted, _ = run_llm_extract_intent(
+    extracted, _ = await run_llm_extract_intent(
         message=req.message,
         session_id=session_id,
         user=full_user,
@@ -185,19 +343,16 @@ def chat_endpoint(req: ChatRequest, user=Depends(auth_dependency)):
         history_override=history
     )
 
-    print(f"[First LLM intend Extracted] {extracted}")
-    # Preload the slot_index → segment_id mapping in advance to avoid repeated queries
-    slot_mapping = get_slot_mapping(session_id)
-    context["slot_mapping"] = slot_mapping
+    log.debug("Intent extracted: %s", extracted.get("action"))
 
     # 4. handler executes the task → returns the structure result
-    routed_response = handle_action_dispatch(extracted, full_user, context=context or {})
+    routed_response = await handle_action_dispatch(extracted, full_user, context=context or {})
     
 
     # 5. Construct the second round of summary prompts
     structured_summary = json.dumps(routed_response, ensure_ascii=False, indent=2) if isinstance(routed_response, dict) else str(routed_response)    
-    # Get the current task_id status
-    task_id = get_session_task(session_id)
+    # Current task_id status, as updated by the handlers during dispatch
+    task_id = context.get("task_id")
     # Splice the natural language summary prompt to bring in the current task status
     summary_prompt = f"""
     [System Info]
@@ -232,16 +387,66 @@ def chat_endpoint(req: ChatRequest, user=Depends(auth_dependency)):
         Just gently prompt the user to pick one option (e.g., "Please pick a number from the list").
         """
 
-    # 6. Second round of LLM: Generating natural language
-    final_reply = run_llm_natural_reply(
-        message=summary_prompt,
-        session_id=session_id,
-        user=full_user,
-        context=context,
-        history_override=clean_history_for_llm(history)
-    )
+    return {
+        "message": req.message,
+        "session_id": session_id,
+        "input_mode": input_mode,
+        "user": full_user,
+        "context": context,
+        "history": history,
+        "routed_response": routed_response,
+        "summary_prompt": summary_prompt,
+        "reply": ""
+    }
+
+
+def turn_available_slots(turn: dict) -> list:
+    routed_response = turn["routed_response"]
+    return routed_response.get("available_slots", []) if isinstance(routed_response, dict) else []
+
 
-    print(f"[Second LLM natural_reply] {final_reply}")
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_turn(turn: dict):
+    """
+    SSE body for streaming mode:
+      meta  → {available_slots, result} as soon as dispatch has finished
+      token → {text} for every reply chunk from the second LLM round
+      done  → {reply} with the full reply text
+    """
+    routed_response = turn["routed_response"]
+    yield sse_event("meta", {
+        "available_slots": turn_available_slots(turn),
+        "result": routed_response if isinstance(routed_response, dict) else None
+    })
+
+    if turn["reply"]:
+        # Already rendered by the handler, nothing to generate
+        yield sse_event("token", {"text": turn["reply"]})
+        yield sse_event("done", {"reply": turn["reply"]})
+        return
+
+    parts = []
+    async for chunk in run_llm_natural_reply_stream(
+        message=turn["summary_prompt"],
+        session_id=turn["session_id"],
+        user=turn["user"],
+        context=turn["context"],
+        history_override=clean_history_for_llm(turn["history"])
+    ):
+        parts.append(chunk)
+        yield sse_event("token", {"text": chunk})
+
+    turn["reply"] = "".join(parts)
+    log.debug("Second LLM reply: %d chars", len(turn["reply"]))
+    yield sse_event("done", {"reply": turn["reply"]})
+
+
+async def finish_turn(turn: dict):
+    full_user = turn["user"]
+    routed_response = turn["routed_response"]
 
     # 7. Try to get the ID from routed_response, allowing it to be empty
     if full_user["role"] == "patient":
@@ -253,22 +458,13 @@ def chat_endpoint(req: ChatRequest, user=Depends(auth_dependency)):
 
 
     # 8. Write conversations (allow patient_id or doctor_id to be NULL)
-    log_conversation(
-        session_id=session_id,
+    await log_conversation(
+        session_id=turn["session_id"],
         patient_id=patient_id,
         doctor_id=doctor_id,
         role=full_user["role"],
-        input=req.message,
-        response=final_reply,
-        input_mode=input_mode,
+        input=turn["message"],
+        response=turn["reply"],
+        input_mode=turn["input_mode"],
         meta=routed_response if isinstance(routed_response, dict) else None
-)
-
-
-    # 9. Return to front end
-    return {
-        "reply": final_reply,
-        "available_slots": routed_response.get("available_slots", []) if isinstance(routed_response, dict) else []
-    }
-
-
+    )
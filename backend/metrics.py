@@ -0,0 +1,242 @@
+# metrics.py
+import contextvars
+import functools
+import inspect
+import os
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Callable
+
+from app_logging import get_logger
+
+
+# Per-stage latency tracing. Functions decorated with @timed(stage) record a span
+# (stage, name, duration). Spans taken while a request is being served are attached
+# to that request's Trace and aggregated when it ends, labelled with the request's
+# action (the dispatched intent) and role, both of which are only known half-way
+# through the turn. Spans outside a request (background flushers, refresh loops) or
+# after it ended (streamed replies, background tasks) are recorded right away.
+#
+# render_metrics() returns everything in the Prometheus text format for GET /metrics.
+# With METRICS_TRACE_LOG=1 every request also logs one "trace" line with its spans.
+
+METRICS_TRACE_LOG = os.getenv("METRICS_TRACE_LOG", "0") == "1"
+
+log = get_logger("metrics")
+
+# Seconds; LLM calls sit in the upper buckets, cached reads in the lowest ones
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+NO_LABEL = "none"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+# (stage, name, action, role) → Histogram
+_stage_histograms: dict[tuple[str, str, str, str], Histogram] = {}
+# (stage, name, action, role) → number of calls that raised
+_stage_errors: dict[tuple[str, str, str, str], int] = {}
+# (method, path, status, action, role) → Histogram
+_request_histograms: dict[tuple[str, str, str, str, str], Histogram] = {}
+
+# name → function returning a flat dict of numbers, exported as gauges
+_stats_sources: dict[str, Callable[[], dict]] = {}
+
+
+@dataclass
+class Trace:
+    action: str = NO_LABEL
+    role: str = NO_LABEL
+    started: float = field(default_factory=time.perf_counter)
+    spans: list[tuple[str, str, float, bool]] = field(default_factory=list)   # (stage, name, seconds, failed)
+    finished: bool = False
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def set_trace_labels(action: str | None = None, role: str | None = None) -> None:
+    """
+    Label the current request. Spans already taken pick the labels up when the trace ends.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    if action:
+        trace.action = action
+    if role:
+        trace.role = role
+
+
+def _observe_span(stage: str, name: str, seconds: float, failed: bool, action: str, role: str) -> None:
+    key = (stage, name, action, role)
+    histogram = _stage_histograms.get(key)
+    if histogram is None:
+        histogram = _stage_histograms[key] = Histogram()
+    histogram.observe(seconds)
+    if failed:
+        _stage_errors[key] = _stage_errors.get(key, 0) + 1
+
+
+def record_span(stage: str, name: str, seconds: float, failed: bool = False) -> None:
+    trace = _current_trace.get()
+    if trace is None:
+        _observe_span(stage, name, seconds, failed, NO_LABEL, NO_LABEL)
+    elif trace.finished:
+        _observe_span(stage, name, seconds, failed, trace.action, trace.role)
+    else:
+        trace.spans.append((stage, name, seconds, failed))
+
+
+def finish_trace(trace: Trace, method: str, path: str, status: int) -> None:
+    trace.finished = True
+    total = time.perf_counter() - trace.started
+    for stage, name, seconds, failed in trace.spans:
+        _observe_span(stage, name, seconds, failed, trace.action, trace.role)
+
+    key = (method, path, str(status), trace.action, trace.role)
+    histogram = _request_histograms.get(key)
+    if histogram is None:
+        histogram = _request_histograms[key] = Histogram()
+    histogram.observe(total)
+
+    if METRICS_TRACE_LOG:
+        log.info("trace", extra={
+            "method": method,
+            "path": path,
+            "status": status,
+            "action": trace.action,
+            "role": trace.role,
+            "total_ms": round(total * 1000, 1),
+            "spans": [
+                {"stage": stage, "name": name, "ms": round(seconds * 1000, 1), "failed": failed}
+                for stage, name, seconds, failed in trace.spans
+            ],
+        })
+
+
+def timed(stage: str, name: str | None = None):
+    """
+    Decorator recording a span for every call of an async function or async generator
+    (for generators the span covers the whole iteration).
+    """
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def gen_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = False
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    record_span(stage, span_name, time.perf_counter() - start, failed)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = False
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                record_span(stage, span_name, time.perf_counter() - start, failed)
+        return wrapper
+
+    return decorator
+
+
+def register_stats(name: str, source: Callable[[], dict]) -> None:
+    """
+    Export the numeric values of an existing get_*_stats() function as app_<name>_<key> gauges.
+    """
+    _stats_sources[name] = source
+
+
+#######################
+# Prometheus text format
+#######################
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_label_value(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _render_histogram(lines: list[str], metric: str, labels: dict, histogram: Histogram) -> None:
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f"{metric}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{metric}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{metric}_sum{_labels(**labels)} {histogram.sum:.6f}")
+    lines.append(f"{metric}_count{_labels(**labels)} {histogram.count}")
+
+
+def render_metrics() -> str:
+    lines = [
+        "# HELP app_stage_duration_seconds Time spent per call, by stage (supabase / llm / handler / chat) and function.",
+        "# TYPE app_stage_duration_seconds histogram",
+    ]
+    for (stage, name, action, role), histogram in sorted(_stage_histograms.items()):
+        _render_histogram(lines, "app_stage_duration_seconds",
+                          {"stage": stage, "name": name, "action": action, "role": role}, histogram)
+
+    lines += [
+        "# HELP app_stage_errors_total Calls that raised, by stage and function.",
+        "# TYPE app_stage_errors_total counter",
+    ]
+    for (stage, name, action, role), count in sorted(_stage_errors.items()):
+        lines.append(f"app_stage_errors_total{_labels(stage=stage, name=name, action=action, role=role)} {count}")
+
+    lines += [
+        "# HELP app_request_duration_seconds HTTP request latency (until the response headers for streamed replies).",
+        "# TYPE app_request_duration_seconds histogram",
+    ]
+    for (method, path, status, action, role), histogram in sorted(_request_histograms.items()):
+        _render_histogram(lines, "app_request_duration_seconds",
+                          {"method": method, "path": path, "status": status, "action": action, "role": role}, histogram)
+
+    for source_name, source in _stats_sources.items():
+        try:
+            stats = source()
+        except Exception as e:
+            log.error("Stats source %s failed: %s", source_name, e)
+            continue
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = f"app_{source_name}_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+
+    return "\n".join(lines) + "\n"
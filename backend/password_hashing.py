@@ -0,0 +1,106 @@
+# password_hashing.py
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+# bcrypt is deliberately slow (~100ms+ of CPU per call). Running it on the event loop
+# stalls every other request in the worker, so hashing and verification go to a small
+# dedicated process pool. At most PASSWORD_HASH_MAX_PENDING jobs are handed to the pool;
+# further callers wait on the semaphore, so a login storm queues up instead of using
+# every core.
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 2)))
+
+_executor: ProcessPoolExecutor | None = None
+_slots: asyncio.Semaphore | None = None
+
+HASH_STATS = {
+    "queue_depth": 0,         # callers waiting for a pool slot or running
+    "max_queue_depth": 0,
+    "completed": 0,
+    "failed": 0,
+    "hash_ms_total": 0.0,     # CPU time inside the worker
+    "hash_ms_max": 0.0,
+    "wait_ms_total": 0.0,     # time from the call until the worker picked the job up
+    "wait_ms_max": 0.0,
+}
+
+
+def _hash(password: str) -> tuple[str, float]:
+    start = time.perf_counter()
+    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    return hashed, time.perf_counter() - start
+
+
+def _check(password: str, hashed: str) -> tuple[bool, float]:
+    start = time.perf_counter()
+    ok = bcrypt.checkpw(password.encode(), hashed.encode())
+    return ok, time.perf_counter() - start
+
+
+def _get_pool() -> tuple[ProcessPoolExecutor, asyncio.Semaphore]:
+    global _executor, _slots
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        _slots = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+    return _executor, _slots
+
+
+async def _run(fn, *args):
+    executor, slots = _get_pool()
+    HASH_STATS["queue_depth"] += 1
+    HASH_STATS["max_queue_depth"] = max(HASH_STATS["max_queue_depth"], HASH_STATS["queue_depth"])
+    submitted = time.perf_counter()
+    try:
+        async with slots:
+            result, cpu_seconds = await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    except Exception:
+        HASH_STATS["failed"] += 1
+        raise
+    finally:
+        HASH_STATS["queue_depth"] -= 1
+
+    hash_ms = cpu_seconds * 1000
+    wait_ms = max((time.perf_counter() - submitted) * 1000 - hash_ms, 0.0)
+    HASH_STATS["completed"] += 1
+    HASH_STATS["hash_ms_total"] += hash_ms
+    HASH_STATS["hash_ms_max"] = max(HASH_STATS["hash_ms_max"], hash_ms)
+    HASH_STATS["wait_ms_total"] += wait_ms
+    HASH_STATS["wait_ms_max"] = max(HASH_STATS["wait_ms_max"], wait_ms)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await _run(_check, password, hashed)
+    except ValueError:
+        # Malformed hash in the DB: treat as a failed login, like bcrypt.checkpw did inline
+        return False
+
+
+def shutdown_password_hashing() -> None:
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _slots = None
+
+
+def get_password_hash_stats() -> dict:
+    done = HASH_STATS["completed"]
+    return {
+        **HASH_STATS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "hash_ms_avg": round(HASH_STATS["hash_ms_total"] / done, 2) if done else 0.0,
+        "wait_ms_avg": round(HASH_STATS["wait_ms_total"] / done, 2) if done else 0.0,
+    }
@@ -0,0 +1,64 @@
+# segment_generator.py
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from supabase_utils import init_supabase, close_supabase, generate_segments_from_shifts, regenerate_doctor_segments
+
+
+# Fills doctor_available_time_segments from doctor_shifts. The expansion runs inside Postgres
+# (generate_segments_from_shifts), so a clinic-wide month is one statement instead of a row-by-row
+# insert loop. Shift edits are picked up automatically by the doctor_shifts triggers; this script is
+# for back-filling and for extending the horizon, e.g. from a daily cron:
+#
+#   python segment_generator.py --weeks 4
+#   python segment_generator.py --doctor 3 --doctor 7 --from 2025-09-01 --weeks 2 --minutes 15
+#   python segment_generator.py --doctor 3 --from 2025-09-01 --weeks 1 --regenerate
+
+
+def _parse_start(value: str | None) -> datetime:
+    if not value:
+        return datetime.now(timezone.utc)
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+async def run(args) -> None:
+    await init_supabase()
+    try:
+        await _generate(args)
+    finally:
+        await close_supabase()
+
+
+async def _generate(args) -> None:
+    start = _parse_start(args.start)
+    end = start + timedelta(weeks=args.weeks)
+
+    if args.regenerate:
+        if not args.doctor:
+            raise SystemExit("--regenerate needs at least one --doctor")
+        for doctor_id in args.doctor:
+            result = await regenerate_doctor_segments(doctor_id, start, end, args.minutes)
+            print(f"[SEGMENTS] doctor_id={doctor_id} removed={result.get('removed', 0)} created={result.get('created', 0)}")
+        return
+
+    created = await generate_segments_from_shifts(args.doctor, start, end, args.minutes)
+    for doctor_id, count in sorted(created.items()):
+        print(f"[SEGMENTS] doctor_id={doctor_id} created={count}")
+    print(f"[SEGMENTS] {sum(created.values())} segments created for {len(created)} doctors "
+          f"between {start.isoformat()} and {end.isoformat()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate doctor time segments from doctor_shifts.")
+    parser.add_argument("--doctor", type=int, action="append", help="doctor id (repeatable, default: all doctors)")
+    parser.add_argument("--from", dest="start", help="start date/time, ISO format (default: now)")
+    parser.add_argument("--weeks", type=int, default=4, help="horizon in weeks (default: 4)")
+    parser.add_argument("--minutes", type=int, default=30, help="segment length in minutes (default: 30)")
+    parser.add_argument("--regenerate", action="store_true", help="re-sync the window with the current shifts")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
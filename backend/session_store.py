@@ -0,0 +1,148 @@
+# session_store.py
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Protocol
+
+from ttl_cache import TTLCache
+
+
+# Number of conversation rows kept per session (get_memory_history reads the oldest ones)
+SESSION_HISTORY_ROWS = 20
+# get_slot_mapping only looks at the 5 most recent rows of a session
+SLOT_MAPPING_WINDOW = 5
+
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "1800"))
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "10000"))
+
+
+@dataclass
+class SessionState:
+    """
+    Hot copy of a session's rows in the conversations table.
+    """
+    rows: list[dict] = field(default_factory=list)        # {role, input, response}, oldest first
+    row_count: int = 0                                     # total rows in the DB, rows may be capped
+    latest_row_id: int | None = None
+    task_id: str | None = None
+    slot_mapping: dict[int, int] = field(default_factory=dict)
+    slot_mapping_age: int = SLOT_MAPPING_WINDOW            # rows written since the mapping row
+
+    def current_slot_mapping(self) -> dict[int, int]:
+        return self.slot_mapping if self.slot_mapping_age < SLOT_MAPPING_WINDOW else {}
+
+
+class SessionBackend(Protocol):
+    """
+    Storage for SessionState objects. Swap the in-process default for a shared
+    store (e.g. Redis) when sessions can hit more than one worker process.
+    """
+
+    async def get(self, session_id: str) -> SessionState | None: ...
+
+    async def set(self, session_id: str, state: SessionState) -> None: ...
+
+    async def delete(self, session_id: str) -> None: ...
+
+
+class InMemorySessionBackend:
+
+    def __init__(self, maxsize: int = SESSION_CACHE_MAX, ttl: float = SESSION_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, session_id: str) -> SessionState | None:
+        return self._cache.get(session_id)
+
+    async def set(self, session_id: str, state: SessionState) -> None:
+        self._cache.set(session_id, state)
+
+    async def delete(self, session_id: str) -> None:
+        self._cache.pop(session_id)
+
+
+class SessionStore:
+    """
+    Read-through cache of per-session state. The loader fetches a session from
+    the database on a miss; writers update the cached state after each successful
+    DB write (write-through), so reads stay in memory.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Awaitable[SessionState]],
+        backend: SessionBackend | None = None
+    ):
+        self._loader = loader
+        self.backend = backend or InMemorySessionBackend()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    async def load(self, session_id: str) -> SessionState:
+        if not session_id:
+            return await self._loader(session_id)
+
+        state = await self.backend.get(session_id)
+        if state is not None:
+            return state
+
+        # Collapse concurrent misses for the same session into one DB read
+        task = self._inflight.get(session_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_and_store(session_id))
+            self._inflight[session_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(session_id, None))
+        return await task
+
+    async def _load_and_store(self, session_id: str) -> SessionState:
+        state = await self._loader(session_id)
+        await self.backend.set(session_id, state)
+        return state
+
+    async def peek(self, session_id: str) -> SessionState | None:
+        return await self.backend.get(session_id)
+
+    async def save(self, session_id: str, state: SessionState) -> None:
+        await self.backend.set(session_id, state)
+
+    async def invalidate(self, session_id: str) -> None:
+        await self.backend.delete(session_id)
+
+    def set_backend(self, backend: SessionBackend) -> None:
+        self.backend = backend
+
+
+def record_row(state: SessionState, row: dict, row_id: int | None, meta: dict | None) -> None:
+    """
+    Apply a newly inserted conversations row to the cached state.
+    """
+    if len(state.rows) < SESSION_HISTORY_ROWS:
+        state.rows.append({
+            "role": row.get("role"),
+            "input": row.get("input"),
+            "response": row.get("response"),
+        })
+    state.row_count += 1
+    if row_id is not None:
+        state.latest_row_id = row_id
+
+    mapping = slot_mapping_from_meta(meta)
+    if mapping:
+        state.slot_mapping = mapping
+        state.slot_mapping_age = 0
+    else:
+        state.slot_mapping_age += 1
+
+
+def slot_mapping_from_meta(meta) -> dict[int, int]:
+    """
+    Build slot_index → segment_id from a conversations.meta value.
+    Supports {index, segment_id} or {index, id} in slot.
+    """
+    if not isinstance(meta, dict):
+        return {}
+    mapping = {}
+    for slot in meta.get("available_slots") or []:
+        try:
+            mapping[int(slot["index"])] = int(slot.get("segment_id") or slot.get("id"))
+        except Exception:
+            continue
+    return mapping
@@ -0,0 +1,128 @@
+# slot_filter.py
+import re
+from datetime import timezone, tzinfo
+from typing import Sequence
+
+from time_utils import local_minutes, utc_offset
+
+try:
+    import numpy as np
+except ImportError:        # optional: the same filters run as plain Python loops
+    np = None
+
+
+# Batch time-of-day filtering and earliest-first ranking of segments, replacing one
+# slot_matches_time_with_tz call per segment. Inputs are parallel sequences of start
+# epochs (and optionally statuses); results are positions into them. With NumPy the
+# offset lookup, minute-of-day test, status test and ranking are array operations, so
+# a scan over months of segments takes a few milliseconds.
+
+# Local minute-of-day windows [first, last) — same boundaries as the search_available_segments RPC
+TIME_OF_DAY_MINUTES = {
+    "morning": (0, 12 * 60),
+    "afternoon": (12 * 60, 17 * 60),
+    "evening": (17 * 60, 21 * 60),
+}
+
+_EXACT_TIME_RE = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+
+def time_window(time_pref: str | None, exact: bool = False) -> tuple[int, int] | None:
+    """
+    Minute-of-day window accepted by time_pref: "morning" / "afternoon" / "evening",
+    or with exact=True an "HH:MM" (that one minute). None for anything else, meaning any
+    time — as in slot_matches_time_with_tz and the RPC, which ignore exact times.
+    """
+    text = (time_pref or "").strip().lower()
+    m = _EXACT_TIME_RE.match(text) if exact else None
+    if m:
+        minute = int(m.group(1)) * 60 + int(m.group(2))
+        return minute, minute + 1
+    return TIME_OF_DAY_MINUTES.get(text)
+
+
+def as_array(values: Sequence, dtype=None):
+    """
+    values as a NumPy array when NumPy is installed, otherwise unchanged.
+    """
+    return np.asarray(values, dtype=dtype) if np is not None else values
+
+
+def _offset_array(starts, tz: tzinfo):
+    if isinstance(tz, timezone):
+        return int(tz.utcoffset(None).total_seconds())
+    # One offset lookup per UTC day touched; only days whose offset differs from the
+    # next day's (a DST change) are resolved per 15-minute block
+    days = (starts // 86400).astype(np.int64)
+    first = int(days.min())
+    day_offsets = np.array([utc_offset(d * 86400, tz) for d in range(first, int(days.max()) + 2)], dtype=np.int64)
+    offsets = day_offsets[days - first]
+    changing = np.flatnonzero(day_offsets[:-1] != day_offsets[1:]) + first
+    if len(changing):
+        for pos in np.flatnonzero(np.isin(days, changing)).tolist():
+            offsets[pos] = utc_offset(float(starts[pos]), tz)
+    return offsets
+
+
+def _local_minute_array(starts, tz: tzinfo):
+    return ((starts + _offset_array(starts, tz)) % 86400) // 60
+
+
+def match_positions(
+    starts: Sequence[float],
+    tz: tzinfo,
+    time_pref: str | None = None,
+    statuses: Sequence[int] | None = None,
+    wanted: tuple[int, ...] | None = None,
+    limit: int | None = None,
+    exact: bool = False
+) -> list[int]:
+    """
+    Positions of the segments whose local start time (in tz) matches time_pref and whose
+    status is in `wanted` (if given), earliest first, at most `limit`.
+    """
+    if len(starts) == 0:
+        return []
+    window = time_window(time_pref, exact)
+
+    if np is None:
+        matched = [pos for pos in range(len(starts)) if wanted is None or statuses[pos] in wanted]
+        if window is not None:
+            minutes = local_minutes([starts[pos] for pos in matched], tz)
+            matched = [pos for pos, minute in zip(matched, minutes) if window[0] <= minute < window[1]]
+        matched.sort(key=lambda pos: starts[pos])
+        return matched[:limit] if limit is not None else matched
+
+    starts = np.asarray(starts, dtype=np.float64)
+    mask = np.ones(len(starts), dtype=bool)
+    if wanted is not None:
+        statuses = np.asarray(statuses)
+        mask &= (statuses == wanted[0]) if len(wanted) == 1 else np.isin(statuses, wanted)
+    if window is not None and mask.any():
+        minutes = _local_minute_array(starts, tz)
+        mask &= (minutes >= window[0]) & (minutes < window[1])
+
+    matched = np.flatnonzero(mask)
+    if limit is not None and limit < len(matched):
+        # Top-N by start time without sorting every match
+        top = np.argpartition(starts[matched], limit - 1)[:limit]
+        matched = matched[top]
+    order = np.argsort(starts[matched], kind="stable")
+    return matched[order].tolist()
+
+
+def filter_rows(
+    rows: list[dict],
+    key: str,
+    tz: tzinfo,
+    time_pref: str | None = None,
+    wanted: tuple[int, ...] | None = None,
+    limit: int | None = None,
+    exact: bool = False
+) -> list[dict]:
+    """
+    match_positions over dict rows whose `key` holds a start datetime (statuses from "status").
+    """
+    starts = [r[key].timestamp() for r in rows]
+    statuses = [r.get("status") for r in rows] if wanted is not None else None
+    return [rows[pos] for pos in match_positions(starts, tz, time_pref, statuses, wanted, limit, exact)]
@@ -1,41 +1,65 @@
 #supabase_utils.py
-from supabase import create_client, Client
+import asyncio
 import os
-from datetime import datetime, timedelta, timezone
-import bcrypt
+from datetime import datetime, timedelta, timezone, tzinfo
 from uuid import uuid4
 from typing import Optional
-from dateutil.parser import parse as parse_date
 import contextvars
 from fastapi import Request, HTTPException, status
 import jwt
 import json
 import re
-from zoneinfo import ZoneInfo
-from dateutil import parser
+from session_store import SessionStore, SessionState, SESSION_HISTORY_ROWS, record_row
+from availability_index import AvailabilityIndex, DoctorSegments, local_day_bounds
+from ttl_cache import TTLCache
+from password_hashing import hash_password, verify_password
+from write_behind import ConversationWriter
+from time_utils import parse_iso, parse_day, get_timezone, pg_timezone
+from slot_filter import time_window, match_positions, filter_rows
+from metrics import timed
+from app_logging import get_logger, sampled
+import db
 from dotenv import load_dotenv
 load_dotenv()
 
+log = get_logger("supabase")
+
 # Supabase setup
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# The async client has to be created inside the running event loop,
+# so it is set up once from the FastAPI lifespan via init_supabase().
+# DB_BACKEND picks PostgREST (supabase-py) or a direct Postgres pool, see db.py.
+supabase: "db.AsyncClient | db.PgClient | None" = None
+
+
+@timed("supabase")
+async def init_supabase():
+    global supabase
+    if supabase is None:
+        supabase = await db.connect(SUPABASE_URL, SUPABASE_KEY)
+    return supabase
+
+
+async def close_supabase() -> None:
+    global supabase
+    await db.close()
+    supabase = None
 
 # JWT Authentication
 JWT_SECRET = os.getenv("JWT_SECRET")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM")
+JWT_LIFETIME = timedelta(hours=8)
 
 
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-def register_doctor_user(req):
+@timed("supabase")
+async def register_doctor_user(req):
     data = {
         "fname": req.fname,
         "lname": req.lname,
         "emailid": req.emailid,
-        "password": hash_password(req.password),
+        "password": await hash_password(req.password),
         "mobilenumber": req.mobilenumber,
         "location1": req.location1,
         "city": req.city,
@@ -49,15 +73,16 @@ def register_doctor_user(req):
         "verification": 0,
         "availability": 1
     }
-    return supabase.table("doctors_registration").insert(data).execute()
+    return await supabase.table("doctors_registration").insert(data).execute()
 
 
-def register_patient_user(req):
+@timed("supabase")
+async def register_patient_user(req):
     data = {
         "fname": req.fname,
         "lname": req.lname,
         "emailid": req.emailid,
-        "password": hash_password(req.password),
+        "password": await hash_password(req.password),
         "mobilenumber": req.mobilenumber,
         "city": req.city,
         "province": req.province,
@@ -75,7 +100,7 @@ def register_patient_user(req):
         "dlnumber": "",
         "verification": 0
     }
-    return supabase.table("patients_registration").insert(data).execute()
+    return await supabase.table("patients_registration").insert(data).execute()
 
 ################[Both] User identification related functions################
 
@@ -96,40 +121,73 @@ def current_user_uuid() -> str:
         )
 
 
-def get_user_by_uuid_and_role(uuid: str, role: str):
+@timed("supabase")
+async def get_user_by_uuid_and_role(uuid: str, role: str):
     table = "doctors_registration" if role == "doctor" else "patients_registration"
-    res = supabase.table(table).select("id, uuid, fname, lname, emailid").eq("uuid", uuid).maybe_single().execute()
+    res = await supabase.table(table).select("id, uuid, fname, lname, emailid").eq("uuid", uuid).maybe_single().execute()
     return res.data if res and res.data else None
 
 
-def login_user(emailid: str, password: str):
+# Profile fields carried in the JWT (see login_user) and returned by get_user_context
+USER_CONTEXT_CLAIMS = ("id", "fname", "lname", "emailid")
+USER_CONTEXT_CACHE_TTL = float(os.getenv("USER_CONTEXT_CACHE_TTL", "900"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
 
-    user = None
-    role = None
+# (role, uuid) → {id, uuid, fname, lname, emailid}
+# Nothing in the app edits these fields after registration, so entries only expire by TTL
+# (and token claims with the token); a profile-editing path would have to evict them here.
+_user_context_cache = TTLCache(maxsize=10000, ttl=USER_CONTEXT_CACHE_TTL)
+# raw token → decoded payload
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
 
-    doc_res = supabase.table("doctors_registration") \
-        .select("id, uuid, password, emailid, fname, lname") \
-        .eq("emailid", emailid) \
-        .maybe_single().execute()
-    if doc_res and doc_res.data:
-        user = doc_res.data
-        role = "doctor"
+
+@timed("supabase")
+async def get_user_context(user: dict) -> dict | None:
+    """
+    Resolved profile of the authenticated user ({uuid, role} plus token claims, from auth_dependency).
+    Uses the cache, then the token claims, and only queries the DB when neither has it.
+    """
+    key = (user["role"], user["uuid"])
+    cached = _user_context_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if all(user.get(c) is not None for c in USER_CONTEXT_CLAIMS):
+        context = {
+            "id": user["id"],
+            "uuid": user["uuid"],
+            "fname": user["fname"],
+            "lname": user["lname"],
+            "emailid": user["emailid"]
+        }
     else:
-        pat_res = supabase.table("patients_registration") \
-            .select("id, uuid, password, emailid, fname, lname") \
-            .eq("emailid", emailid) \
-            .maybe_single().execute()
-        if pat_res and pat_res.data:
-            user = pat_res.data
-            role = "patient"
+        context = await get_user_by_uuid_and_role(user["uuid"], user["role"])
+        if not context:
+            return None
+
+    _user_context_cache.set(key, context)
+    return context
 
-    if not user or not bcrypt.checkpw(password.encode(), user["password"].encode()):
+
+@timed("supabase")
+async def login_user(emailid: str, password: str):
+
+    # One round trip resolves both the account and its role (doctors first)
+    res = await supabase.rpc("get_account_by_email", {"p_emailid": emailid}).execute()
+    user = res.data[0] if res.data else None
+    role = user["role"] if user else None
+
+    if not user or not await verify_password(password, user["password"]):
         return None, "Invalid credentials"
 
     payload = {
         "sub": user["uuid"],
         "role": role,
-        "exp": int((datetime.now(timezone.utc) + timedelta(hours=8)).timestamp()) # valid for 8 hours
+        "id": user["id"],
+        "fname": user.get("fname", ""),
+        "lname": user.get("lname", ""),
+        "emailid": user["emailid"],
+        "exp": int((datetime.now(timezone.utc) + JWT_LIFETIME).timestamp()) # valid for 8 hours
     }
     token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
@@ -145,23 +203,35 @@ def login_user(emailid: str, password: str):
     }, None
 
 
-def auth_dependency(request: Request):
+@timed("supabase")
+async def auth_dependency(request: Request):
     auth = request.headers.get("Authorization", "")
     if not auth.lower().startswith("bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing auth header")
     token = auth.split(" ", 1)[1]
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    payload = _token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        # Never keep a token past its expiry
+        ttl = min(TOKEN_CACHE_TTL, payload.get("exp", 0) - datetime.now(timezone.utc).timestamp())
+        if ttl > 0:
+            _token_cache.set(token, payload, ttl=ttl)
     set_current_user_uuid(payload["sub"])
-    return {"uuid": payload["sub"], "role": payload["role"]}
+    user = {"uuid": payload["sub"], "role": payload["role"]}
+    for claim in USER_CONTEXT_CLAIMS:
+        if claim in payload:
+            user[claim] = payload[claim]
+    return user
 
 
-def get_user_info_by_email(emailid: str, role: str):
+@timed("supabase")
+async def get_user_info_by_email(emailid: str, role: str):
     table = "doctors_registration" if role == "doctor" else "patients_registration"
     key = "emailid"
-    res = supabase.table(table).select("emailid, fname, lname").eq(key, emailid).single().execute()
+    res = await supabase.table(table).select("emailid, fname, lname").eq(key, emailid).single().execute()
     if res.data:
         return {
         "emailid": res.data["emailid"],
@@ -174,12 +244,13 @@ def get_user_info_by_email(emailid: str, role: str):
 
 ################[Patients] booking related functions################
 ##Idempotence, concurrency, slot state atomicity##
-def book_slot(patient_id: int, time_segment_id: int, description: str = None):
+@timed("supabase")
+async def book_slot(patient_id: int, time_segment_id: int, description: str = None):
     """
     Atomically schedules a slot. After a successful appointment, write doctor_appointment.
     """
-    segment = supabase.table("doctor_available_time_segments") \
-        .select("doctor_id") \
+    segment = await supabase.table("doctor_available_time_segments") \
+        .select("doctor_id, start_time, held_by, held_until") \
         .eq("id", time_segment_id) \
         .maybe_single().execute()
 
@@ -188,34 +259,171 @@ def book_slot(patient_id: int, time_segment_id: int, description: str = None):
 
     #doctor_id = segment.data["doctor_id"]
 
-    resp = supabase.rpc("book_appointment_atomic", {
-        "p_segment_id": time_segment_id,
-        "p_patient_id": patient_id
-    }).execute()
+    held_until = segment.data.get("held_until")
+    held = segment.data.get("held_by") == patient_id and bool(held_until) \
+        and parse_iso(held_until) > datetime.now(timezone.utc)
+    try:
+        resp = await supabase.rpc("book_appointment_atomic", {
+            "p_segment_id": time_segment_id,
+            "p_patient_id": patient_id
+        }).execute()
+    except Exception as e:
+        HOLD_STATS["rejected_held" if "SEGMENT_HELD" in str(e) else "taken"] += 1
+        # Usually the slot was taken by someone else: reload that doctor's index
+        availability_index.invalidate_segment(time_segment_id)
+        raise
 
     if not resp.data or len(resp.data) == 0:
         raise RuntimeError("No data returned from booking RPC")
 
     appt = resp.data[0]
-    print(f"[BOOKED] Appointment booked: segment_id={time_segment_id}, patient_id={patient_id}, appointment_id={appt.get('appointment_id')}")
+    # The RPC doesn't return the time; callers format it in the user's timezone
+    appt.setdefault("appointment_time", segment.data["start_time"])
+    HOLD_STATS["booked_held" if held else "booked_unheld"] += 1
+    availability_index.set_status(time_segment_id, 1)
+    # The RPC released the patient's other held slots
+    availability_index.release_holds(patient_id)
+    log.info("Appointment booked", extra={"segment_id": time_segment_id, "patient_id": patient_id, "appointment_id": appt.get("appointment_id")})
 
     return appt
 
 
+@timed("supabase")
+async def book_series(patient_id: int, time_segment_ids: list[int]) -> list[dict]:
+    """
+    Books every segment in one transaction (book_series_atomic): all of them or none.
+    Returns the appointments ({appointment_id, time_segment_id, appointment_time, status}) by start time.
+    Raises with SERIES_SEGMENT_NOT_AVAILABLE: <ids> in the message when any segment is taken.
+    """
+    try:
+        resp = await supabase.rpc("book_series_atomic", {
+            "p_patient_id": patient_id,
+            "p_segment_ids": time_segment_ids
+        }).execute()
+    except Exception:
+        # Usually one of the slots was taken by someone else: reload the doctor's index
+        for time_segment_id in time_segment_ids:
+            availability_index.invalidate_segment(time_segment_id)
+        raise
+
+    appts = resp.data or []
+    for appt in appts:
+        availability_index.set_status(appt["time_segment_id"], 1)
+    availability_index.release_holds(patient_id)
+    log.info("Series booked", extra={"patient_id": patient_id, "appointments": len(appts)})
+
+    return appts
+
+
+# Slot holds: the slots offered to a patient are reserved for them for SLOT_HOLD_TTL seconds
+# (hold_segments RPC), so another patient's search skips them and their booking turn does
+# not fail with "just taken". book_appointment_atomic honours the hold and releases the rest.
+SLOT_HOLD_TTL = int(os.getenv("SLOT_HOLD_TTL", "300"))
+SLOT_HOLD_SWEEP_INTERVAL = float(os.getenv("SLOT_HOLD_SWEEP_INTERVAL", "60"))
+
+HOLD_STATS = {
+    "offers": 0,              # hold_slots calls that held at least one slot
+    "segments_held": 0,
+    "segments_lost": 0,       # offered but already held / taken by the time of the hold
+    "booked_held": 0,         # bookings of a slot the patient held
+    "booked_unheld": 0,
+    "rejected_held": 0,       # bookings refused: slot held for another patient
+    "taken": 0,               # bookings refused for any other reason (usually already booked)
+    "swept": 0,
+    "errors": 0,
+}
+
+
+@timed("supabase")
+async def hold_slots(patient_id: int, time_segment_ids: list[int], ttl: int = SLOT_HOLD_TTL) -> set[int] | None:
+    """
+    Holds the offered segments for the patient (replacing their previous holds).
+    Returns the ids actually held, or None if holding failed (the offer then goes out unheld).
+    """
+    try:
+        resp = await supabase.rpc("hold_segments", {
+            "p_patient_id": patient_id,
+            "p_segment_ids": time_segment_ids,
+            "p_ttl_seconds": ttl
+        }).execute()
+    except Exception as e:
+        HOLD_STATS["errors"] += 1
+        log.error("Holding slots failed: %s", e)
+        return None
+
+    rows = resp.data or []
+    held = {r["segment_id"] for r in rows}
+    if held:
+        HOLD_STATS["offers"] += 1
+        availability_index.set_holds(list(held), patient_id, parse_iso(rows[0]["held_until"]).timestamp())
+    HOLD_STATS["segments_held"] += len(held)
+    HOLD_STATS["segments_lost"] += len(time_segment_ids) - len(held)
+    if len(held) < len(time_segment_ids):
+        # The index offered slots that are taken or held elsewhere: reload it on the next search
+        availability_index.invalidate_segment(time_segment_ids[0])
+    return held
+
+
+@timed("supabase")
+async def release_expired_slot_holds() -> int:
+    """
+    Clears expired holds in the database (they already stopped counting at held_until).
+    """
+    resp = await supabase.rpc("release_expired_slot_holds", {}).execute()
+    released = resp.data or 0
+    HOLD_STATS["swept"] += released
+    return released
+
+
+async def run_slot_sweep_loop(interval: float = SLOT_HOLD_SWEEP_INTERVAL) -> None:
+    """
+    Periodic slot housekeeping: clears expired holds and rolls doctor_next_available past slots that have started.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await release_expired_slot_holds()
+        except Exception as e:
+            log.error("Slot hold sweep failed: %s", e)
+        try:
+            await roll_next_available()
+        except Exception as e:
+            log.error("Next-available roll failed: %s", e)
+
+
+def get_slot_hold_stats() -> dict:
+    refused = HOLD_STATS["rejected_held"] + HOLD_STATS["taken"]
+    attempts = HOLD_STATS["booked_held"] + HOLD_STATS["booked_unheld"] + refused
+    return {
+        **HOLD_STATS,
+        "ttl_seconds": SLOT_HOLD_TTL,
+        # Share of offers that ended in a booking of a held slot
+        "hit_rate": round(HOLD_STATS["booked_held"] / HOLD_STATS["offers"], 4) if HOLD_STATS["offers"] else 0.0,
+        # Share of booking attempts refused because another booking or hold got there first
+        "conflict_rate": round(refused / attempts, 4) if attempts else 0.0,
+    }
+
+
 
 ##Idempotence, concurrency, slot state atomicity##
-def cancel_appointment(appointment_id: int, by_doctor: bool = False):
+@timed("supabase")
+async def cancel_appointment(appointment_id: int, by_doctor: bool = False, time_segment_id: int | None = None):
     """
     Call the PG transaction function to atomically cancel the reservation and roll back the segment status.
+    Pass time_segment_id when known so the availability index is patched instead of dropped.
     Returns: (True, None) if success; (None, error_code) if failed.
     """
     try:
-        resp = supabase.rpc("cancel_appointment_atomic", {
+        resp = await supabase.rpc("cancel_appointment_atomic", {
             "appt_id": appointment_id,
             "by_doctor": by_doctor
         }).execute()
 
         if resp.data and (resp.data == "OK" or (isinstance(resp.data, list) and "OK" in resp.data)):
+            if time_segment_id is not None:
+                availability_index.set_status(time_segment_id, 0)
+            else:
+                availability_index.invalidate()
             return True, None
         return None, "UNKNOWN_CANCEL_ERROR"
     except Exception as e:
@@ -226,13 +434,14 @@ def cancel_appointment(appointment_id: int, by_doctor: bool = False):
 
 
 ##Idempotence, concurrency, slot state atomicity##
-def reactivate_time_segment(time_segment_id: int):
+@timed("supabase")
+async def reactivate_time_segment(time_segment_id: int):
     """
     Restore a time segment from blocked (-1) to available (0).
     Raises ValueError on any failure.
     """
     try:
-        resp = supabase.rpc("reactivate_time_segment_atomic", {
+        resp = await supabase.rpc("reactivate_time_segment_atomic", {
             "segment_id": time_segment_id
         }).execute()
     except Exception as e:
@@ -243,187 +452,211 @@ def reactivate_time_segment(time_segment_id: int):
         if "can only be reactivated" in str(result):
             raise ValueError("TIME_SEGMENT_STATUS_INVALID_FOR_REACTIVATE")
         raise ValueError("UNKNOWN_TIME_SEGMENT_REACTIVATE_ERROR")
+    availability_index.set_status(time_segment_id, 0)
+
 
+@timed("supabase")
+async def block_time_range(
+    doctor_id: int,
+    start: datetime,
+    end: datetime,
+    time_pref: Optional[str] = None,
+    tz_name: str = "UTC",
+    description: Optional[str] = None
+) -> dict:
+    """
+    Blocks every open segment of the doctor starting in [start, end), optionally only in one time of day
+    ("morning" / "afternoon" / "evening" in tz_name), with one block_time_range RPC.
+    Returns {changed, segment_ids, booked, unchanged, first_start, last_end}.
+    """
+    resp = await supabase.rpc("block_time_range", {
+        "p_doctor_id": doctor_id,
+        "p_from": start.isoformat(),
+        "p_to": end.isoformat(),
+        "p_time_pref": time_pref or None,
+        "p_tz": pg_timezone(parse_timezone(tz_name)),
+        "p_description": description or None
+    }).execute()
+    summary = resp.data or {}
+    for segment_id in summary.get("segment_ids") or []:
+        availability_index.set_status(segment_id, -1)
+    log.info("Range blocked", extra={"doctor_id": doctor_id, "changed": summary.get("changed", 0)})
+    return summary
 
-def get_patient_appointments(patient_id: int):
-    return supabase.table("doctor_appointment") \
+
+@timed("supabase")
+async def reactivate_time_range(
+    doctor_id: int,
+    start: datetime,
+    end: datetime,
+    time_pref: Optional[str] = None,
+    tz_name: str = "UTC"
+) -> dict:
+    """
+    Reopens every blocked segment of the doctor starting in [start, end) (and cancels its event)
+    with one reactivate_time_range RPC. Same summary as block_time_range.
+    """
+    resp = await supabase.rpc("reactivate_time_range", {
+        "p_doctor_id": doctor_id,
+        "p_from": start.isoformat(),
+        "p_to": end.isoformat(),
+        "p_time_pref": time_pref or None,
+        "p_tz": pg_timezone(parse_timezone(tz_name))
+    }).execute()
+    summary = resp.data or {}
+    for segment_id in summary.get("segment_ids") or []:
+        availability_index.set_status(segment_id, 0)
+    log.info("Range reactivated", extra={"doctor_id": doctor_id, "changed": summary.get("changed", 0)})
+    return summary
+
+
+def _apply_appointment_filters(query, from_time=None, to_time=None, status: int | None = None, limit: int | None = None):
+    """
+    Push status / appointment_time range (inclusive) / limit into the doctor_appointment query,
+    ordered by appointment_time so limit keeps the earliest ones.
+    """
+    if status is not None:
+        query = query.eq("status", status)
+    if from_time is not None:
+        query = query.gte("appointment_time", from_time.isoformat() if isinstance(from_time, datetime) else from_time)
+    if to_time is not None:
+        query = query.lte("appointment_time", to_time.isoformat() if isinstance(to_time, datetime) else to_time)
+    query = query.order("appointment_time", desc=False)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+@timed("supabase")
+async def get_patient_appointments(patient_id: int, from_time=None, to_time=None, status: int | None = None, limit: int | None = None):
+    query = supabase.table("doctor_appointment") \
         .select("*, doctors_registration(fname, lname)") \
-        .eq("patient_id", patient_id) \
-        .execute()
+        .eq("patient_id", patient_id)
+    return await _apply_appointment_filters(query, from_time, to_time, status, limit).execute()
 
 
 ################[Doctors] Event realted functions################
 ##Idempotence, concurrency, slot state atomicity##
-def create_doctor_event(time_segment_id: int, doctor_id: int, description: str):
+@timed("supabase")
+async def create_doctor_event(time_segment_id: int, doctor_id: int, description: str):
     """
     Doctors create self-use events (blocks), based on the create_appointment_request_atomic RPC.
     """
     try:
-        resp = supabase.rpc("create_appointment_request_atomic", {
+        resp = await supabase.rpc("create_appointment_request_atomic", {
             "p_segment_id": time_segment_id,
             "p_doctor_id": doctor_id,
             "p_request_description": description
         }).execute()
         if isinstance(resp.data, dict) and "time_segment_id" in resp.data:
+            availability_index.set_status(time_segment_id, -1)
             return resp.data, None
         else:
             return None, "UNKNOWN_EVENT_CREATE_ERROR"
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception("Event creation failed for segment %s", time_segment_id)
         msg = str(e).lower()
         if "requests can only be created for available time segments" in msg:
             return None, "EVENT_SEGMENT_NOT_AVAILABLE"
         return None, msg
 
 
-def get_doctor_schedule(doctor_id: int, start_date: Optional[str] = None, end_date: Optional[str] = None) -> list[dict]:
+@timed("supabase")
+async def get_doctor_schedule(doctor_id: int, start_date: Optional[str] = None, end_date: Optional[str] = None) -> list[dict]:
     """
     Returns doctor's schedule segments enriched with appointment or event information.
+    start_date / end_date are inclusive calendar days (UTC); the whole range is fetched
+    in one round trip through the get_doctor_schedule_enriched RPC.
     """
 
-    from_date = parse_date(start_date).date() if start_date else None
-    to_date = parse_date(end_date).date() if end_date else None
+    from_date = parse_day(start_date) if start_date else None
+    to_date = parse_day(end_date) if end_date else None
+
+    params = {
+        "p_doctor_id": doctor_id,
+        "p_from": f"{from_date.isoformat()}T00:00:00+00:00" if from_date else None,
+        "p_to": f"{(to_date + timedelta(days=1)).isoformat()}T00:00:00+00:00" if to_date else None,
+    }
 
     try:
-        res = (
-            supabase.table("doctor_available_time_segments")
-            .select("id, start_time, end_time, status")
-            .eq("doctor_id", doctor_id)
-            .order("start_time", desc=False)
-            .execute()
-        )
-        segments = res.data or []
-
-        def in_range(s):
-            dt = parse_date(s["start_time"]).date()
-            return (not from_date or dt >= from_date) and (not to_date or dt <= to_date)
-        segments = [s for s in segments if in_range(s)]
-
-        enriched = []
-        for seg in segments:
-            item = {
-                "segment_id": seg["id"],
-                "start_time": seg["start_time"],
-                "end_time": seg["end_time"],
-                "status": seg["status"],
+        res = await supabase.rpc("get_doctor_schedule_enriched", params).execute()
+        rows = res.data or []
+
+        return [
+            {
+                "segment_id": row["segment_id"],
+                "start_time": row["start_time"],
+                "end_time": row["end_time"],
+                "status": row["status"],
                 "label": {
                     -1: "Blocked",
                     0: "Available",
                     1: "Booked"
-                }.get(seg["status"], "Unknown"),
-                "patient": None,
-                "event_description": None
+                }.get(row["status"], "Unknown"),
+                "patient": row.get("patient"),
+                "event_description": row.get("event_description")
             }
-
-            if seg["status"] == 1:
-                appt_res = (
-                    supabase.table("doctor_appointment")
-                    .select("patient_id")
-                    .eq("time_segment_id", seg["id"])
-                    .eq("status", 1)
-                    .limit(1)
-                    .execute()
-                )
-                appt = appt_res.data[0] if appt_res.data else None
-                if appt:
-                    patient_res = (
-                        supabase.table("patients_registration")
-                        .select("fname, fname")
-                        .eq("id", appt["patient_id"])
-                        .limit(1)
-                        .execute()
-                    )
-                    patient = patient_res.data[0] if patient_res.data else {}
-                    item["patient"] = f"{patient.get('fname', '')} {patient.get('lname', '')}".strip()
-
-            elif seg["status"] == -1:
-                event_res = (
-                    supabase.table("doctor_appointment_requests")
-                    .select("description")
-                    .eq("time_segment_id", seg["id"])
-                    .eq("status", 0)
-                    .limit(1)
-                    .execute()
-                )
-                if event_res.data:
-                    item["event_description"] = event_res.data[0].get("description")
-
-            enriched.append(item)
-
-        return enriched
+            for row in rows
+        ]
 
     except Exception as e:
-        print(f"[get_doctor_schedule] Failed to fetch schedule: {e}")
+        log.error("Failed to fetch doctor schedule: %s", e)
         return []
 
 
-def get_doctor_appointments(doctor_id: int):
-    return supabase.table("doctor_appointment") \
+@timed("supabase")
+async def get_doctor_appointments(doctor_id: int, from_time=None, to_time=None, status: int | None = None, limit: int | None = None):
+    query = supabase.table("doctor_appointment") \
         .select("*, patients_registration(fname, lname)") \
-        .eq("doctor_id", doctor_id) \
-        .execute()
+        .eq("doctor_id", doctor_id)
+    return await _apply_appointment_filters(query, from_time, to_time, status, limit).execute()
 
 
-def get_family_doctor_id(patient_id: int) -> int:
+# patient_id → {id, fname, lname} of the active family doctor; assignments rarely change
+FAMILY_DOCTOR_CACHE_TTL = float(os.getenv("FAMILY_DOCTOR_CACHE_TTL", "600"))
+_family_doctor_cache = TTLCache(maxsize=10000, ttl=FAMILY_DOCTOR_CACHE_TTL)
 
-    response = supabase.table("patient_doctor") \
-        .select("doctor_id") \
-        .eq("patient_id", patient_id) \
-        .eq("relationship_status", "active") \
-        .limit(1) \
-        .execute()
 
-    data = response.data
-    if not data or not data[0].get("doctor_id"):
-        raise ValueError(f"No active family doctor found for patient_id={patient_id}")
-
-    return data[0]["doctor_id"]
-
-
-def get_family_doctor(patient_id: int) -> dict:
+@timed("supabase")
+async def get_family_doctor_brief(patient_id: int) -> dict | None:
     """
-    Get the complete information of the family doctor bound to the patient (requires relationship_status='active')
-
-    Returns:
-        {
-            "id": 5,
-            "fname": "Ali",
-            "lname": "Reza",
-            "emailid": "...",
-            ...
-        }
+    {id, fname, lname} of the patient's active family doctor, or None. Cached per patient.
     """
-    response = (
-        supabase.table("patient_doctor")
-        .select("doctor_id, doctors_registration(*)")
-        .eq("patient_id", patient_id)
-        .eq("relationship_status", "active")
-        .limit(1)
-        .maybe_single()
+    doctor = _family_doctor_cache.get(patient_id)
+    if doctor is not None:
+        return doctor
+
+    response = await supabase.table("patient_doctor") \
+        .select("doctor_id, doctors_registration(id, fname, lname)") \
+        .eq("patient_id", patient_id) \
+        .eq("relationship_status", "active") \
+        .limit(1) \
         .execute()
-    )
 
-    data = response.data
-    if not data or not data.get("doctors_registration"):
-        raise ValueError(f"No active family doctor found for patient_id={patient_id}")
+    data = response.data or []
+    if not data or not data[0].get("doctors_registration"):
+        return None
 
-    return data["doctors_registration"]
+    d = data[0]["doctors_registration"]
+    doctor = {"id": d["id"], "fname": d.get("fname") or "", "lname": d.get("lname") or ""}
+    _family_doctor_cache.set(patient_id, doctor)
+    return doctor
 
 
-def cancel_event(segment_id: int, doctor_id: int) -> tuple[str | None, str | None]:
+@timed("supabase")
+async def cancel_event(segment_id: int, doctor_id: int) -> tuple[str | None, str | None]:
     """
     Cancel a doctor_appointment_request for a segment_id
     """
 
     try:
-        seg_res = supabase.table("doctor_available_time_segments") \
+        seg_res = await supabase.table("doctor_available_time_segments") \
             .select("start_time") \
             .eq("id", segment_id) \
             .maybe_single().execute()
         segment_time = seg_res.data.get("start_time") if seg_res.data else None
 
-        req_res = supabase.table("doctor_appointment_requests") \
+        req_res = await supabase.table("doctor_appointment_requests") \
             .select("id") \
             .eq("time_segment_id", segment_id) \
             .eq("doctor_id", doctor_id) \
@@ -434,253 +667,361 @@ def cancel_event(segment_id: int, doctor_id: int) -> tuple[str | None, str | Non
         if not request_id:
             return None, "REQUEST_NOT_FOUND"
 
-        resp = supabase.rpc("cancel_appointment_request_atomic", {
+        resp = await supabase.rpc("cancel_appointment_request_atomic", {
             "doctorid": doctor_id,
             "segmentid": segment_id
         }).execute()
-        print(f"[DEBUG] cancel_appointment_request_atomic RPC response: {resp.data}")
         result = resp.data
-        print(f"[DEBUG] cancel_appointment_request_atomic RPC response: {result}")
+        log.debug("cancel_appointment_request_atomic returned %s", result)
 
         if result != "OK" and (not isinstance(result, list) or result[0] != "OK"):
-            print(f"[ERROR] Unknown cancel error, response={result}")
+            log.error("Unknown cancel error, response=%s", result)
             return None, "UNKNOWN_EVENT_CANCEL_ERROR"
 
-        print(f"[DEBUG] Successfully cancelled request {request_id}")
+        availability_index.set_status(segment_id, 0)
+        log.debug("Cancelled request %s", request_id)
         return segment_time, None
 
     except Exception as e:
         msg = str(e)
-        print(f"[EXCEPTION] Cancel event failed: {msg}")
+        log.error("Cancel event failed: %s", msg)
         return None, msg
-    
+
+
+@timed("supabase")
+async def generate_segments_from_shifts(
+    doctor_ids: list[int] | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    segment_minutes: int = 30
+) -> dict[int, int]:
+    """
+    Expand doctor_shifts in [start, end) into open segments via the set-based RPC.
+    Segments overlapping existing ones are skipped, so re-running is safe.
+    Returns {doctor_id: segments_created}.
+    """
+    start = start or datetime.now(timezone.utc)
+    end = end or start + timedelta(weeks=4)
+    resp = await supabase.rpc("generate_segments_from_shifts", {
+        "p_doctor_ids": doctor_ids,
+        "p_from": start.isoformat(),
+        "p_to": end.isoformat(),
+        "p_segment_minutes": segment_minutes
+    }).execute()
+    created = {row["doctor_id"]: row["segments_created"] for row in resp.data or []}
+    for doctor_id in created:
+        availability_index.invalidate(doctor_id)
+    return created
+
+
+@timed("supabase")
+async def regenerate_doctor_segments(doctor_id: int, start: datetime, end: datetime, segment_minutes: int = 30) -> dict:
+    """
+    Re-sync one doctor's segments in [start, end) with the current shifts: unused open
+    segments outside any shift are removed, missing ones are created.
+    Returns {doctor_id, removed, created}.
+    """
+    resp = await supabase.rpc("regenerate_doctor_segments", {
+        "p_doctor_id": doctor_id,
+        "p_from": start.isoformat(),
+        "p_to": end.isoformat(),
+        "p_segment_minutes": segment_minutes
+    }).execute()
+    availability_index.invalidate(doctor_id)
+    return resp.data or {}
+
 
 ################[Both] Get/View/List slots ################
 
 def parse_timezone(tz_str: str):
-    """Parse various time zone formats and return time zone objects"""
-    try:
-        # Handles UTC offset formats (e.g. "+08:00", "-05:00")
-        if re.match(r"^[+-]\d{2}:\d{2}$", tz_str):
-            sign = -1 if tz_str.startswith("-") else 1
-            hours, minutes = map(int, tz_str[1:].split(":"))
-            return timezone(timedelta(hours=sign*hours, minutes=sign*minutes))
-        
-        # Handling IANA time zone names (such as "Asia/Shanghai")
-        return ZoneInfo(tz_str)
-    except Exception:
-        return ZoneInfo("UTC") 
+    """Parse various time zone formats and return time zone objects (cached, see time_utils)"""
+    return get_timezone(tz_str)
 
 
-def slot_matches_time_with_tz(dt: datetime, time_pref: str, user_tz: str) -> bool:
+def slot_matches_time_with_tz(dt: datetime, time_pref: str, user_tz) -> bool:
+    """Single-slot check; use slot_filter.match_positions for lists of segments"""
     try:
-        time_pref = time_pref.strip().lower()
-        user_zone = parse_timezone(user_tz)  
+        window = time_window(time_pref)
+        if window is None:
+            return True
+        user_zone = user_tz if isinstance(user_tz, tzinfo) else parse_timezone(user_tz)
         local_dt = dt.astimezone(user_zone)
-        
-        if time_pref == "morning":
-            return local_dt.hour < 12
-        elif time_pref == "afternoon":
-            return 12 <= local_dt.hour < 17
-        elif time_pref == "evening":
-            return 17 <= local_dt.hour < 21
-        return True
+        return window[0] <= local_dt.hour * 60 + local_dt.minute < window[1]
     except Exception as e:
-        print(f"[ERROR] Time processing failed: {e}")
+        log.error("Time processing failed: %s", e)
         return True  
 
 
-def get_next_available_slots(
-    doctor_id: int,
-    days_ahead: int = 7,
-    time_pref: Optional[str] = None,
-    start_iso: Optional[str] = None,
-    end_iso: Optional[str] = None,
-    user_tz: Optional[str] = "+00:00",
-):
-
-    if start_iso and end_iso:
-        window_start = parse_date(start_iso).astimezone(timezone.utc)
-        window_end   = parse_date(end_iso).astimezone(timezone.utc)
-    else:
-        now = datetime.now(timezone.utc)
-        window_start = now
-        window_end   = now + timedelta(days=days_ahead)
-
-  
-    resp = supabase.table("doctor_available_time_segments")\
-        .select("id, doctor_id, start_time, end_time")\
-        .eq("doctor_id", doctor_id)\
-        .eq("status", 0)\
-        .gte("start_time", window_start.isoformat())\
-        .lte("start_time", window_end.isoformat())\
-        .execute()
-
-    results = []
-    for segment in resp.data:
-        try:
-            segment_start = parse_date(segment["start_time"]).astimezone(timezone.utc)
-        except Exception as e:
-            print(f"Skipping invalid segment {segment.get('id')}: {e}")
-            continue
-
-
-        if slot_matches_time_with_tz(segment_start, time_pref, user_tz):
-            results.append(segment)
-
-    print(f"Found {len(results)} segments for doctor {doctor_id}, time_pref={time_pref or 'anytime'}")
-    return results
+# PostgREST caps responses (1000 rows by default), so segment loads are paged
+SEGMENT_PAGE_SIZE = 1000
 
 
-def get_slot_mapping(session_id: str) -> dict[int, int]:
+@timed("supabase")
+async def _fetch_doctor_segments(doctor_id: int, window_start: datetime, window_end: datetime) -> list[dict]:
     """
-    Extract the mapping from slot_index to segment_id from the most recent record in the conversations table containing available_slots.
-    Supports {index, segment_id} or {index, id} in slot.
+    All segments of a doctor starting in [window_start, window_end), ordered by start_time.
+    Loader of the availability index, also used directly outside its horizon.
     """
-    try:
-        response = supabase.table("conversations") \
-            .select("meta") \
-            .eq("session_id", session_id) \
-            .order("created_at", desc=True) \
-            .limit(5) \
+    rows = []
+    offset = 0
+    while True:
+        res = await supabase.table("doctor_available_time_segments") \
+            .select("id, start_time, end_time, status, held_by, held_until") \
+            .eq("doctor_id", doctor_id) \
+            .gte("start_time", window_start.isoformat()) \
+            .lt("start_time", window_end.isoformat()) \
+            .order("start_time") \
+            .range(offset, offset + SEGMENT_PAGE_SIZE - 1) \
             .execute()
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < SEGMENT_PAGE_SIZE:
+            return rows
+        offset += SEGMENT_PAGE_SIZE
 
-        for row in response.data or []:
-            meta_raw = row.get("meta")
-
-            if isinstance(meta_raw, str):
-                try:
-                    meta = json.loads(meta_raw)
-                except json.JSONDecodeError:
-                    print("[SLOT MAP ERROR] meta JSON decode failed")
-                    continue
-            elif isinstance(meta_raw, dict):
-                meta = meta_raw
-            else:
-                print("[SLOT MAP ERROR] meta is not dict or JSON string")
-                continue
-
-            available_slots = meta.get("available_slots")
-            if not available_slots:
-                continue
-
-            mapping = {}
-            for slot in available_slots:
-                try:
-                    index = int(slot["index"])
-                    segment_id = int(slot.get("segment_id") or slot.get("id"))
-                    mapping[index] = segment_id
-                except Exception as e:
-                    print(f"[SLOT MAP ERROR] Invalid slot format: {e}, raw slot: {slot}")
-                    continue
-
-            if mapping:
-                return mapping
 
-    except Exception as e:
-        print(f"[SLOT MAP ERROR] Supabase query failed: {e}")
+availability_index = AvailabilityIndex(loader=_fetch_doctor_segments)
 
-    print(f"[SLOT MAP] No valid available_slots mapping found for session {session_id}")
-    return {}
 
+@timed("supabase")
+async def get_doctor_segments(doctor_id: int, start: datetime, end: datetime, tz=None) -> list[dict]:
+    """
+    Doctor's segments (any status) starting in [start, end), earliest first. Served from the
+    availability index; windows outside the indexed horizon are read from the database.
 
-def get_available_segments(preferred_date=None, preferred_time=None, topn=5, user=None, days_ahead=0):
+    Each dict: segment_id, doctor_id, start_time, end_time, status, start_dt (in tz), local_day
+    """
+    rows = await availability_index.segments(doctor_id, start, end, tz=tz)
+    if rows is not None:
+        return rows
+    doc = DoctorSegments.from_rows(
+        doctor_id, start.timestamp(), end.timestamp(),
+        await _fetch_doctor_segments(doctor_id, start, end)
+    )
+    return [doc.row(pos, tz) for pos in range(len(doc.ids))]
 
-    if not user or "id" not in user or user.get("role") != "patient":
-        raise ValueError("Only patients can fetch available segments")
 
-    patient_id = user["id"]
-    doctor_id = get_family_doctor_id(patient_id)
-    user_tz = user.get("timezone", "+00:00")
+@timed("supabase")
+async def get_open_segments(doctor_id: int, start: datetime, end: datetime, tz=None, patient_id: int | None = None) -> list[dict]:
+    """
+    Doctor's open segments starting in [start, end), earliest first, leaving out slots held for a
+    patient other than patient_id. Same rows as get_doctor_segments.
+    """
+    rows = await availability_index.free_slots(doctor_id, start, end, tz=tz, patient_id=patient_id)
+    if rows is not None:
+        return rows
+    doc = DoctorSegments.from_rows(
+        doctor_id, start.timestamp(), end.timestamp(),
+        await _fetch_doctor_segments(doctor_id, start, end)
+    )
+    positions = match_positions(
+        doc.start_array, tz or timezone.utc,
+        statuses=doc.visible_statuses(0, len(doc.ids), patient_id), wanted=(0,)
+    )
+    return [doc.row(pos, tz) for pos in positions]
 
-    all_segments = []
 
-    slots = []
+@timed("supabase")
+async def roll_next_available() -> int:
+    """
+    Rebuilds doctor_next_available for doctors whose listed slots have started; returns how many.
+    """
+    resp = await supabase.rpc("roll_next_available", {}).execute()
+    return resp.data or 0
 
-    # Step 1: Prioritize the specified date (and range if days_ahead is provided)
-    if preferred_date:
-        if days_ahead:
-            # Range mode: preferred_date + range
-            start_date = parser.parse(preferred_date)
-            end_date = start_date + timedelta(days_ahead)
 
-            slots = get_next_available_slots(
-                doctor_id=doctor_id,
-                start_iso=start_date.isoformat(),
-                end_iso=end_date.isoformat(),
-                time_pref=preferred_time,
-                user_tz=user_tz
-            )
-            print(f"[DEBUG] Found {len(slots)} slots from {preferred_date} for {days_ahead} days")
-        else:
-            # Single-day mode
-            slots = get_next_available_slots(
-                doctor_id=doctor_id,
-                start_iso=preferred_date + "T00:00:00Z",
-                end_iso=preferred_date + "T23:59:59Z",
-                time_pref=preferred_time,
-                user_tz=user_tz
-            )
-            print(f"[DEBUG] Found {len(slots)} slots on preferred_date {preferred_date}")
-
-    # Step 2: If no slot is found, fallback to checking in the next few days from today
-    if not slots:
-        slots = get_next_available_slots(
-            doctor_id=doctor_id,
-            days_ahead=days_ahead,
-            time_pref=preferred_time,
-            user_tz=user_tz
-        )
-        print(f"[DEBUG] Fallback: found {len(slots)} slots in next {days_ahead} days")
+@timed("supabase")
+async def get_slot_mapping(session_id: str) -> dict[int, int]:
+    """
+    Mapping from slot_index to segment_id from the most recent record (within the last 5)
+    containing available_slots. Served from the session state cache.
+    """
+    try:
+        state = await session_store.load(session_id)
+        mapping = state.current_slot_mapping()
+        if mapping:
+            return dict(mapping)
+    except Exception as e:
+        log.error("Slot mapping query failed: %s", e)
 
-    # Step 3: Filter available slots with status = 0
-    for s in slots:
-        if s.get("status", 0) == 0:
-            s = s.copy()
-            s["doctor_name"] = "Your Family Doctor"
-            all_segments.append(s)
+    log.debug("No slot mapping for session %s", session_id)
+    return {}
 
-    all_segments = sorted(all_segments, key=lambda s: s["start_time"])
-    return all_segments[:topn]
 
+@timed("supabase")
+async def search_availability(
+    patient_id: int,
+    preferred_date: Optional[str] = None,
+    preferred_time: Optional[str] = None,
+    window_days: int = 0,
+    later_days: int = 5,
+    topn: int = 5,
+    tz_name: str = "UTC",
+    horizon_days: int = 60
+) -> dict:
+    """
+    One-round-trip availability search for the patient's family doctor (search_available_segments RPC).
 
+    Returns:
+        {
+            "doctor": {"id", "fname", "lname"} or None,
+            "preferred": [...],   # slots on preferred_date (+ window_days), earliest first
+            "later": [...],       # slots on the first later day that has any
+            "earliest": [...]     # earliest slots from now
+        }
+    Each slot: {id, doctor_id, start_time, end_time, local_day, doctor_name}
+    tz_name is the user's timezone as given (IANA name or "+05:30").
+    Answered from the availability index; the RPC is the fallback outside its horizon.
+    """
+    tz = parse_timezone(tz_name)
+    doctor = await get_family_doctor_brief(patient_id)
+    if doctor is None:
+        return {"doctor": None, "preferred": [], "later": [], "earliest": []}
+
+    result = await _search_availability_indexed(
+        patient_id,
+        doctor,
+        parse_day(preferred_date) if preferred_date else None,
+        preferred_time,
+        tz,
+        window_days,
+        later_days,
+        topn,
+        horizon_days
+    )
+    if result is not None:
+        return result
+
+    resp = await supabase.rpc("search_available_segments", {
+        "p_patient_id": patient_id,
+        "p_preferred_date": parse_day(preferred_date).isoformat() if preferred_date else None,
+        "p_time_pref": preferred_time or None,
+        "p_tz": pg_timezone(tz),
+        "p_window_days": window_days,
+        "p_later_days": later_days,
+        "p_topn": topn,
+        "p_horizon_days": horizon_days
+    }).execute()
 
-def find_matching_appointments(user_id: int, role: str, target: str, target_date: str | None = None):
+    result = {"doctor": None, "preferred": [], "later": [], "earliest": []}
+    for row in resp.data or []:
+        if row["bucket"] == "doctor":
+            result["doctor"] = {
+                "id": row["doctor_id"],
+                "fname": row.get("doctor_fname") or "",
+                "lname": row.get("doctor_lname") or ""
+            }
+            continue
+        result[row["bucket"]].append({
+            "id": row["segment_id"],
+            "doctor_id": row["doctor_id"],
+            "start_time": row["start_time"],
+            "end_time": row["end_time"],
+            "local_day": row["local_day"],
+            "doctor_name": "Your Family Doctor"
+        })
+
+    for bucket in ("preferred", "later", "earliest"):
+        result[bucket].sort(key=lambda s: s["start_time"])
+    return result
+
+
+@timed("supabase")
+async def _search_availability_indexed(
+    patient_id: int,
+    doctor: dict,
+    preferred_day,
+    preferred_time: Optional[str],
+    tz,
+    window_days: int,
+    later_days: int,
+    topn: int,
+    horizon_days: int
+) -> dict | None:
+    """
+    search_available_segments evaluated on the availability index (same buckets, days in tz,
+    slots held for other patients left out). Returns None if any part of the search is outside the indexed horizon.
     """
-    Returns a list of matching appointment dicts.
+    now = datetime.now(timezone.utc)
+    doctor_id = doctor["id"]
+    result = {"doctor": doctor, "preferred": [], "later": [], "earliest": []}
+
+    def to_slots(rows):
+        return [
+            {
+                "id": r["segment_id"],
+                "doctor_id": doctor_id,
+                "start_time": r["start_time"],
+                "end_time": r["end_time"],
+                "local_day": r["local_day"],
+                "doctor_name": "Your Family Doctor"
+            }
+            for r in rows
+        ]
+
+    if preferred_day:
+        start, end = local_day_bounds(preferred_day, max(window_days, 0) + 1, tz)
+        rows = await availability_index.free_slots(doctor_id, max(start, now), max(end, now), preferred_time, tz, topn, patient_id)
+        if rows is None:
+            return None
+        result["preferred"] = to_slots(rows)
+
+        # First later day (within later_days) that has any slot
+        start, end = local_day_bounds(preferred_day + timedelta(days=1), max(later_days, 1), tz)
+        first = await availability_index.free_slots(doctor_id, max(start, now), max(end, now), preferred_time, tz, 1, patient_id)
+        if first is None:
+            return None
+        if first:
+            start, end = local_day_bounds(first[0]["start_dt"].date(), 1, tz)
+            rows = await availability_index.free_slots(doctor_id, max(start, now), end, preferred_time, tz, topn, patient_id)
+            if rows is None:
+                return None
+            result["later"] = to_slots(rows)
+
+    rows = await availability_index.free_slots(doctor_id, now, now + timedelta(days=horizon_days), preferred_time, tz, topn, patient_id)
+    if rows is None:
+        return None
+    result["earliest"] = to_slots(rows)
+    return result
+
+
+@timed("supabase")
+async def find_matching_appointments(user_id: int, role: str, target: str, target_date: str | None = None):
+    """
+    Returns a list of matching active appointment dicts, earliest first.
+    target="next" → the next upcoming one; target="date" → all on target_date (UTC day).
 
-    Each dict contains: appointment_id, appointment_time, status
+    Each dict contains: appointment_id, appointment_time, status, doctor_id, time_segment_id
     """
     now = datetime.now(timezone.utc)
     column = "patient_id" if role == "patient" else "doctor_id"
 
+    if target == "next":
+        from_time, to_time, limit = now, None, 1
+    elif target == "date" and target_date:
+        try:
+            day = parse_day(target_date)
+        except Exception as e:
+            log.warning("Invalid target_date %s: %s", target_date, e)
+            return []
+        from_time = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+        to_time = from_time + timedelta(days=1) - timedelta(microseconds=1)
+        limit = None
+    else:
+        return []
+
     try:
-        res = (
+        query = (
             supabase.table("doctor_appointment")
-            .select("appointment_id, appointment_time, status")
+            .select("appointment_id, appointment_time, status, doctor_id, time_segment_id")
             .eq(column, user_id)
-            .execute()
         )
+        res = await _apply_appointment_filters(query, from_time, to_time, status=1, limit=limit).execute()
     except Exception as e:
-        print(f"[ERROR] Failed to fetch appointments: {e}")
+        log.error("Failed to fetch appointments: %s", e)
         return []
 
-    matches = []
-    for appt in res.data:
-        try:
-            dt = parse_date(appt["appointment_time"]).astimezone(timezone.utc)
-            if appt.get("status") != 1:
-                continue  
-
-            if target == "next" and dt >= now:
-                matches.append(appt)
-            elif target == "date" and target_date and dt.strftime("%Y-%m-%d") == target_date:
-                matches.append(appt)
-        except Exception as e:
-            print(f"[WARN] Skipping invalid appt: {e}")
-            continue
-
-    return matches
+    return res.data or []
 
 
 def is_exact_time_string(time_str: str) -> bool:
@@ -692,40 +1033,131 @@ def is_exact_time_string(time_str: str) -> bool:
     return re.fullmatch(r"\d{1,2}:\d{2}", time_str.strip()) is not None
 
 
-def find_matching_events(doctor_id: int, preferred_date: str, preferred_time: str, user_tz, debug: bool = True) -> list[dict]:
+@timed("supabase")
+async def find_matching_events(doctor_id: int, preferred_date: str, preferred_time: str, user_tz, debug: bool = True) -> list[dict]:
  
     if debug:
-        print(f"[DEBUG] Looking for doctor {doctor_id}'s events on {preferred_date} with time_pref={preferred_time}, tz={user_tz}")
+        log.debug("Looking for doctor %s's events on %s with time_pref=%s, tz=%s", doctor_id, preferred_date, preferred_time, user_tz)
 
-    schedule = get_doctor_schedule(doctor_id, start_date=preferred_date, end_date=preferred_date)
+    day_start = datetime.combine(parse_day(preferred_date), datetime.min.time(), tzinfo=timezone.utc)
+    schedule = await get_doctor_segments(doctor_id, day_start, day_start + timedelta(days=1), tz=user_tz)
     if debug:
-        print(f"[DEBUG] Retrieved {len(schedule)} segments for date {preferred_date}")
+        log.debug("Retrieved %d segments for date %s", len(schedule), preferred_date)
 
-    matches = []
-    for s in schedule:
-        if s.get("status") != -1:  
-            continue
-
-        try:
-            dt = parse_date(s["start_time"]).astimezone(user_tz)
-
-            if is_exact_time_string(preferred_time):
-                if dt.strftime("%H:%M") == preferred_time:
-                    matches.append({"segment_id": s["segment_id"], "start_time": s["start_time"]})
-            else:
-                if slot_matches_time_with_tz(dt, preferred_time, user_tz):
-                    matches.append({"segment_id": s["segment_id"], "start_time": s["start_time"]})
-        except Exception as e:
-            print(f"[WARN] Skipping invalid segment: {e}")
-            continue
+    tz = user_tz if isinstance(user_tz, tzinfo) else parse_timezone(user_tz)
+    blocked = filter_rows(
+        schedule, "start_dt", tz, preferred_time, wanted=(-1,),
+        exact=is_exact_time_string(preferred_time)
+    )
+    matches = [{"segment_id": s["segment_id"], "start_time": s["start_time"]} for s in blocked]
 
-    print(f"[DEBUG] find_matching_events → {len(matches)} matching events")
+    log.debug("find_matching_events → %d matching events", len(matches))
     return matches
 
 
 ################ Others ################
 
-def log_conversation(
+@timed("supabase")
+async def _fetch_session_state(session_id: str) -> SessionState:
+    """
+    Cache-miss path of the session store: load every conversations row of the
+    session in one query and derive history, task_id and slot mapping from it.
+    """
+    state = SessionState()
+    if not session_id:
+        return state
+
+    # Queued rows must be in the DB before the session is rebuilt from it
+    await conversation_writer.flush()
+
+    response = await supabase.table("conversations") \
+        .select("id,role,input,response,meta,task_id") \
+        .eq("session_id", session_id) \
+        .order("created_at", desc=False) \
+        .execute()
+
+    rows = response.data or []
+    for row in rows:
+        meta = row.get("meta")
+        if isinstance(meta, str):
+            try:
+                meta = json.loads(meta)
+            except json.JSONDecodeError:
+                log.error("Slot mapping meta JSON decode failed")
+                meta = None
+        record_row(state, row, row.get("id"), meta)
+
+    if rows:
+        state.task_id = rows[-1].get("task_id")
+    return state
+
+
+# Per-session history / task_id / slot mapping; the conversations table is the durability layer
+session_store = SessionStore(loader=_fetch_session_state)
+
+
+@timed("supabase")
+async def _insert_conversation_rows(payloads: list[dict]) -> list[int | None]:
+    res = await supabase.table("conversations").insert(payloads).execute()
+    return [row.get("id") for row in res.data or []]
+
+
+@timed("supabase")
+async def _update_conversation_tasks(updates: list[dict]):
+    await supabase.rpc("set_conversation_tasks", {"p_updates": updates}).execute()
+
+
+# conversations rows and task_id changes are written in the background (write-behind)
+conversation_writer = ConversationWriter(
+    insert_rows=_insert_conversation_rows,
+    update_tasks=_update_conversation_tasks,
+    on_error=session_store.invalidate
+)
+
+# Every queued row is sent with the same columns (bulk inserts fill missing keys with NULL)
+CONVERSATION_COLUMNS = ("session_id", "patient_id", "doctor_id", "role", "input", "response",
+                        "input_mode", "meta", "task_id", "created_at")
+
+
+def _history_from_rows(rows: list[dict]) -> list[dict]:
+    history = []
+    for row in rows:
+        role = row["role"]
+        if role not in ("user", "assistant", "system", "tool"):
+            role = "user"
+
+        history.append({"role": role, "content": row["input"]})
+        if row.get("response"):
+            history.append({"role": "assistant", "content": row["response"]})
+    return history
+
+
+@timed("supabase")
+async def _insert_conversation_row(session_id: str, payload: dict, meta: dict | None):
+    """
+    Queue a conversations row and apply it to the cached session state right away.
+    New rows carry the session's current task_id so the latest row always reflects it.
+    """
+    state = await session_store.load(session_id)
+    if state.task_id is not None:
+        payload["task_id"] = state.task_id
+    # Rows of one batch share the transaction time, so keep the real order explicitly
+    payload["created_at"] = datetime.now(timezone.utc).isoformat()
+    row = {column: payload.get(column) for column in CONVERSATION_COLUMNS}
+
+    def on_written(row_id: int | None):
+        # Only the newest row of the session may become latest_row_id
+        if row_id is not None and state.row_count == row_count:
+            state.latest_row_id = row_id
+
+    record_row(state, payload, None, meta)
+    row_count = state.row_count
+    await session_store.save(session_id, state)
+    conversation_writer.add_row(session_id, row, on_written)
+
+
+@timed("supabase")
+async def log_conversation(
     session_id: str,
     patient_id: int | None,
     doctor_id: int | None,
@@ -751,41 +1183,42 @@ def log_conversation(
         payload["meta"] = meta
 
     try:
-        supabase.table("conversations").insert(payload).execute()
+        await _insert_conversation_row(session_id, payload, meta)
     except Exception as e:
-        print(f"[LOG ERROR] Failed to log conversation: {e}")
-        print("[PAYLOAD]", json.dumps(payload, indent=2))
+        # Keys only: the payload holds the user's message and the reply
+        log.error("Failed to log conversation for session %s: %s", session_id, e, extra={"payload_keys": sorted(payload)})
 
 
-def delete_conversations(session_id: str):
-    supabase.table("conversations").delete().eq("session_id", session_id).execute()
+@timed("supabase")
+async def delete_conversations(session_id: str):
+    await conversation_writer.flush()
+    await supabase.table("conversations").delete().eq("session_id", session_id).execute()
+    await session_store.invalidate(session_id)
 
 
-def get_memory_history(session_id: str, limit: int = 6) -> list[dict]:
-    response = supabase.table("conversations") \
-        .select("role,input,response") \
-        .eq("session_id", session_id) \
-        .order("created_at", desc=False) \
-        .limit(limit) \
-        .execute()
+@timed("supabase")
+async def get_memory_history(session_id: str, limit: int = 6) -> list[dict]:
+    if limit <= SESSION_HISTORY_ROWS:
+        state = await session_store.load(session_id)
+        data = state.rows[:limit]
+    else:
+        await conversation_writer.flush()
+        response = await supabase.table("conversations") \
+            .select("role,input,response") \
+            .eq("session_id", session_id) \
+            .order("created_at", desc=False) \
+            .limit(limit) \
+            .execute()
+        data = response.data or []
 
-    data = response.data or []
     if not data:
-        print(f"[MEMORY] No history found for session {session_id}")
+        log.debug("No history found for session %s", session_id)
 
-    history = []
-    for row in data:
-        role = row["role"]
-        if role not in ("user", "assistant", "system", "tool"):
-            role = "user"
-
-        history.append({"role": role, "content": row["input"]})
-        if row.get("response"):
-            history.append({"role": "assistant", "content": row["response"]})
-    return history
+    return _history_from_rows(data)
 
 
-def save_slot_mapping(
+@timed("supabase")
+async def save_slot_mapping(
     session_id: str,
     mapping: dict[int, int],
     patient_id: int,
@@ -811,54 +1244,58 @@ def save_slot_mapping(
         }
     }
     try:
-        supabase.table("conversations").insert(payload).execute()
-        print(f"[SLOT MAP SAVED] Mapping written for session {session_id}")
+        await _insert_conversation_row(session_id, payload, payload["meta"])
+        log.info("Slot mapping saved for session %s", session_id, extra=sampled())
     except Exception as e:
-        print(f"[SLOT MAP ERROR] Failed to save mapping: {e}")
+        log.error("Failed to save slot mapping: %s", e)
 
 
-def update_task_state(session_id: str, task_id: str | None):
+@timed("supabase")
+async def update_task_state(session_id: str, task_id: str | None):
     """
     Update the task status (task_id) of the latest record in the specified session
     """
     try:
-        resp = supabase.table("conversations") \
-            .select("id") \
-            .eq("session_id", session_id) \
-            .order("created_at", desc=True) \
-            .limit(1) \
-            .execute()
-        
-        if not resp.data or len(resp.data) == 0:
-            print(f"[TASK STATE] No conversation found for session={session_id}, skipping update.")
+        state = await session_store.load(session_id)
+
+        if state.row_count == 0:
+            log.info("No conversation found for session=%s, skipping task update", session_id)
             return
 
-        latest_id = resp.data[0]["id"]
+        # The latest row already carries this task_id
+        if state.task_id == task_id:
+            return
 
-        supabase.table("conversations") \
-            .update({ "task_id": task_id }) \
-            .eq("id", latest_id) \
-            .execute()
+        # Queued (coalesced with a pending insert when possible), written in the background
+        if not conversation_writer.set_task(session_id, task_id, state.latest_row_id):
+            resp = await supabase.table("conversations") \
+                .select("id") \
+                .eq("session_id", session_id) \
+                .order("created_at", desc=True) \
+                .limit(1) \
+                .execute()
+            if not resp.data:
+                log.info("No conversation found for session=%s, skipping task update", session_id)
+                return
+            state.latest_row_id = resp.data[0]["id"]
+            conversation_writer.set_task(session_id, task_id, state.latest_row_id)
+
+        state.task_id = task_id
+        await session_store.save(session_id, state)
 
     except Exception as e:
-        print(f"[TASK STATE ERROR] Failed to update task for session {session_id}: {e}")
+        await session_store.invalidate(session_id)
+        log.error("Failed to update task for session %s: %s", session_id, e)
 
 
-def get_session_task(session_id: str) -> str | None:
+@timed("supabase")
+async def get_session_task(session_id: str) -> str | None:
     """
     Get the task_id of the most recent round of the session for LLM prompt
     """
     try:
-        res = supabase.table("conversations") \
-            .select("task_id") \
-            .eq("session_id", session_id) \
-            .order("created_at", desc=True) \
-            .limit(1) \
-            .execute()
-        if res.data and res.data[0].get("task_id"):
-            return res.data[0]["task_id"]
+        state = await session_store.load(session_id)
+        return state.task_id
     except Exception as e:
-        print(f"[TASK STATE ERROR] Failed to fetch task_id for session {session_id}: {e}")
+        log.error("Failed to fetch task_id for session %s: %s", session_id, e)
     return None
-
-
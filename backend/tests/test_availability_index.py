@@ -0,0 +1,69 @@
+# test_availability_index.py
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from availability_index import AvailabilityIndex  # noqa: E402
+
+TOMORROW = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+
+
+def make_rows(status=0):
+    return [{
+        "id": 1,
+        "start_time": TOMORROW.isoformat(),
+        "end_time": (TOMORROW + timedelta(minutes=30)).isoformat(),
+        "status": status,
+    }]
+
+
+def test_booking_during_reload_survives_the_older_snapshot():
+    async def scenario():
+        calls = []
+        gate = asyncio.Event()
+
+        async def loader(doctor_id, start, end):
+            calls.append(doctor_id)
+            if len(calls) > 1:
+                await gate.wait()
+            return make_rows()
+
+        index = AvailabilityIndex(loader)
+        await index.get(1)
+
+        refresh = asyncio.ensure_future(index.refresh())
+        await asyncio.sleep(0)
+        # A read while the refresh is loading joins it instead of loading again
+        index._doctors[1].loaded_at = 0.0
+        read = asyncio.ensure_future(index.get(1))
+        await asyncio.sleep(0)
+        index.set_status(1, 1)
+        gate.set()
+        await refresh
+        doc = await read
+
+        assert len(calls) == 2
+        assert doc is index._doctors[1]
+        assert doc.statuses == [1]
+
+    asyncio.run(scenario())
+
+
+def test_refresh_drops_doctors_not_read_recently():
+    async def scenario():
+        async def loader(doctor_id, start, end):
+            return make_rows()
+
+        index = AvailabilityIndex(loader, idle_ttl=60)
+        await index.get(1)
+        await index.get(2)
+        index._last_read[2] -= 120
+
+        await index.refresh()
+
+        assert list(index._doctors) == [1]
+        assert await index.get(2) is not None
+
+    asyncio.run(scenario())
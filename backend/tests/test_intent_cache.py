@@ -0,0 +1,38 @@
+# test_intent_cache.py
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import intent_cache  # noqa: E402
+from intent_cache import intent_cache_key, get_cached_intent, store_intent  # noqa: E402
+
+TODAY = "2025-09-01"
+SLOT_PICK = {"action": "book_appointment", "arguments": {"slot_index": 2, "description": ""}}
+
+
+def setup_function():
+    intent_cache._cache.clear()
+
+
+def test_slot_pick_is_not_served_to_another_session():
+    message = "I'll take the 2:30 one please"
+
+    # Session A has a slot list on offer: no cache lookup, nothing stored
+    key_a = intent_cache_key(message, "patient", TODAY, "UTC", "BOOK_APPT", has_slot_mapping=True)
+    assert key_a is None
+    store_intent(key_a, SLOT_PICK)
+
+    # Even under a cacheable key, a result carrying slot_index is not stored
+    key_b = intent_cache_key(message, "patient", TODAY, "UTC", "BOOK_APPT", has_slot_mapping=False)
+    store_intent(key_b, SLOT_PICK)
+
+    assert get_cached_intent(key_b) is None
+    assert get_cached_intent(intent_cache_key(message, "patient", TODAY, "UTC", "BOOK_APPT", True)) is None
+
+
+def test_other_intents_are_still_cached():
+    key = intent_cache_key("book an appointment tomorrow morning", "patient", TODAY, "UTC", None, False)
+    intent = {"action": "book_appointment", "arguments": {"preferred_date": "2025-09-02", "preferred_time": "morning"}}
+    store_intent(key, intent)
+
+    assert get_cached_intent(key) == intent
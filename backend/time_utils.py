@@ -0,0 +1,162 @@
+# time_utils.py
+import re
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Iterable
+from zoneinfo import ZoneInfo
+
+from dateutil.parser import parse as parse_date
+
+
+# Shared timestamp / timezone helpers. PostgREST always returns ISO-8601, which
+# datetime.fromisoformat parses two orders of magnitude faster than dateutil; dateutil
+# stays as the fallback for free-form input (LLM arguments such as "July 27").
+# Parsed values and resolved timezones are cached, since the same segment times and
+# user timezones come back turn after turn.
+#
+# local_days, local_minutes and bucket_by_local_day convert whole lists of epoch
+# timestamps at once. They look up the zone's UTC offset once per 15-minute block
+# (every real DST transition falls on one) instead of building a datetime per row.
+
+PARSE_CACHE_SIZE = 65536
+
+_OFFSET_RE = re.compile(r"^([+-])(\d{2}):?(\d{2})$")
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_OFFSET_BLOCK = 900
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_iso(value: str) -> datetime:
+    """
+    ISO-8601 string → datetime (aware if the string has an offset), same result as dateutil.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parse_date(value)
+
+
+def iso_to_timestamp(value: str) -> float:
+    return parse_iso(value).timestamp()
+
+
+def iso_to_timestamps(values: Iterable[str]) -> list[float]:
+    return [parse_iso(v).timestamp() for v in values]
+
+
+def parse_day(value: str) -> date:
+    """
+    Calendar day of a date/datetime argument ("2025-07-27", "2025-07-27T13:00", "July 27").
+    """
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return parse_iso(value).date()
+
+
+@lru_cache(maxsize=512)
+def get_timezone(name: str | None) -> tzinfo:
+    """
+    IANA name ("America/Toronto") or UTC offset ("+08:00", "-0500") → tzinfo; UTC if unknown.
+    """
+    if not name:
+        return timezone.utc
+    m = _OFFSET_RE.match(name.strip())
+    if m:
+        sign = -1 if m.group(1) == "-" else 1
+        return timezone(sign * timedelta(hours=int(m.group(2)), minutes=int(m.group(3))))
+    try:
+        return ZoneInfo(name.strip())
+    except Exception:
+        return timezone.utc
+
+
+def pg_timezone(tz: tzinfo) -> str:
+    """
+    tz as a Postgres time zone name (for AT TIME ZONE / RPC p_tz arguments): the IANA key, or for a
+    fixed offset a POSIX zone such as "<+0530>-05:30". Postgres reads a bare "+05:30" or "UTC+05:30"
+    POSIX-style, i.e. as 05:30 west of UTC.
+    """
+    key = getattr(tz, "key", None)
+    if key:
+        return key
+    offset = tz.utcoffset(None) if isinstance(tz, timezone) else None
+    if offset is None:
+        return "UTC"
+    minutes = int(offset.total_seconds()) // 60
+    if minutes == 0:
+        return "UTC"
+    sign, inverse = ("+", "-") if minutes > 0 else ("-", "+")
+    hh, mm = divmod(abs(minutes), 60)
+    return f"<{sign}{hh:02d}{mm:02d}>{inverse}{hh:02d}:{mm:02d}"
+
+
+class _OffsetCache:
+    """
+    UTC offset (seconds) of one zone, memoized per 15-minute block of epoch time.
+    """
+
+    def __init__(self, tz: tzinfo):
+        self.tz = tz
+        self.fixed = tz.utcoffset(None) if isinstance(tz, timezone) else None
+        self.blocks: dict[int, int] = {}
+
+    def offset(self, ts: float) -> int:
+        if self.fixed is not None:
+            return int(self.fixed.total_seconds())
+        block = int(ts // _OFFSET_BLOCK)
+        off = self.blocks.get(block)
+        if off is None:
+            off = int(datetime.fromtimestamp(block * _OFFSET_BLOCK, self.tz).utcoffset().total_seconds())
+            self.blocks[block] = off
+        return off
+
+
+@lru_cache(maxsize=512)
+def _offsets(tz: tzinfo) -> _OffsetCache:
+    return _OffsetCache(tz)
+
+
+def utc_offset(ts: float, tz: tzinfo) -> int:
+    """
+    UTC offset of tz at epoch ts, in seconds.
+    """
+    return _offsets(tz).offset(ts)
+
+
+def local_days(timestamps: Iterable[float], tz: tzinfo) -> list[date]:
+    offsets = _offsets(tz)
+    return [date.fromordinal(_EPOCH_ORDINAL + int((ts + offsets.offset(ts)) // 86400)) for ts in timestamps]
+
+
+def local_minute(ts: float, tz: tzinfo) -> int:
+    """
+    Minute of the local day (0-1439) of one timestamp.
+    """
+    return int((ts + _offsets(tz).offset(ts)) % 86400 // 60)
+
+
+def local_minutes(timestamps: Iterable[float], tz: tzinfo) -> list[int]:
+    """
+    Minute of the local day (0-1439) of each timestamp.
+    """
+    offsets = _offsets(tz)
+    return [int((ts + offsets.offset(ts)) % 86400 // 60) for ts in timestamps]
+
+
+def bucket_by_local_day(timestamps: Iterable[float], tz: tzinfo) -> dict[date, list[int]]:
+    """
+    Positions of the timestamps grouped by local calendar day, in input order.
+    """
+    buckets: dict[date, list[int]] = {}
+    for pos, day in enumerate(local_days(timestamps, tz)):
+        buckets.setdefault(day, []).append(pos)
+    return buckets
+
+
+def format_local(value: str, tz: tzinfo, fmt: str = "%Y-%m-%d %H:%M") -> str:
+    return parse_iso(value).astimezone(tz).strftime(fmt)
+
+
+def format_local_many(values: Iterable[str], tz: tzinfo, fmt: str = "%Y-%m-%d %H:%M") -> list[str]:
+    return [parse_iso(v).astimezone(tz).strftime(fmt) for v in values]
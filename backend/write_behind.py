@@ -0,0 +1,231 @@
+# write_behind.py
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from app_logging import get_logger
+
+
+# Background persistence for conversation bookkeeping. Chat turns enqueue their
+# conversations rows and task_id changes and return immediately; a single flusher
+# writes them in batches (one multi-row insert + one task-update RPC) when the queue
+# reaches WRITE_BEHIND_MAX_BATCH or every WRITE_BEHIND_MAX_DELAY seconds.
+#
+# Read-your-writes comes from the session store, which is updated at enqueue time.
+# A session-store miss flushes first (see _fetch_session_state), so a reload from
+# the DB never misses queued rows.
+
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "100"))
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("WRITE_BEHIND_MAX_DELAY", "0.25"))
+
+log = get_logger("write_behind")
+
+WRITE_BEHIND_STATS = {
+    "rows_queued": 0,
+    "rows_written": 0,
+    "rows_failed": 0,
+    "task_updates_queued": 0,
+    "task_updates_coalesced": 0,
+    "task_updates_written": 0,
+    "flushes": 0,
+}
+
+
+@dataclass(eq=False)
+class PendingRow:
+    session_id: str
+    payload: dict
+    on_written: Callable[[int | None], None] | None = None
+    row_id: int | None = None
+    state: str = "queued"            # queued → inflight → written / failed
+
+
+class ConversationWriter:
+    """
+    Queue of conversations inserts and task_id updates, flushed in batches.
+
+    insert_rows(list[payload]) → list of inserted ids, same order
+    update_tasks(list[{id, task_id}]) → None
+    on_error(session_id) is called for sessions whose writes were lost.
+    """
+
+    def __init__(
+        self,
+        insert_rows: Callable[[list[dict]], Awaitable[list[int | None]]],
+        update_tasks: Callable[[list[dict]], Awaitable[Any]],
+        on_error: Callable[[str], Awaitable[None]] | None = None,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        max_delay: float = WRITE_BEHIND_MAX_DELAY
+    ):
+        self._insert_rows = insert_rows
+        self._update_tasks = update_tasks
+        self._on_error = on_error
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._rows: list[PendingRow] = []
+        # Newest not-yet-written row of each session
+        self._latest: dict[str, PendingRow] = {}
+        # session_id → (row id or PendingRow, task_id); last update per session wins
+        self._task_updates: dict[str, tuple[int | PendingRow, str | None]] = {}
+
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    def pending(self) -> int:
+        return len(self._rows) + len(self._task_updates)
+
+    def add_row(self, session_id: str, payload: dict, on_written: Callable[[int | None], None] | None = None) -> PendingRow:
+        row = PendingRow(session_id, payload, on_written)
+        self._rows.append(row)
+        self._latest[session_id] = row
+        WRITE_BEHIND_STATS["rows_queued"] += 1
+        self._kick()
+        return row
+
+    def set_task(self, session_id: str, task_id: str | None, latest_row_id: int | None) -> bool:
+        """
+        Set task_id on the session's latest row. Returns False when the row is unknown
+        (nothing queued and no latest_row_id), so the caller can resolve it itself.
+        """
+        row = self._latest.get(session_id)
+        if row is not None and row.state == "queued":
+            # Not sent yet: the insert simply carries the new value
+            row.payload["task_id"] = task_id
+            WRITE_BEHIND_STATS["task_updates_coalesced"] += 1
+            return True
+
+        target = row if row is not None else latest_row_id
+        if target is None:
+            return False
+        if session_id in self._task_updates:
+            WRITE_BEHIND_STATS["task_updates_coalesced"] += 1
+        self._task_updates[session_id] = (target, task_id)
+        WRITE_BEHIND_STATS["task_updates_queued"] += 1
+        self._kick()
+        return True
+
+    def _kick(self) -> None:
+        if self.pending() >= self.max_batch:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            while self._rows or self._task_updates:
+                await self._flush_once()
+                # Updates still waiting on rows of an interrupted flush are retried next time
+                if not self._rows and all(
+                    isinstance(target, PendingRow) and target.state != "written"
+                    for target, _ in self._task_updates.values()
+                ):
+                    break
+
+    async def _flush_once(self) -> None:
+        rows, self._rows = self._rows[:self.max_batch], self._rows[self.max_batch:]
+        WRITE_BEHIND_STATS["flushes"] += 1
+
+        if rows:
+            for row in rows:
+                row.state = "inflight"
+            try:
+                await self._write_rows(rows)
+            except asyncio.CancelledError:
+                # Put unfinished rows back so a later flush (e.g. the shutdown drain) sends them
+                unfinished = [r for r in rows if r.state == "inflight"]
+                for row in unfinished:
+                    row.state = "queued"
+                self._rows[:0] = unfinished
+                raise
+            for row in rows:
+                if self._latest.get(row.session_id) is row:
+                    del self._latest[row.session_id]
+
+        # Task updates whose row is still queued (beyond this batch) wait for the next round
+        ready = {}
+        for session_id, (target, task_id) in list(self._task_updates.items()):
+            if isinstance(target, PendingRow):
+                if target.state in ("queued", "inflight"):
+                    continue
+                if target.state == "failed" or target.row_id is None:
+                    del self._task_updates[session_id]
+                    continue
+                target = target.row_id
+            ready[session_id] = {"id": target, "task_id": task_id}
+            del self._task_updates[session_id]
+
+        if ready:
+            try:
+                await self._update_tasks(list(ready.values()))
+                WRITE_BEHIND_STATS["task_updates_written"] += len(ready)
+            except Exception as e:
+                log.error("Task update batch failed: %s", e)
+                for session_id in ready:
+                    await self._report(session_id)
+
+    async def _write_rows(self, rows: list[PendingRow]) -> None:
+        try:
+            ids = list(await self._insert_rows([r.payload for r in rows]))
+            results = list(zip(rows, ids + [None] * (len(rows) - len(ids))))
+        except Exception as e:
+            # One bad row must not lose the whole batch: retry them one by one
+            log.error("Batch insert of %d rows failed, retrying per row: %s", len(rows), e)
+            results = []
+            for row in rows:
+                try:
+                    ids = await self._insert_rows([row.payload])
+                    results.append((row, ids[0] if ids else None))
+                except Exception as row_error:
+                    log.error("Dropping conversations row for session %s: %s", row.session_id, row_error)
+                    row.state = "failed"
+                    WRITE_BEHIND_STATS["rows_failed"] += 1
+                    await self._report(row.session_id)
+
+        for row, row_id in results:
+            row.row_id = row_id
+            row.state = "written"
+            WRITE_BEHIND_STATS["rows_written"] += 1
+            if row.on_written:
+                row.on_written(row_id)
+
+    async def _report(self, session_id: str) -> None:
+        if self._on_error:
+            try:
+                await self._on_error(session_id)
+            except Exception as e:
+                log.error("on_error failed for session %s: %s", session_id, e)
+
+    async def run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Flush failed: %s", e)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def drain(self) -> None:
+        """
+        Stop the background flusher and write everything still queued (graceful shutdown).
+        """
+        if self._task is not None:
+            # Let the current flush finish instead of cancelling it half-way
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+
+def get_write_behind_stats(writer: ConversationWriter) -> dict:
+    return {**WRITE_BEHIND_STATS, "pending": writer.pending()}
@@ -0,0 +1,8 @@
+-- 00_roles.sql
+-- Roles PostgREST switches to. The backend's SUPABASE_KEY is a JWT with role=service_role,
+-- signed with PGRST_JWT_SECRET (see docker-compose.yml and bench.env).
+CREATE ROLE anon NOLOGIN;
+CREATE ROLE service_role NOLOGIN BYPASSRLS;
+CREATE ROLE authenticator LOGIN NOINHERIT PASSWORD 'bench';
+GRANT anon TO authenticator;
+GRANT service_role TO authenticator;
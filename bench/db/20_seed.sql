@@ -0,0 +1,33 @@
+-- 20_seed.sql
+-- Benchmark data: BENCH_DOCTORS doctors with weekday 09:00-17:00 shifts for the next 8 weeks
+-- (segments are generated by the doctor_shifts triggers), and 20 patients per doctor,
+-- each bound to one family doctor.
+-- Every account's password is "bench-password" (bcrypt, default cost 12).
+-- Logins: doctor<N>@bench.local, patient<N>@bench.local
+
+\set doctors 10
+\set patients_per_doctor 20
+
+INSERT INTO doctors_registration(fname, lname, mobilenumber, emailid, location1, city, province, country,
+                                 medical_license_number, specialization, uuid, password)
+SELECT 'Doctor', 'No' || n, '555-0' || n, 'doctor' || n || '@bench.local', '1 Bench St', 'Toronto', 'ON', 'Canada',
+       'BENCH-LIC-' || n, 'Family Medicine', gen_random_uuid()::TEXT,
+       '$2b$12$1bCZELv9DgFHd9brsSG.aOeI/OffykUErVax5S5HgO.XG0AbQnabO'
+FROM generate_series(1, :doctors) n;
+
+INSERT INTO patients_registration(fname, lname, mobilenumber, emailid, address, city, province, uuid, password)
+SELECT 'Patient', 'No' || n, '555-1' || n, 'patient' || n || '@bench.local', n || ' Bench Ave', 'Toronto', 'ON',
+       gen_random_uuid()::TEXT,
+       '$2b$12$1bCZELv9DgFHd9brsSG.aOeI/OffykUErVax5S5HgO.XG0AbQnabO'
+FROM generate_series(1, :doctors * :patients_per_doctor) n;
+
+INSERT INTO patient_doctor(patient_id, doctor_id)
+SELECT p.id, (p.id - 1) % :doctors + 1
+FROM patients_registration p;
+
+-- One statement, so the shift triggers regenerate each doctor's window once
+INSERT INTO doctor_shifts(doctor_id, start_time, end_time)
+SELECT d.id, day + TIME '09:00', day + TIME '17:00'
+FROM doctors_registration d
+CROSS JOIN generate_series(CURRENT_DATE, CURRENT_DATE + 55, INTERVAL '1 day') day
+WHERE EXTRACT(ISODOW FROM day) < 6;
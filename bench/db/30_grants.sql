@@ -0,0 +1,5 @@
+-- 30_grants.sql
+GRANT USAGE ON SCHEMA public TO anon, service_role;
+GRANT ALL ON ALL TABLES IN SCHEMA public TO service_role;
+GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO service_role;
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA public TO service_role;
@@ -0,0 +1,207 @@
+# fake_openai.py
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import time
+from datetime import date, timedelta
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+# Stand-in for the OpenAI chat completions API, just enough for llm_client.py:
+#   - requests with tools → an extract_intent tool call chosen by keyword rules on the last user message
+#   - plain requests      → a canned reply, optionally streamed as SSE chunks
+# Every response waits FAKE_OPENAI_LATENCY_MS ± FAKE_OPENAI_JITTER_MS first (streams: before the first
+# chunk, then FAKE_OPENAI_TOKEN_MS per chunk). Point the backend at it with OPENAI_BASE_URL.
+#
+# FAKE_OPENAI_INTENTS may name a JSON file of extra rules, tried before the built-in ones:
+#   [{"pattern": "reopen", "intent": {"action": "reactivate_time_segment", "arguments": {"slot_time": ""}}}]
+
+LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", "800"))
+JITTER_MS = float(os.getenv("FAKE_OPENAI_JITTER_MS", "200"))
+TOKEN_MS = float(os.getenv("FAKE_OPENAI_TOKEN_MS", "20"))
+INTENTS_FILE = os.getenv("FAKE_OPENAI_INTENTS")
+
+CANNED_REPLY = "Sure, I have taken care of that for you. Is there anything else I can help you with?"
+
+STATS = {
+    "requests": 0,
+    "tool_calls": 0,
+    "replies": 0,
+    "streams": 0,
+}
+
+_ids = itertools.count(1)
+
+
+def _next_weekday(today: date) -> date:
+    day = today + timedelta(days=1)
+    while day.isoweekday() > 5:
+        day += timedelta(days=1)
+    return day
+
+
+def _time_pref(text: str) -> str:
+    for pref in ("morning", "afternoon", "evening"):
+        if pref in text:
+            return pref
+    return "any"
+
+
+_SERIES_RE = re.compile(r"\bevery (?:other )?(mon|tues|wednes|thurs|fri|satur|sun)day\b")
+
+
+def _series(text: str, m: re.Match) -> dict:
+    time_m = re.search(r"\bat (\d{1,2})(?::(\d{2}))?\b", text)
+    count_m = re.search(r"\bfor (\d+) weeks?\b", text)
+    return {
+        "weekday": m.group(1) + "day",
+        "preferred_time": f"{int(time_m.group(1)):02d}:{time_m.group(2) or '00'}" if time_m else _time_pref(text),
+        "occurrences": int(count_m.group(1)) if count_m else 4,
+        "interval_weeks": 2 if "every other" in text else 1,
+        "start_date": "",
+        "description": "",
+    }
+
+
+def _book(text: str) -> dict:
+    return {
+        "preferred_date": _next_weekday(date.today()).isoformat(),
+        "preferred_time": _time_pref(text),
+        "days_ahead": 7 if "week" in text else 0,
+    }
+
+
+# (pattern, message → intent), first match wins
+BUILTIN_RULES = [
+    (re.compile(r"^\s*#?(\d{1,2})\b"),
+     lambda text, m: {"action": "book_appointment", "arguments": {"slot_index": int(m.group(1)), "description": ""}}),
+    (_SERIES_RE,
+     lambda text, m: {"action": "book_series", "arguments": _series(text, m)}),
+    (re.compile(r"\bcancel\b"),
+     lambda text, m: {"action": "cancel_appointment", "arguments": {"target": "next", "target_date": ""}}),
+    (re.compile(r"\breschedul"),
+     lambda text, m: {"action": "reschedule_appointment", "arguments": {"target": "next", **_book(text)}}),
+    (re.compile(r"\b(schedule|calendar|my week|my day)\b"),
+     lambda text, m: {"action": "show_my_schedule", "arguments": {}}),
+    (re.compile(r"\b(my appointments|upcoming)\b"),
+     lambda text, m: {"action": "show_appointments", "arguments": {}}),
+    (re.compile(r"\b(book|appointment|see (?:my )?doctor)\b"),
+     lambda text, m: {"action": "book_appointment", "arguments": _book(text)}),
+]
+
+
+def _load_rules() -> list:
+    rules = []
+    if INTENTS_FILE:
+        with open(INTENTS_FILE) as f:
+            for entry in json.load(f):
+                intent = entry["intent"]
+                rules.append((re.compile(entry["pattern"], re.I), lambda text, m, intent=intent: intent))
+    return rules + BUILTIN_RULES
+
+
+RULES = _load_rules()
+
+
+def classify(messages: list[dict]) -> dict:
+    text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "").lower()
+    for pattern, build in RULES:
+        m = pattern.search(text)
+        if m:
+            return build(text, m)
+    return {"action": "general_chat", "arguments": {"type": "empty"}}
+
+
+async def _delay() -> None:
+    ms = max(LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS), 0.0)
+    await asyncio.sleep(ms / 1000)
+
+
+def _envelope(model: str, obj: str) -> dict:
+    return {"id": f"chatcmpl-bench-{next(_ids)}", "object": obj, "created": int(time.time()), "model": model}
+
+
+app = FastAPI()
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4-1106-preview")
+    STATS["requests"] += 1
+
+    if body.get("stream"):
+        STATS["streams"] += 1
+        return StreamingResponse(_stream(model), media_type="text/event-stream")
+
+    await _delay()
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    if body.get("tools"):
+        STATS["tool_calls"] += 1
+        intent = classify(body.get("messages", []))
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{next(_ids)}",
+                "type": "function",
+                "function": {"name": "extract_intent", "arguments": json.dumps(intent)},
+            }],
+        }
+        finish_reason = "tool_calls"
+    else:
+        STATS["replies"] += 1
+        message = {"role": "assistant", "content": CANNED_REPLY}
+        finish_reason = "stop"
+
+    return {
+        **_envelope(model, "chat.completion"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": usage,
+    }
+
+
+async def _stream(model: str):
+    await _delay()
+    words = CANNED_REPLY.split(" ")
+    for i, word in enumerate(words):
+        chunk = {
+            **_envelope(model, "chat.completion.chunk"),
+            "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(TOKEN_MS / 1000)
+    done = {**_envelope(model, "chat.completion.chunk"), "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    yield f"data: {json.dumps(done)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stats")
+async def stats():
+    return STATS
+
+
+@app.post("/stats/reset")
+async def reset_stats():
+    for key in STATS:
+        STATS[key] = 0
+    return STATS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
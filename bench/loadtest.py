@@ -0,0 +1,247 @@
+# loadtest.py
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+
+# Drives scripted conversations against a running backend (see bench/README.md) and reports
+# latency percentiles, throughput and, from /metrics and the fake OpenAI server's /stats,
+# how many DB and LLM calls an average chat turn costs.
+#
+#   python loadtest.py --concurrency 20 --duration 60
+#   python loadtest.py --concurrency 50 --duration 120 --mix book=3,cancel=1,schedule=1 --stream
+
+PASSWORD = "bench-password"
+
+# Scenario → list of (step name, message). "{slot}" is replaced with a slot number from the previous reply.
+SCRIPTS = {
+    "book": [
+        ("book_request", "I'd like to book an appointment tomorrow morning"),
+        ("slot_choice", "{slot}"),
+    ],
+    "cancel": [
+        ("cancel", "I need to cancel my appointment"),
+    ],
+    "show": [
+        ("show_appointments", "show my appointments"),
+    ],
+    "series": [
+        ("book_series", "Book me every Thursday at 10 for 4 weeks"),
+    ],
+    "schedule": [
+        ("schedule", "What does my schedule look like?"),
+    ],
+}
+PATIENT_SCENARIOS = ("book", "cancel", "show", "series")
+DOCTOR_SCENARIOS = ("schedule",)
+
+STAGE_COUNT_RE = re.compile(r'^app_stage_duration_seconds_count\{stage="([^"]+)",.*\} (\d+)$')
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.first_byte: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.turns = 0
+
+    def add(self, step: str, seconds: float, ok: bool, ttfb: float | None = None) -> None:
+        self.latencies[step].append(seconds)
+        if ttfb is not None:
+            self.first_byte[step].append(ttfb)
+        if not ok:
+            self.errors[step] += 1
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCRIPTS:
+            raise SystemExit(f"unknown scenario {name!r}, expected one of {', '.join(SCRIPTS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+async def scrape_stage_counts(client: httpx.AsyncClient, base_url: str) -> dict[str, int]:
+    counts: dict[str, int] = defaultdict(int)
+    try:
+        res = await client.get(f"{base_url}/metrics")
+        for line in res.text.splitlines():
+            m = STAGE_COUNT_RE.match(line)
+            if m:
+                counts[m.group(1)] += int(m.group(2))
+    except httpx.HTTPError as e:
+        print(f"[LOADTEST] /metrics unavailable: {e}")
+    return counts
+
+
+async def fake_llm_stats(client: httpx.AsyncClient, openai_url: str) -> dict[str, int]:
+    try:
+        return (await client.get(f"{openai_url}/stats")).json()
+    except httpx.HTTPError as e:
+        print(f"[LOADTEST] fake OpenAI /stats unavailable: {e}")
+        return {}
+
+
+async def login(client: httpx.AsyncClient, base_url: str, email: str, rec: Recorder) -> str | None:
+    start = time.perf_counter()
+    res = await client.post(f"{base_url}/login", json={"emailid": email, "password": PASSWORD})
+    ok = res.status_code == 200
+    rec.add("login", time.perf_counter() - start, ok)
+    return res.json()["access_token"] if ok else None
+
+
+async def chat_turn(client: httpx.AsyncClient, base_url: str, token: str, session_id: str,
+                    step: str, message: str, stream: bool, rec: Recorder) -> dict:
+    body = {
+        "message": message,
+        "context": {"session_id": session_id, "input_mode": "text", "timezone": "America/Toronto"},
+        "stream": stream,
+    }
+    headers = {"Authorization": f"Bearer {token}"}
+    start = time.perf_counter()
+    rec.turns += 1
+
+    if not stream:
+        res = await client.post(f"{base_url}/chat/text", json=body, headers=headers)
+        ok = res.status_code == 200
+        rec.add(step, time.perf_counter() - start, ok)
+        return res.json() if ok else {}
+
+    # SSE: the meta event carries available_slots, time to first byte is measured on it
+    result, ttfb, event = {}, None, None
+    async with client.stream("POST", f"{base_url}/chat/text", json=body, headers=headers) as res:
+        ok = res.status_code == 200
+        async for line in res.aiter_lines():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "meta":
+                result = json.loads(line[6:])
+    rec.add(step, time.perf_counter() - start, ok, ttfb)
+    return result
+
+
+async def virtual_user(n: int, args, mix: dict[str, int], deadline: float, rec: Recorder) -> None:
+    is_doctor = args.doctor_ratio > 0 and n % round(1 / args.doctor_ratio) == 0
+    if is_doctor:
+        email = f"doctor{n % args.doctors + 1}@bench.local"
+        scenarios = [s for s in mix if s in DOCTOR_SCENARIOS]
+    else:
+        email = f"patient{n % args.patients + 1}@bench.local"
+        scenarios = [s for s in mix if s in PATIENT_SCENARIOS]
+    if not scenarios:
+        return
+    weights = [mix[s] for s in scenarios]
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        token = await login(client, args.base_url, email, rec)
+        if token is None:
+            return
+        session_id = str(uuid.uuid4())
+        while time.monotonic() < deadline:
+            scenario = random.choices(scenarios, weights)[0]
+            reply = {}
+            for step, message in SCRIPTS[scenario]:
+                if "{slot}" in message:
+                    slots = reply.get("available_slots") or []
+                    if not slots:
+                        break
+                    message = str(random.randint(1, len(slots)))
+                try:
+                    reply = await chat_turn(client, args.base_url, token, session_id, step, message, args.stream, rec)
+                except httpx.HTTPError as e:
+                    rec.add(step, args.timeout, False)
+                    print(f"[LOADTEST] {email} {step} failed: {e!r}")
+                    break
+            if args.think_time:
+                await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+
+
+def report(rec: Recorder, elapsed: float, db_calls: dict[str, int], llm_calls: dict[str, int]) -> dict:
+    steps = {}
+    print(f"\n{'step':<20}{'count':>8}{'errors':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, values in sorted(rec.latencies.items()):
+        row = {
+            "count": len(values),
+            "errors": rec.errors.get(step, 0),
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1),
+        }
+        if rec.first_byte.get(step):
+            row["ttfb_p50_ms"] = round(percentile(rec.first_byte[step], 50) * 1000, 1)
+            row["ttfb_p95_ms"] = round(percentile(rec.first_byte[step], 95) * 1000, 1)
+        steps[step] = row
+        print(f"{step:<20}{row['count']:>8}{row['errors']:>8}{row['rps']:>8}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}")
+
+    turns = max(rec.turns, 1)
+    per_turn = {stage: round(count / turns, 2) for stage, count in sorted(db_calls.items())}
+    per_turn["llm_requests"] = round(llm_calls.get("requests", 0) / turns, 2)
+    print(f"\n{rec.turns} chat turns in {elapsed:.1f}s ({rec.turns / elapsed:.1f} turns/s)")
+    print("calls per turn: " + ", ".join(f"{k}={v}" for k, v in per_turn.items()))
+    return {"elapsed_s": round(elapsed, 2), "turns": rec.turns, "steps": steps, "calls_per_turn": per_turn}
+
+
+async def run(args) -> None:
+    mix = parse_mix(args.mix)
+    rec = Recorder()
+    async with httpx.AsyncClient(timeout=10) as client:
+        before_db = await scrape_stage_counts(client, args.base_url)
+        before_llm = await fake_llm_stats(client, args.openai_url)
+
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*(virtual_user(n, args, mix, deadline, rec) for n in range(args.concurrency)))
+        elapsed = time.monotonic() - start
+
+        after_db = await scrape_stage_counts(client, args.base_url)
+        after_llm = await fake_llm_stats(client, args.openai_url)
+
+    db_calls = {stage: after_db[stage] - before_db.get(stage, 0) for stage in after_db}
+    llm_calls = {key: after_llm.get(key, 0) - before_llm.get(key, 0) for key in after_llm}
+    result = report(rec, elapsed, db_calls, llm_calls)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), **result}, f, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the chatbot backend with scripted conversations.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--openai-url", default="http://localhost:8090", help="fake OpenAI server, for LLM call counts")
+    parser.add_argument("--concurrency", type=int, default=10, help="virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--mix", default="book=3,cancel=1,show=1,schedule=1", help="scenario weights")
+    parser.add_argument("--doctor-ratio", type=float, default=0.2, help="share of virtual users logged in as doctors")
+    parser.add_argument("--patients", type=int, default=200, help="patient accounts in the seed data")
+    parser.add_argument("--doctors", type=int, default=10, help="doctor accounts in the seed data")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between conversations, seconds")
+    parser.add_argument("--stream", action="store_true", help="request streamed (SSE) replies")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="also write the results to this file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
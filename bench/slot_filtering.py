@@ -0,0 +1,84 @@
+# slot_filtering.py
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import slot_filter  # noqa: E402
+from slot_filter import as_array, match_positions  # noqa: E402
+from time_utils import get_timezone  # noqa: E402
+
+
+# Micro-benchmark for slot_filter: find the earliest N open afternoon segments among
+# M segments, compared with the per-segment datetime conversion it replaced and with
+# slot_filter's own pure-Python path (used when NumPy is not installed).
+#
+#   python slot_filtering.py --segments 20000 --limit 10 --tz America/Toronto
+
+
+def make_segments(n: int) -> tuple[list[float], list[int]]:
+    rng = random.Random(42)
+    start = datetime(2025, 9, 1, tzinfo=timezone.utc).timestamp()
+    starts = [start + 900 * i for i in range(n)]
+    statuses = [rng.choice((-1, 0, 0, 0, 1)) for _ in range(n)]
+    return starts, statuses
+
+
+def baseline(starts, statuses, tz, limit):
+    found = []
+    for pos, ts in enumerate(starts):
+        local = datetime.fromtimestamp(ts, timezone.utc).astimezone(tz)
+        if statuses[pos] == 0 and 12 <= local.hour < 17:
+            found.append(pos)
+            if len(found) >= limit:
+                break
+    return found
+
+
+def scan_all(starts, statuses, tz, limit):
+    # The realistic worst case: nothing matches early, so the loop visits every segment
+    return [pos for pos, ts in enumerate(starts)
+            if statuses[pos] == 0 and 12 <= datetime.fromtimestamp(ts, tz).hour < 17][:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark slot_filter against per-segment filtering.")
+    parser.add_argument("--segments", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--tz", default="America/Toronto")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tz = get_timezone(args.tz)
+    starts, statuses = make_segments(args.segments)
+    start_array, status_array = as_array(starts, "float64"), as_array(statuses, "int8")
+
+    def vectorized():
+        return match_positions(start_array, tz, "afternoon", status_array, (0,), args.limit)
+
+    def pure_python():
+        np, slot_filter.np = slot_filter.np, None
+        try:
+            return match_positions(starts, tz, "afternoon", statuses, (0,), args.limit)
+        finally:
+            slot_filter.np = np
+
+    assert baseline(starts, statuses, tz, args.limit) == vectorized() == pure_python(), "results differ"
+
+    cases = [("per segment, full scan", lambda: scan_all(starts, statuses, tz, args.limit)),
+             ("slot_filter, pure Python", pure_python)]
+    if slot_filter.np is not None:
+        cases.append(("slot_filter, NumPy", vectorized))
+    base_ms = None
+    print(f"{args.segments} segments, top {args.limit} open afternoon slots, tz={args.tz}, best of {args.repeat}")
+    for label, fn in cases:
+        ms = min(timeit.repeat(fn, number=1, repeat=args.repeat)) * 1000
+        base_ms = base_ms or ms
+        print(f"  {label:<26}{ms:9.2f} ms  {base_ms / ms:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
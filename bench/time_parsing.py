@@ -0,0 +1,89 @@
+# time_parsing.py
+import argparse
+import os
+import re
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from dateutil.parser import parse as parse_date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from time_utils import (  # noqa: E402
+    parse_iso, iso_to_timestamps, get_timezone, local_days, local_minutes, bucket_by_local_day
+)
+
+
+# Micro-benchmark for time_utils on a schedule-sized input: N segment rows as PostgREST
+# returns them, parsed, converted to a user timezone, bucketed by local day and filtered
+# to the afternoon, compared with the per-row dateutil + ZoneInfo code it replaced.
+#
+#   python time_parsing.py --segments 10000 --tz America/Toronto
+
+
+def make_rows(n: int) -> list[dict]:
+    start = datetime(2025, 9, 1, 9, tzinfo=timezone.utc)
+    return [
+        {"id": i, "start_time": (start + timedelta(minutes=30 * i)).isoformat()}
+        for i in range(n)
+    ]
+
+
+def old_parse_timezone(tz_str: str):
+    # parse_timezone as it was: regex + a new tz lookup on every call
+    if re.match(r"^[+-]\d{2}:\d{2}$", tz_str):
+        sign = -1 if tz_str.startswith("-") else 1
+        hours, minutes = map(int, tz_str[1:].split(":"))
+        return timezone(timedelta(hours=sign * hours, minutes=sign * minutes))
+    return ZoneInfo(tz_str)
+
+
+def baseline(rows: list[dict], tz_name: str):
+    days, afternoon = {}, []
+    for r in rows:
+        local = parse_date(r["start_time"]).astimezone(old_parse_timezone(tz_name))
+        days.setdefault(local.date(), []).append(r["id"])
+        if 12 <= local.hour < 17:
+            afternoon.append(r["id"])
+    return days, afternoon
+
+
+def optimized(rows: list[dict], tz_name: str):
+    tz = get_timezone(tz_name)
+    ts = iso_to_timestamps(r["start_time"] for r in rows)
+    days = {day: [rows[pos]["id"] for pos in positions] for day, positions in bucket_by_local_day(ts, tz).items()}
+    afternoon = [rows[pos]["id"] for pos, minute in enumerate(local_minutes(ts, tz)) if 720 <= minute < 1020]
+    return days, afternoon
+
+
+def cold(rows: list[dict], tz_name: str):
+    parse_iso.cache_clear()
+    return optimized(rows, tz_name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark time_utils against per-row dateutil parsing.")
+    parser.add_argument("--segments", type=int, default=10000)
+    parser.add_argument("--tz", default="America/Toronto")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.segments)
+    assert baseline(rows, args.tz) == optimized(rows, args.tz), "results differ"
+    # Day boundaries must agree with a per-row conversion across the DST change in the data
+    ts = iso_to_timestamps(r["start_time"] for r in rows)
+    tz = get_timezone(args.tz)
+    assert local_days(ts, tz) == [datetime.fromtimestamp(t, tz).date() for t in ts]
+
+    cases = [("dateutil per row", baseline), ("time_utils, cold cache", cold), ("time_utils, warm cache", optimized)]
+    base_ms = None
+    print(f"{args.segments} segments, tz={args.tz}, best of {args.repeat}")
+    for label, fn in cases:
+        ms = min(timeit.repeat(lambda: fn(rows, args.tz), number=1, repeat=args.repeat)) * 1000
+        base_ms = base_ms or ms
+        print(f"  {label:<24}{ms:9.1f} ms  {base_ms / ms:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
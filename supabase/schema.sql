@@ -144,6 +144,8 @@ CREATE TABLE doctor_available_time_segments (
   category SMALLINT,
   book_count INTEGER DEFAULT 0,
   description VARCHAR(255),
+  held_by INTEGER REFERENCES patients_registration(id) ON DELETE SET NULL, -- short-lived offer hold (see section 21)
+  held_until TIMESTAMPTZ,
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
   CONSTRAINT chk_time_range CHECK (end_time > start_time)
@@ -407,41 +409,8 @@ $$;
 
 
 
-    -- Insert the request and capture all returned values into local variables
-    RAISE NOTICE 'Inserting event...';
-    INSERT INTO doctor_appointment_requests(time_segment_id, doctor_id, description)
-    VALUES (p_segment_id, p_doctor_id, p_request_description)
-    RETURNING 
-        doctor_appointment_requests.id, 
-        doctor_appointment_requests.time_segment_id, 
-        doctor_appointment_requests.doctor_id, 
-        doctor_appointment_requests.description, 
-        doctor_appointment_requests.created_at
-    INTO 
-        v_request_id, 
-        v_time_segment_id, 
-        v_doctor_id, 
-        v_description, 
-        v_created_at;
-
-    -- Update the time segment status to blocked (-1)
-    UPDATE doctor_available_time_segments SET status = -1 WHERE id = p_segment_id;
-
-    RAISE NOTICE ' Event created at segment %', p_segment_id;
-
-    -- Assign values to output parameters
-    request_id := v_request_id;
-    time_segment_id := v_time_segment_id;
-    doctor_id := v_doctor_id;
-    description := v_description;
-    created_at := v_created_at;
-    
-    RETURN NEXT;
-END;
-$$;
-
 -- cancel_appointment_request_atomic 
-DROP FUNCTION cancel_appointment_request_atomic(integer,integer);
+DROP FUNCTION IF EXISTS cancel_appointment_request_atomic(integer,integer);
 CREATE OR REPLACE FUNCTION cancel_appointment_request_atomic(
     doctorid INT,
     segmentid INT
@@ -541,14 +510,16 @@ DECLARE
     v_segment_status SMALLINT;
     v_start_time TIMESTAMPTZ;
     v_doctor_id INT;
+    v_held_by INT;
+    v_held_until TIMESTAMPTZ;
     v_appointment_id INT;
     v_time_segment_id INT;
     v_return_patient_id INT;
     v_appointment_status SMALLINT;
 BEGIN
     -- 1. Row-level locking of time segment with doctor_id retrieval
-    SELECT d.status, d.start_time, d.doctor_id 
-    INTO v_segment_status, v_start_time, v_doctor_id
+    SELECT d.status, d.start_time, d.doctor_id, d.held_by, d.held_until
+    INTO v_segment_status, v_start_time, v_doctor_id, v_held_by, v_held_until
     FROM doctor_available_time_segments d
     WHERE d.id = p_segment_id 
     FOR UPDATE;
@@ -557,6 +528,11 @@ BEGIN
         RAISE EXCEPTION 'Time segment already booked or unavailable (status must be 0)';
     END IF;
 
+    -- Offered to another patient a moment ago and still held for them
+    IF v_held_by <> p_patient_id AND v_held_until > NOW() THEN
+        RAISE EXCEPTION 'SEGMENT_HELD: time segment is held for another patient';
+    END IF;
+
     -- 2. Insert appointment with doctor_id
     INSERT INTO doctor_appointment(
         doctor_id,
@@ -583,8 +559,9 @@ BEGIN
         v_return_patient_id, 
         v_appointment_status;
 
-    -- 3. Update time segment status to booked (1)
-    UPDATE doctor_available_time_segments SET status = 1 WHERE id = p_segment_id;
+    -- 3. Update time segment status to booked (1); the patient's other offered slots are released
+    UPDATE doctor_available_time_segments SET status = 1, held_by = NULL, held_until = NULL WHERE id = p_segment_id;
+    UPDATE doctor_available_time_segments SET held_by = NULL, held_until = NULL WHERE held_by = p_patient_id;
 
     -- 4. Set the output parameters
     appointment_id := v_appointment_id;
@@ -795,3 +772,926 @@ CREATE INDEX idx_audit_entity
 
 
 
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 13. Doctor schedule: one round trip per schedule view
+-- Returns segments already joined with the booked patient's name and the
+-- doctor's event description. The date range is applied on start_time so it
+-- hits idx_doctor_time instead of being filtered client-side.
+DROP FUNCTION IF EXISTS get_doctor_schedule_enriched(INT, TIMESTAMPTZ, TIMESTAMPTZ);
+
+CREATE OR REPLACE FUNCTION get_doctor_schedule_enriched(
+    p_doctor_id INT,
+    p_from TIMESTAMPTZ DEFAULT NULL,
+    p_to TIMESTAMPTZ DEFAULT NULL
+)
+RETURNS TABLE(
+    segment_id INT,
+    start_time TIMESTAMPTZ,
+    end_time TIMESTAMPTZ,
+    status SMALLINT,
+    patient TEXT,
+    event_description TEXT
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        s.id,
+        s.start_time,
+        s.end_time,
+        s.status,
+        NULLIF(TRIM(CONCAT(p.fname, ' ', p.lname)), ''),
+        r.description::TEXT
+    FROM doctor_available_time_segments s
+    LEFT JOIN LATERAL (
+        SELECT a.patient_id
+        FROM doctor_appointment a
+        WHERE a.time_segment_id = s.id AND a.status = 1
+        LIMIT 1
+    ) a ON s.status = 1
+    LEFT JOIN patients_registration p ON p.id = a.patient_id
+    LEFT JOIN LATERAL (
+        SELECT q.description
+        FROM doctor_appointment_requests q
+        WHERE q.time_segment_id = s.id AND q.status = 1
+        LIMIT 1
+    ) r ON s.status = -1
+    WHERE s.doctor_id = p_doctor_id
+      AND (p_from IS NULL OR s.start_time >= p_from)
+      AND (p_to IS NULL OR s.start_time < p_to)
+    ORDER BY s.start_time;
+$$;
+
+-- Event lookup by segment (only active events are joined)
+CREATE INDEX IF NOT EXISTS idx_request_segment_active
+  ON doctor_appointment_requests(time_segment_id) WHERE status = 1;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 14. Appointment lookups with status / time range pushed down
+-- find_matching_appointments, show_appointments, get_patient_appointments and
+-- get_doctor_appointments filter on (owner, status, appointment_time).
+CREATE INDEX IF NOT EXISTS idx_appointment_doctor_status_time
+  ON doctor_appointment(doctor_id, status, appointment_time);
+CREATE INDEX IF NOT EXISTS idx_appointment_patient_status_time
+  ON doctor_appointment(patient_id, status, appointment_time);
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 15. Availability search: preferred day(s), nearest later day and global earliest in one query
+-- Resolves the patient's active family doctor and returns ranked rows tagged by bucket:
+--   'doctor'    → one row with the doctor's id and name (segment columns NULL)
+--   'preferred' → open segments on p_preferred_date .. p_preferred_date + p_window_days
+--   'later'     → open segments on the first later day (within p_later_days) that has any
+--   'earliest'  → the earliest open segments from now (within p_horizon_days)
+-- Days and time-of-day preference are evaluated in the user's timezone p_tz (IANA name).
+-- Section 22 redefines it to serve the 'earliest' bucket from doctor_next_available.
+DROP FUNCTION IF EXISTS search_available_segments(INT, DATE, TEXT, TEXT, INT, INT, INT, INT);
+
+CREATE OR REPLACE FUNCTION search_available_segments(
+    p_patient_id INT,
+    p_preferred_date DATE DEFAULT NULL,
+    p_time_pref TEXT DEFAULT NULL,
+    p_tz TEXT DEFAULT 'UTC',
+    p_window_days INT DEFAULT 0,
+    p_later_days INT DEFAULT 5,
+    p_topn INT DEFAULT 5,
+    p_horizon_days INT DEFAULT 60
+)
+RETURNS TABLE(
+    bucket TEXT,
+    segment_id INT,
+    doctor_id INT,
+    start_time TIMESTAMPTZ,
+    end_time TIMESTAMPTZ,
+    local_day DATE,
+    doctor_fname TEXT,
+    doctor_lname TEXT
+)
+LANGUAGE sql STABLE AS $$
+    WITH doc AS (
+        SELECT d.id, d.fname::TEXT AS fname, d.lname::TEXT AS lname
+        FROM patient_doctor pd
+        JOIN doctors_registration d ON d.id = pd.doctor_id
+        WHERE pd.patient_id = p_patient_id
+          AND pd.relationship_status = 'active'
+        LIMIT 1
+    ),
+    candidates AS (
+        SELECT
+            s.id,
+            s.doctor_id,
+            s.start_time,
+            s.end_time,
+            (s.start_time AT TIME ZONE p_tz)::DATE AS local_day
+        FROM doctor_available_time_segments s
+        JOIN doc ON s.doctor_id = doc.id
+        WHERE s.status = 0
+          AND (s.held_until IS NULL OR s.held_until <= NOW() OR s.held_by = p_patient_id)
+          AND s.start_time >= NOW()
+          AND s.start_time < GREATEST(
+                NOW() + make_interval(days => p_horizon_days),
+                COALESCE((p_preferred_date + GREATEST(p_window_days, 0) + GREATEST(p_later_days, 1) + 2)::TIMESTAMPTZ, NOW())
+              )
+          AND CASE lower(trim(COALESCE(p_time_pref, '')))
+                WHEN 'morning'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) < 12
+                WHEN 'afternoon' THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 12 AND 16
+                WHEN 'evening'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 17 AND 20
+                ELSE TRUE
+              END
+    ),
+    preferred AS (
+        SELECT c.* FROM candidates c
+        WHERE p_preferred_date IS NOT NULL
+          AND c.local_day BETWEEN p_preferred_date AND p_preferred_date + GREATEST(p_window_days, 0)
+        ORDER BY c.start_time
+        LIMIT p_topn
+    ),
+    later AS (
+        SELECT c.* FROM candidates c
+        WHERE c.local_day = (
+            SELECT MIN(c2.local_day) FROM candidates c2
+            WHERE p_preferred_date IS NOT NULL
+              AND c2.local_day > p_preferred_date
+              AND c2.local_day <= p_preferred_date + GREATEST(p_later_days, 1)
+        )
+        ORDER BY c.start_time
+        LIMIT p_topn
+    ),
+    earliest AS (
+        SELECT c.* FROM candidates c
+        WHERE c.start_time < NOW() + make_interval(days => p_horizon_days)
+        ORDER BY c.start_time
+        LIMIT p_topn
+    )
+    SELECT 'doctor', NULL::INT, doc.id, NULL::TIMESTAMPTZ, NULL::TIMESTAMPTZ, NULL::DATE, doc.fname, doc.lname FROM doc
+    UNION ALL
+    SELECT 'preferred', p.id, p.doctor_id, p.start_time, p.end_time, p.local_day, NULL, NULL FROM preferred p
+    UNION ALL
+    SELECT 'later', l.id, l.doctor_id, l.start_time, l.end_time, l.local_day, NULL, NULL FROM later l
+    UNION ALL
+    SELECT 'earliest', e.id, e.doctor_id, e.start_time, e.end_time, e.local_day, NULL, NULL FROM earliest e;
+$$;
+
+-- Open segments by doctor + time (availability searches only look at status = 0)
+CREATE INDEX IF NOT EXISTS idx_segments_open_doctor_time
+  ON doctor_available_time_segments(doctor_id, start_time) WHERE status = 0;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 16. Segment generation from doctor_shifts
+-- Expands shifts into fixed-length doctor_available_time_segments in one set-based statement.
+-- Overlapping shifts of the same doctor are merged first, and a generated segment is skipped
+-- if it overlaps any existing segment of that doctor (whatever its status).
+DROP FUNCTION IF EXISTS generate_segments_from_shifts(INT[], TIMESTAMPTZ, TIMESTAMPTZ, INT);
+
+CREATE OR REPLACE FUNCTION generate_segments_from_shifts(
+    p_doctor_ids INT[] DEFAULT NULL,              -- NULL = every doctor with shifts
+    p_from TIMESTAMPTZ DEFAULT NOW(),
+    p_to TIMESTAMPTZ DEFAULT NOW() + INTERVAL '4 weeks',
+    p_segment_minutes INT DEFAULT 30
+)
+RETURNS TABLE(doctor_id INT, segments_created INT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH merged AS (
+        SELECT m.doctor_id, lower(r) AS range_start, upper(r) AS range_end
+        FROM (
+            SELECT sh.doctor_id, range_agg(tstzrange(sh.start_time, sh.end_time)) AS ranges
+            FROM doctor_shifts sh
+            WHERE (p_doctor_ids IS NULL OR sh.doctor_id = ANY(p_doctor_ids))
+              AND sh.end_time > p_from
+              AND sh.start_time < p_to
+            GROUP BY sh.doctor_id
+        ) m
+        CROSS JOIN LATERAL unnest(m.ranges) AS r
+    ),
+    slots AS (
+        SELECT mg.doctor_id, g AS start_time, g + make_interval(mins => p_segment_minutes) AS end_time
+        FROM merged mg
+        CROSS JOIN LATERAL generate_series(
+            mg.range_start,
+            mg.range_end - make_interval(mins => p_segment_minutes),
+            make_interval(mins => p_segment_minutes)
+        ) AS g
+        WHERE g >= p_from AND g < p_to
+    ),
+    inserted AS (
+        INSERT INTO doctor_available_time_segments(doctor_id, start_time, end_time, status)
+        SELECT s.doctor_id, s.start_time, s.end_time, 0
+        FROM slots s
+        -- Segments of a doctor never overlap, so only the last one starting before
+        -- this slot ends can collide with it (single index probe on doctor_id, start_time)
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM (
+                SELECT e.end_time
+                FROM doctor_available_time_segments e
+                WHERE e.doctor_id = s.doctor_id
+                  AND e.start_time < s.end_time
+                ORDER BY e.start_time DESC
+                LIMIT 1
+            ) prev
+            WHERE prev.end_time > s.start_time
+        )
+        RETURNING doctor_available_time_segments.doctor_id AS doctor_id
+    )
+    SELECT i.doctor_id, COUNT(*)::INT FROM inserted i GROUP BY i.doctor_id;
+END;
+$$;
+
+
+-- Reference lookups by segment (any status) for the clean-up below and for FK cascades
+CREATE INDEX IF NOT EXISTS idx_appointment_segment ON doctor_appointment(time_segment_id);
+CREATE INDEX IF NOT EXISTS idx_request_segment ON doctor_appointment_requests(time_segment_id);
+
+
+-- Incremental re-generation for one doctor and window, used when shifts change:
+-- open segments in the window that are no longer covered by a shift (and were never
+-- referenced by an appointment or event) are removed, then the window is re-expanded.
+DROP FUNCTION IF EXISTS regenerate_doctor_segments(INT, TIMESTAMPTZ, TIMESTAMPTZ, INT);
+
+CREATE OR REPLACE FUNCTION regenerate_doctor_segments(
+    p_doctor_id INT,
+    p_from TIMESTAMPTZ,
+    p_to TIMESTAMPTZ,
+    p_segment_minutes INT DEFAULT 30
+)
+RETURNS JSONB
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_removed INT;
+    v_created INT;
+BEGIN
+    DELETE FROM doctor_available_time_segments s
+    WHERE s.doctor_id = p_doctor_id
+      AND s.status = 0
+      AND s.start_time >= p_from
+      AND s.start_time < p_to
+      AND NOT EXISTS (
+          SELECT 1 FROM doctor_shifts sh
+          WHERE sh.doctor_id = p_doctor_id
+            AND sh.start_time <= s.start_time
+            AND sh.end_time >= s.end_time
+      )
+      AND NOT EXISTS (SELECT 1 FROM doctor_appointment a WHERE a.time_segment_id = s.id)
+      AND NOT EXISTS (SELECT 1 FROM doctor_appointment_requests q WHERE q.time_segment_id = s.id);
+    GET DIAGNOSTICS v_removed = ROW_COUNT;
+
+    SELECT COALESCE(SUM(g.segments_created), 0) INTO v_created
+    FROM generate_segments_from_shifts(ARRAY[p_doctor_id], p_from, p_to, p_segment_minutes) g;
+
+    RETURN jsonb_build_object('doctor_id', p_doctor_id, 'removed', v_removed, 'created', v_created);
+END;
+$$;
+
+
+-- Keep segments in step with shift edits: each statement on doctor_shifts re-generates the
+-- affected doctor windows once (statement-level, so bulk shift loads stay set-based).
+-- Postgres allows transition tables on single-event triggers only, hence three triggers.
+CREATE OR REPLACE FUNCTION trg_shifts_regenerate_segments()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        FOR r IN
+            SELECT n.doctor_id, MIN(n.start_time) AS window_start, MAX(n.end_time) AS window_end
+            FROM new_shifts n GROUP BY n.doctor_id
+        LOOP
+            PERFORM regenerate_doctor_segments(r.doctor_id, r.window_start, r.window_end);
+        END LOOP;
+    ELSIF TG_OP = 'DELETE' THEN
+        FOR r IN
+            SELECT o.doctor_id, MIN(o.start_time) AS window_start, MAX(o.end_time) AS window_end
+            FROM old_shifts o GROUP BY o.doctor_id
+        LOOP
+            PERFORM regenerate_doctor_segments(r.doctor_id, r.window_start, r.window_end);
+        END LOOP;
+    ELSE
+        FOR r IN
+            SELECT c.doctor_id, MIN(c.start_time) AS window_start, MAX(c.end_time) AS window_end
+            FROM (
+                SELECT n.doctor_id, n.start_time, n.end_time FROM new_shifts n
+                UNION ALL
+                SELECT o.doctor_id, o.start_time, o.end_time FROM old_shifts o
+            ) c
+            GROUP BY c.doctor_id
+        LOOP
+            PERFORM regenerate_doctor_segments(r.doctor_id, r.window_start, r.window_end);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_shifts_segments_ins ON doctor_shifts;
+DROP TRIGGER IF EXISTS trg_shifts_segments_upd ON doctor_shifts;
+DROP TRIGGER IF EXISTS trg_shifts_segments_del ON doctor_shifts;
+
+CREATE TRIGGER trg_shifts_segments_ins
+AFTER INSERT ON doctor_shifts
+REFERENCING NEW TABLE AS new_shifts
+FOR EACH STATEMENT EXECUTE FUNCTION trg_shifts_regenerate_segments();
+
+CREATE TRIGGER trg_shifts_segments_upd
+AFTER UPDATE ON doctor_shifts
+REFERENCING OLD TABLE AS old_shifts NEW TABLE AS new_shifts
+FOR EACH STATEMENT EXECUTE FUNCTION trg_shifts_regenerate_segments();
+
+CREATE TRIGGER trg_shifts_segments_del
+AFTER DELETE ON doctor_shifts
+REFERENCING OLD TABLE AS old_shifts
+FOR EACH STATEMENT EXECUTE FUNCTION trg_shifts_regenerate_segments();
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 17. Account lookup for login
+-- Resolves an email to its account and role in one round trip. Doctors take precedence,
+-- as in the former doctor-then-patient lookup; each branch is an index lookup on EmailId.
+DROP FUNCTION IF EXISTS get_account_by_email(TEXT);
+
+CREATE OR REPLACE FUNCTION get_account_by_email(p_emailid TEXT)
+RETURNS TABLE(
+    role TEXT,
+    id INT,
+    uuid TEXT,
+    emailid TEXT,
+    password TEXT,
+    fname TEXT,
+    lname TEXT
+)
+LANGUAGE sql STABLE AS $$
+    SELECT a.role, a.id, a.uuid, a.emailid, a.password, a.fname, a.lname
+    FROM (
+        SELECT 'doctor'::TEXT AS role, 0 AS priority, d.id, d.uuid::TEXT, d.emailid::TEXT,
+               d.password::TEXT, d.fname::TEXT, d.lname::TEXT
+        FROM doctors_registration d
+        WHERE d.emailid = p_emailid
+        UNION ALL
+        SELECT 'patient'::TEXT, 1, p.id, p.uuid::TEXT, p.emailid::TEXT,
+               p.password::TEXT, p.fname::TEXT, p.lname::TEXT
+        FROM patients_registration p
+        WHERE p.emailid = p_emailid
+    ) a
+    ORDER BY a.priority
+    LIMIT 1;
+$$;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 18. Batched task_id updates for the conversation write-behind queue
+-- p_updates: [{"id": <conversations.id>, "task_id": <text or null>}, ...]
+DROP FUNCTION IF EXISTS set_conversation_tasks(JSONB);
+
+CREATE OR REPLACE FUNCTION set_conversation_tasks(p_updates JSONB)
+RETURNS INT
+LANGUAGE sql AS $$
+    WITH updated AS (
+        UPDATE conversations c
+        SET task_id = u.task_id
+        FROM jsonb_to_recordset(p_updates) AS u(id INT, task_id TEXT)
+        WHERE c.id = u.id
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INT FROM updated;
+$$;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 19. Series booking: several segments for one patient, all or nothing
+-- Recurring appointments ("every Tuesday at 10 for 6 weeks") in one transaction and one round trip.
+-- Segments are locked in id order, so overlapping series (and single bookings, which lock one row)
+-- always take their row locks in the same order and cannot deadlock. A missing or non-open segment
+-- aborts the call with SERIES_SEGMENT_NOT_AVAILABLE: <ids>, and nothing is booked.
+DROP FUNCTION IF EXISTS book_series_atomic(INT, INT[]);
+
+CREATE OR REPLACE FUNCTION book_series_atomic(
+    p_patient_id INT,
+    p_segment_ids INT[]
+)
+RETURNS TABLE(
+    appointment_id INT,
+    time_segment_id INT,
+    appointment_time TIMESTAMPTZ,
+    status SMALLINT
+)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_ids INT[];
+    v_unavailable INT[];
+BEGIN
+    SELECT array_agg(DISTINCT s.id ORDER BY s.id) INTO v_ids
+    FROM unnest(p_segment_ids) AS s(id)
+    WHERE s.id IS NOT NULL;
+
+    IF v_ids IS NULL THEN
+        RAISE EXCEPTION 'SERIES_EMPTY';
+    END IF;
+
+    -- 1. Row-level locks on every segment, in id order
+    PERFORM 1
+    FROM doctor_available_time_segments d
+    WHERE d.id = ANY(v_ids)
+    ORDER BY d.id
+    FOR UPDATE;
+
+    -- 2. Every segment must exist, be open and not be held for another patient
+    SELECT array_agg(s.id ORDER BY s.id) INTO v_unavailable
+    FROM unnest(v_ids) AS s(id)
+    LEFT JOIN doctor_available_time_segments d ON d.id = s.id
+    WHERE d.id IS NULL OR d.status <> 0
+       OR (d.held_by <> p_patient_id AND d.held_until > NOW());
+
+    IF v_unavailable IS NOT NULL THEN
+        RAISE EXCEPTION 'SERIES_SEGMENT_NOT_AVAILABLE: %', array_to_string(v_unavailable, ',');
+    END IF;
+
+    -- 3. One insert for the appointments, one update for the segments
+    RETURN QUERY
+    INSERT INTO doctor_appointment AS a (doctor_id, time_segment_id, patient_id, appointment_time, status)
+    SELECT d.doctor_id, d.id, p_patient_id, d.start_time, 1
+    FROM doctor_available_time_segments d
+    WHERE d.id = ANY(v_ids)
+    ORDER BY d.start_time
+    RETURNING a.appointment_id, a.time_segment_id, a.appointment_time, a.status;
+
+    UPDATE doctor_available_time_segments d SET status = 1, held_by = NULL, held_until = NULL WHERE d.id = ANY(v_ids);
+    UPDATE doctor_available_time_segments d SET held_by = NULL, held_until = NULL WHERE d.held_by = p_patient_id;
+END;
+$$;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 20. Range blocking / reactivation of a doctor's calendar
+-- Every segment of p_doctor_id starting in [p_from, p_to), optionally only those in a time of day
+-- (p_time_pref 'morning' / 'afternoon' / 'evening' in p_tz, same boundaries as search_available_segments),
+-- is changed with set-based statements in one transaction. Rows are locked in id order like
+-- book_series_atomic. Both return a summary instead of per-segment rows:
+--   {"changed": n, "segment_ids": [...], "booked": n, "unchanged": n, "first_start": ts, "last_end": ts}
+-- booked = segments with a patient appointment, which are never touched; unchanged = already in the
+-- target state. first_start / last_end cover the changed segments.
+DROP FUNCTION IF EXISTS block_time_range(INT, TIMESTAMPTZ, TIMESTAMPTZ, TEXT, TEXT, TEXT);
+DROP FUNCTION IF EXISTS reactivate_time_range(INT, TIMESTAMPTZ, TIMESTAMPTZ, TEXT, TEXT);
+DROP FUNCTION IF EXISTS lock_range_segments(INT, TIMESTAMPTZ, TIMESTAMPTZ, TEXT, TEXT);
+
+-- The segments in the range, locked in id order
+CREATE OR REPLACE FUNCTION lock_range_segments(
+    p_doctor_id INT,
+    p_from TIMESTAMPTZ,
+    p_to TIMESTAMPTZ,
+    p_time_pref TEXT,
+    p_tz TEXT
+)
+RETURNS TABLE(id INT, status SMALLINT, start_time TIMESTAMPTZ, end_time TIMESTAMPTZ)
+LANGUAGE sql AS $$
+    SELECT s.id, s.status, s.start_time, s.end_time
+    FROM doctor_available_time_segments s
+    WHERE s.doctor_id = p_doctor_id
+      AND s.start_time >= p_from
+      AND s.start_time < p_to
+      AND CASE lower(trim(COALESCE(p_time_pref, '')))
+            WHEN 'morning'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) < 12
+            WHEN 'afternoon' THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 12 AND 16
+            WHEN 'evening'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 17 AND 20
+            ELSE TRUE
+          END
+    ORDER BY s.id
+    FOR UPDATE;
+$$;
+
+-- Block: a confirmed doctor event (doctor_appointment_requests, status 1) per open segment, segment → -1
+CREATE OR REPLACE FUNCTION block_time_range(
+    p_doctor_id INT,
+    p_from TIMESTAMPTZ,
+    p_to TIMESTAMPTZ,
+    p_time_pref TEXT DEFAULT NULL,
+    p_tz TEXT DEFAULT 'UTC',
+    p_description TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_ids INT[];
+    v_booked INT;
+    v_unchanged INT;
+    v_first TIMESTAMPTZ;
+    v_last TIMESTAMPTZ;
+BEGIN
+    SELECT array_agg(r.id ORDER BY r.start_time) FILTER (WHERE r.status = 0),
+           COUNT(*) FILTER (WHERE r.status = 1),
+           COUNT(*) FILTER (WHERE r.status = -1),
+           MIN(r.start_time) FILTER (WHERE r.status = 0),
+           MAX(r.end_time) FILTER (WHERE r.status = 0)
+    INTO v_ids, v_booked, v_unchanged, v_first, v_last
+    FROM lock_range_segments(p_doctor_id, p_from, p_to, p_time_pref, p_tz) r;
+
+    IF v_ids IS NOT NULL THEN
+        INSERT INTO doctor_appointment_requests(time_segment_id, doctor_id, description, status)
+        SELECT u.id, p_doctor_id, p_description, 1
+        FROM unnest(v_ids) AS u(id);
+
+        UPDATE doctor_available_time_segments SET status = -1 WHERE id = ANY(v_ids);
+    END IF;
+
+    RETURN jsonb_build_object(
+        'changed', COALESCE(cardinality(v_ids), 0),
+        'segment_ids', COALESCE(to_jsonb(v_ids), '[]'::JSONB),
+        'booked', v_booked,
+        'unchanged', v_unchanged,
+        'first_start', v_first,
+        'last_end', v_last
+    );
+END;
+$$;
+
+-- Reactivate: blocked segments → 0, their active doctor events are cancelled
+CREATE OR REPLACE FUNCTION reactivate_time_range(
+    p_doctor_id INT,
+    p_from TIMESTAMPTZ,
+    p_to TIMESTAMPTZ,
+    p_time_pref TEXT DEFAULT NULL,
+    p_tz TEXT DEFAULT 'UTC'
+)
+RETURNS JSONB
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_ids INT[];
+    v_booked INT;
+    v_unchanged INT;
+    v_first TIMESTAMPTZ;
+    v_last TIMESTAMPTZ;
+BEGIN
+    SELECT array_agg(r.id ORDER BY r.start_time) FILTER (WHERE r.status = -1),
+           COUNT(*) FILTER (WHERE r.status = 1),
+           COUNT(*) FILTER (WHERE r.status = 0),
+           MIN(r.start_time) FILTER (WHERE r.status = -1),
+           MAX(r.end_time) FILTER (WHERE r.status = -1)
+    INTO v_ids, v_booked, v_unchanged, v_first, v_last
+    FROM lock_range_segments(p_doctor_id, p_from, p_to, p_time_pref, p_tz) r;
+
+    IF v_ids IS NOT NULL THEN
+        UPDATE doctor_appointment_requests
+        SET status = -1, updated_at = NOW()
+        WHERE time_segment_id = ANY(v_ids) AND doctor_id = p_doctor_id AND status = 1;
+
+        UPDATE doctor_available_time_segments SET status = 0, updated_at = NOW() WHERE id = ANY(v_ids);
+    END IF;
+
+    RETURN jsonb_build_object(
+        'changed', COALESCE(cardinality(v_ids), 0),
+        'segment_ids', COALESCE(to_jsonb(v_ids), '[]'::JSONB),
+        'booked', v_booked,
+        'unchanged', v_unchanged,
+        'first_start', v_first,
+        'last_end', v_last
+    );
+END;
+$$;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 21. Short-lived slot holds
+-- Slots offered to a patient are held for them (held_by / held_until) while they pick one, so
+-- another patient's search skips them and book_appointment_atomic / book_series_atomic reject
+-- them. Status stays 0: a hold is only in effect while held_until > NOW(), so an expired hold
+-- needs no cleanup to stop counting. release_expired_slot_holds clears the leftovers.
+
+-- Holds p_segment_ids (open, and not held by someone else) for p_patient_id for p_ttl_seconds,
+-- releasing the patient's previous holds first: one set of offered slots per patient at a time.
+-- Returns the segments actually held.
+CREATE OR REPLACE FUNCTION hold_segments(
+    p_patient_id INT,
+    p_segment_ids INT[],
+    p_ttl_seconds INT DEFAULT 300
+)
+RETURNS TABLE(segment_id INT, held_until TIMESTAMPTZ)
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE doctor_available_time_segments d
+    SET held_by = NULL, held_until = NULL
+    WHERE d.held_by = p_patient_id
+      AND NOT (d.id = ANY(p_segment_ids));
+
+    RETURN QUERY
+    UPDATE doctor_available_time_segments d
+    SET held_by = p_patient_id,
+        held_until = NOW() + make_interval(secs => p_ttl_seconds)
+    WHERE d.id = ANY(p_segment_ids)
+      AND d.status = 0
+      AND (d.held_until IS NULL OR d.held_until <= NOW() OR d.held_by = p_patient_id)
+    RETURNING d.id, d.held_until;
+END;
+$$;
+
+-- Clears expired holds; returns how many were cleared
+CREATE OR REPLACE FUNCTION release_expired_slot_holds()
+RETURNS INT
+LANGUAGE sql AS $$
+    WITH released AS (
+        UPDATE doctor_available_time_segments
+        SET held_by = NULL, held_until = NULL
+        WHERE held_until IS NOT NULL
+          AND held_until <= NOW()
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INT FROM released;
+$$;
+
+-- Only held rows are indexed, so the sweep and the per-patient release stay cheap
+CREATE INDEX IF NOT EXISTS idx_segments_held_until
+  ON doctor_available_time_segments(held_until) WHERE held_until IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_segments_held_by
+  ON doctor_available_time_segments(held_by) WHERE held_by IS NOT NULL;
+
+
+-- ──────────────────────────────────────────────────────────────────────────
+-- 22. Each doctor's next open segments, kept up to date by triggers
+-- doctor_next_available holds the earliest next_available_depth() open (status 0) future segments of
+-- every doctor, so "earliest slots" reads a handful of rows by primary key instead of filtering
+-- doctor_available_time_segments. Statement-level triggers on the segments table rebuild a doctor's
+-- rows only when a change reaches them: a listed segment stops being open or moves, or a newly open
+-- segment starts before the last listed one (or the list is short). That covers book / cancel /
+-- create_request / reactivate, the range RPCs and segment generation alike.
+-- Rows whose start_time has passed are ignored by readers and dropped by roll_next_available().
+CREATE TABLE IF NOT EXISTS doctor_next_available (
+  doctor_id INTEGER NOT NULL REFERENCES doctors_registration(id) ON DELETE CASCADE,
+  start_time TIMESTAMPTZ NOT NULL,
+  segment_id INTEGER NOT NULL REFERENCES doctor_available_time_segments(id) ON DELETE CASCADE,
+  end_time TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (doctor_id, start_time, segment_id)
+);
+
+CREATE OR REPLACE FUNCTION next_available_depth()
+RETURNS INT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT 20;
+$$;
+
+-- Rebuilds one doctor's rows. The advisory lock serializes concurrent rebuilds of the same doctor;
+-- each statement after it sees the other transaction's committed rows.
+CREATE OR REPLACE FUNCTION refresh_doctor_next_available(p_doctor_id INT)
+RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('doctor_next_available'), p_doctor_id);
+
+    DELETE FROM doctor_next_available WHERE doctor_id = p_doctor_id;
+
+    INSERT INTO doctor_next_available (doctor_id, start_time, segment_id, end_time)
+    SELECT s.doctor_id, s.start_time, s.id, s.end_time
+    FROM doctor_available_time_segments s
+    WHERE s.doctor_id = p_doctor_id
+      AND s.status = 0
+      AND s.start_time >= NOW()
+    ORDER BY s.start_time, s.id
+    LIMIT next_available_depth();
+END;
+$$;
+
+-- Whether a segment that is now open at p_start_time belongs in the doctor's list
+CREATE OR REPLACE FUNCTION next_available_admits(p_doctor_id INT, p_status SMALLINT, p_start_time TIMESTAMPTZ)
+RETURNS BOOLEAN
+LANGUAGE sql STABLE AS $$
+    SELECT p_status = 0
+       AND p_start_time >= NOW()
+       AND (
+            (SELECT COUNT(*) FROM doctor_next_available a WHERE a.doctor_id = p_doctor_id) < next_available_depth()
+            OR p_start_time <= (SELECT MAX(a.start_time) FROM doctor_next_available a WHERE a.doctor_id = p_doctor_id)
+       );
+$$;
+
+CREATE OR REPLACE FUNCTION trg_segments_next_available()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_doctor_ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT n.doctor_id) INTO v_doctor_ids
+        FROM new_rows n
+        WHERE next_available_admits(n.doctor_id, n.status, n.start_time);
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT a.doctor_id) INTO v_doctor_ids
+        FROM old_rows o
+        JOIN doctor_next_available a ON a.doctor_id = o.doctor_id AND a.segment_id = o.id;
+    ELSE
+        -- Only status / time changes matter (not holds, descriptions, book_count)
+        WITH changed AS (
+            SELECT o.id, o.doctor_id AS old_doctor_id, n.doctor_id, n.status, n.start_time
+            FROM old_rows o
+            JOIN new_rows n ON n.id = o.id
+            WHERE o.status IS DISTINCT FROM n.status
+               OR o.start_time IS DISTINCT FROM n.start_time
+               OR o.end_time IS DISTINCT FROM n.end_time
+        )
+        SELECT array_agg(DISTINCT d.doctor_id) INTO v_doctor_ids
+        FROM (
+            SELECT a.doctor_id
+            FROM changed c
+            JOIN doctor_next_available a ON a.doctor_id = c.old_doctor_id AND a.segment_id = c.id
+            UNION ALL
+            SELECT c.doctor_id
+            FROM changed c
+            WHERE next_available_admits(c.doctor_id, c.status, c.start_time)
+        ) d;
+    END IF;
+
+    -- In doctor order, so concurrent multi-doctor statements take the advisory locks in the same order
+    PERFORM refresh_doctor_next_available(d)
+    FROM unnest(v_doctor_ids) AS d
+    ORDER BY d;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_segments_next_available_ins ON doctor_available_time_segments;
+DROP TRIGGER IF EXISTS trg_segments_next_available_upd ON doctor_available_time_segments;
+DROP TRIGGER IF EXISTS trg_segments_next_available_del ON doctor_available_time_segments;
+
+CREATE TRIGGER trg_segments_next_available_ins
+AFTER INSERT ON doctor_available_time_segments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_segments_next_available();
+
+CREATE TRIGGER trg_segments_next_available_upd
+AFTER UPDATE ON doctor_available_time_segments
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_segments_next_available();
+
+CREATE TRIGGER trg_segments_next_available_del
+AFTER DELETE ON doctor_available_time_segments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_segments_next_available();
+
+-- Rebuilds the doctors whose list has rows in the past; returns how many were rebuilt
+CREATE OR REPLACE FUNCTION roll_next_available()
+RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_doctor_ids INT[];
+BEGIN
+    SELECT array_agg(DISTINCT doctor_id ORDER BY doctor_id) INTO v_doctor_ids
+    FROM doctor_next_available
+    WHERE start_time < NOW();
+
+    PERFORM refresh_doctor_next_available(d)
+    FROM unnest(v_doctor_ids) AS d
+    ORDER BY d;
+
+    RETURN COALESCE(array_length(v_doctor_ids, 1), 0);
+END;
+$$;
+
+-- Earliest p_limit open future segments of a doctor, optionally in a time of day (in p_tz) and
+-- leaving out slots held for other patients. Answered from doctor_next_available when its rows
+-- contain p_limit matches (they are a prefix of the open segments, so those are the earliest);
+-- otherwise from the segments table.
+CREATE OR REPLACE FUNCTION next_available_segments(
+    p_doctor_id INT,
+    p_limit INT DEFAULT 5,
+    p_time_pref TEXT DEFAULT NULL,
+    p_tz TEXT DEFAULT 'UTC',
+    p_patient_id INT DEFAULT NULL
+)
+RETURNS TABLE(
+    segment_id INT,
+    doctor_id INT,
+    start_time TIMESTAMPTZ,
+    end_time TIMESTAMPTZ
+)
+LANGUAGE sql STABLE AS $$
+    WITH listed AS MATERIALIZED (
+        SELECT a.segment_id, a.doctor_id, a.start_time, a.end_time
+        FROM doctor_next_available a
+        WHERE a.doctor_id = p_doctor_id
+          AND a.start_time >= NOW()
+    ),
+    cached AS (
+        SELECT a.segment_id, a.doctor_id, a.start_time, a.end_time
+        FROM listed a
+        JOIN doctor_available_time_segments s ON s.id = a.segment_id
+        WHERE s.status = 0
+          AND (s.held_until IS NULL OR s.held_until <= NOW() OR s.held_by = p_patient_id)
+          AND CASE lower(trim(COALESCE(p_time_pref, '')))
+                WHEN 'morning'   THEN EXTRACT(HOUR FROM a.start_time AT TIME ZONE p_tz) < 12
+                WHEN 'afternoon' THEN EXTRACT(HOUR FROM a.start_time AT TIME ZONE p_tz) BETWEEN 12 AND 16
+                WHEN 'evening'   THEN EXTRACT(HOUR FROM a.start_time AT TIME ZONE p_tz) BETWEEN 17 AND 20
+                ELSE TRUE
+              END
+        ORDER BY a.start_time
+        LIMIT p_limit
+    ),
+    scanned AS (
+        SELECT s.id, s.doctor_id, s.start_time, s.end_time
+        FROM doctor_available_time_segments s
+        WHERE (SELECT COUNT(*) FROM cached) < p_limit
+          AND s.doctor_id = p_doctor_id
+          AND s.status = 0
+          AND s.start_time >= NOW()
+          AND (s.held_until IS NULL OR s.held_until <= NOW() OR s.held_by = p_patient_id)
+          AND CASE lower(trim(COALESCE(p_time_pref, '')))
+                WHEN 'morning'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) < 12
+                WHEN 'afternoon' THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 12 AND 16
+                WHEN 'evening'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 17 AND 20
+                ELSE TRUE
+              END
+        ORDER BY s.start_time
+        LIMIT p_limit
+    )
+    SELECT * FROM cached WHERE (SELECT COUNT(*) FROM cached) >= p_limit
+    UNION ALL
+    SELECT * FROM scanned
+    ORDER BY 3;
+$$;
+
+-- search_available_segments (section 15) with the 'earliest' bucket read through next_available_segments
+CREATE OR REPLACE FUNCTION search_available_segments(
+    p_patient_id INT,
+    p_preferred_date DATE DEFAULT NULL,
+    p_time_pref TEXT DEFAULT NULL,
+    p_tz TEXT DEFAULT 'UTC',
+    p_window_days INT DEFAULT 0,
+    p_later_days INT DEFAULT 5,
+    p_topn INT DEFAULT 5,
+    p_horizon_days INT DEFAULT 60
+)
+RETURNS TABLE(
+    bucket TEXT,
+    segment_id INT,
+    doctor_id INT,
+    start_time TIMESTAMPTZ,
+    end_time TIMESTAMPTZ,
+    local_day DATE,
+    doctor_fname TEXT,
+    doctor_lname TEXT
+)
+LANGUAGE sql STABLE AS $$
+    WITH doc AS (
+        SELECT d.id, d.fname::TEXT AS fname, d.lname::TEXT AS lname
+        FROM patient_doctor pd
+        JOIN doctors_registration d ON d.id = pd.doctor_id
+        WHERE pd.patient_id = p_patient_id
+          AND pd.relationship_status = 'active'
+        LIMIT 1
+    ),
+    candidates AS (
+        SELECT
+            s.id,
+            s.doctor_id,
+            s.start_time,
+            s.end_time,
+            (s.start_time AT TIME ZONE p_tz)::DATE AS local_day
+        FROM doctor_available_time_segments s
+        JOIN doc ON s.doctor_id = doc.id
+        WHERE s.status = 0
+          AND (s.held_until IS NULL OR s.held_until <= NOW() OR s.held_by = p_patient_id)
+          AND s.start_time >= NOW()
+          AND s.start_time < GREATEST(
+                NOW() + make_interval(days => p_horizon_days),
+                COALESCE((p_preferred_date + GREATEST(p_window_days, 0) + GREATEST(p_later_days, 1) + 2)::TIMESTAMPTZ, NOW())
+              )
+          AND CASE lower(trim(COALESCE(p_time_pref, '')))
+                WHEN 'morning'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) < 12
+                WHEN 'afternoon' THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 12 AND 16
+                WHEN 'evening'   THEN EXTRACT(HOUR FROM s.start_time AT TIME ZONE p_tz) BETWEEN 17 AND 20
+                ELSE TRUE
+              END
+    ),
+    preferred AS (
+        SELECT c.* FROM candidates c
+        WHERE p_preferred_date IS NOT NULL
+          AND c.local_day BETWEEN p_preferred_date AND p_preferred_date + GREATEST(p_window_days, 0)
+        ORDER BY c.start_time
+        LIMIT p_topn
+    ),
+    later AS (
+        SELECT c.* FROM candidates c
+        WHERE c.local_day = (
+            SELECT MIN(c2.local_day) FROM candidates c2
+            WHERE p_preferred_date IS NOT NULL
+              AND c2.local_day > p_preferred_date
+              AND c2.local_day <= p_preferred_date + GREATEST(p_later_days, 1)
+        )
+        ORDER BY c.start_time
+        LIMIT p_topn
+    ),
+    earliest AS (
+        SELECT n.segment_id AS id, n.doctor_id, n.start_time, n.end_time, (n.start_time AT TIME ZONE p_tz)::DATE AS local_day
+        FROM doc, next_available_segments(doc.id, p_topn, p_time_pref, p_tz, p_patient_id) n
+        WHERE n.start_time < NOW() + make_interval(days => p_horizon_days)
+    )
+    SELECT 'doctor', NULL::INT, doc.id, NULL::TIMESTAMPTZ, NULL::TIMESTAMPTZ, NULL::DATE, doc.fname, doc.lname FROM doc
+    UNION ALL
+    SELECT 'preferred', p.id, p.doctor_id, p.start_time, p.end_time, p.local_day, NULL, NULL FROM preferred p
+    UNION ALL
+    SELECT 'later', l.id, l.doctor_id, l.start_time, l.end_time, l.local_day, NULL, NULL FROM later l
+    UNION ALL
+    SELECT 'earliest', e.id, e.doctor_id, e.start_time, e.end_time, e.local_day, NULL, NULL FROM earliest e;
+$$;
+
+-- Fill for existing doctors
+SELECT refresh_doctor_next_available(id) FROM doctors_registration;